@@ -0,0 +1,43 @@
+'''Shared helpers for the benchmarks
+
+Run with pytest-benchmark, e.g.
+
+    python -m pytest benchmarks --benchmark-columns=mean,stddev,rounds
+
+Steps per second, points per second and peak memory are shown in the
+"extra_info" of each benchmark (use --benchmark-json to save them and
+compare versions with pytest-benchmark compare).'''
+import sys
+import pytest
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_memory():
+    '''Peak resident set size of this process in bytes, or None if not
+    available'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on Mac OS X
+    if sys.platform == 'darwin':
+        return rss
+    return 1024*rss
+
+@pytest.fixture
+def report(benchmark):
+    '''Returns a function to call after the benchmark has run, to record
+    rates per second of points and ODE steps for one call of the
+    benchmarked function'''
+    def _report(points=None,steps=None):
+        mean = benchmark.stats.stats.mean
+        if points is not None:
+            benchmark.extra_info['points'] = points
+            benchmark.extra_info['points_per_second'] = points / mean
+        if steps is not None:
+            benchmark.extra_info['steps'] = steps
+            benchmark.extra_info['steps_per_second'] = steps / mean
+        benchmark.extra_info['peak_memory'] = peak_memory()
+    return _report
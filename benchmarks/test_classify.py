@@ -0,0 +1,32 @@
+'''Benchmarks of the discreteness test'''
+import cp1
+import numpy
+import pytest
+
+from cp1.t11 import markov_z
+
+# Triples far from and near to the boundary of the discreteness locus
+# (the second is close to a group with a parabolic element)
+TRIPLES = {
+    'hex': (3.0, 3.0, 3.0),
+    'nearparabolic': (2.01+0.01j, 3.0, markov_z(2.01+0.01j, 3.0)),
+    'indiscrete': (0.5, 2.0, 2.0),
+    }
+
+@pytest.mark.parametrize( ("name"), sorted(TRIPLES))
+def test_classify(benchmark,report,name):
+    res, nodes = benchmark(cp1.classify,*TRIPLES[name])
+    benchmark.extra_info['nodes'] = nodes
+    report(points=1)
+
+def test_classify_many(benchmark,report):
+    N = 1000
+    xyz = numpy.array([ TRIPLES[name] for name in sorted(TRIPLES) ] * N)
+    benchmark(cp1.classify_many,xyz,threads=1)
+    report(points=len(xyz))
+
+def test_classify_many_bounded(benchmark,report):
+    N = 1000
+    xyz = numpy.array([ TRIPLES[name] for name in sorted(TRIPLES) ] * N)
+    benchmark(cp1.classify_many,xyz,threads=1,node_budget=20)
+    report(points=len(xyz))
@@ -0,0 +1,66 @@
+'''Benchmarks of ODE integration'''
+import cp1
+from cp1.pcint import pcint
+import pytest
+
+# Reference points from cp1/test/test_s04.py
+POINTS = {
+    'hex': (0.5 + 0.86602540378443864676j, -0.57735026918962576451j),
+    'square': (0.5, 0.0),
+    'largeC': (0.5 + 0.86602540378443864676j, 2.0 + 3.0j - (0.5 + 0.86602540378443864676j)),
+    'extreme': (0.00001 + 0.00001j, 0.5 + 0.3j - (0.00001 + 0.00001j)),
+    }
+
+@pytest.mark.parametrize( ("method"), ['rk8pd', 'magnus4', 'magnus6'])
+def test_seg_int(benchmark,report,method):
+    p = pcint(atol=1e-8, method=method)
+    args = (0.5, 0.1+0.2j, -0.5+0.5j, 1.5+0.5j)
+    p.seg_int(*args)
+    steps = p.nsteps
+    benchmark(p.seg_int,*args)
+    report(points=1,steps=steps)
+
+def test_seg_int_sl2c(benchmark,report):
+    # Result written in place, without allocating
+    p = pcint(atol=1e-8)
+    args = (0.5, 0.1+0.2j, -0.5+0.5j, 1.5+0.5j)
+    m = cp1.SL2C()
+    p.seg_int(*args,out=m)
+    steps = p.nsteps
+    benchmark(p.seg_int,*args,out=m)
+    report(points=1,steps=steps)
+
+@pytest.mark.parametrize( ("contour_mode"), ['rectangular', 'clearance'])
+@pytest.mark.parametrize( ("method"), ['rk8pd', 'magnus6'])
+@pytest.mark.parametrize( ("name"), sorted(POINTS))
+def test_s04_traces(benchmark,report,name,method,contour_mode):
+    L, C = POINTS[name]
+    h = cp1.S04(L,contours=3,tol=1e-8,method=method,contour_mode=contour_mode)
+    h.traces(C)
+    steps = h._pcint.nsteps
+    benchmark(h.traces,C)
+    report(points=1,steps=steps)
+
+def test_s04_traces_many(benchmark,report):
+    L = 0.5
+    Cs = [ 0.01*k*(1+1j) for k in range(32) ]
+    h = cp1.S04(L,contours=3,tol=1e-8)
+    h.traces_many(Cs)
+    steps = h._pcint.nsteps
+    benchmark(h.traces_many,Cs)
+    report(points=len(Cs),steps=steps)
+
+# Points spread over the upper half plane, including some far from the
+# fundamental domain
+TAUS = [ complex(0.37*k - 3.0, 0.05 + 0.04*k) for k in range(20) ]
+
+def test_s04_tau_hol(benchmark,report):
+    def run():
+        for tau in TAUS:
+            cp1.s04_tau_hol(tau,0.0)
+    benchmark(run)
+    report(points=len(TAUS))
+
+def test_s04_tau_hol_many(benchmark,report):
+    benchmark(cp1.s04_tau_hol_many,TAUS,0.0)
+    report(points=len(TAUS))
@@ -0,0 +1,24 @@
+'''Benchmarks of slice rendering'''
+import cp1.slice
+import pytest
+
+# Square torus slice centered on the Fuchsian point, slightly larger
+# than the Bers embedding (as in examples/simple-bers-slice.py)
+L = 0.5
+CENTER = 0.0
+RADIUS = 0.16
+SHAPE = (32,32)
+
+@pytest.mark.parametrize( ("threads"), [1, None])
+def test_classify_grid(benchmark,report,threads):
+    benchmark(cp1.slice.classify_grid,L,CENTER,RADIUS,SHAPE,threads=threads)
+    report(points=SHAPE[0]*SHAPE[1])
+
+def test_classify_quadtree(benchmark,report):
+    benchmark(cp1.slice.classify_quadtree,L,CENTER,RADIUS,SHAPE,cell=8,threads=1)
+    report(points=SHAPE[0]*SHAPE[1])
+
+def test_classify_adaptive(benchmark,report):
+    C = cp1.slice.grid_points(CENTER,RADIUS,SHAPE)
+    benchmark(cp1.slice.classify_adaptive,L,C,tols=(1e-5,1e-8),threads=1)
+    report(points=SHAPE[0]*SHAPE[1])
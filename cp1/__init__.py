@@ -1,6 +1,7 @@
 from cp1.s04 import *
 from cp1.t11 import *
 from cp1.bowditch import *
+from cp1.pcint import modularlambda, modularlambda_many, SL2C
 
 __version__ = '0.0.2'
 __author__ = 'David Dumas'
@@ -0,0 +1,5 @@
+'''Run the command line interface, see cp1.cli'''
+import sys
+from cp1.cli import main
+
+sys.exit(main())
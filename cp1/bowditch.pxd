@@ -0,0 +1,24 @@
+from gsl_complex cimport *
+
+cdef enum rep_type:
+    cREP_DISCRETE = 1
+    cREP_INDISCRETE = 0
+    cREP_UNCERTAIN = 128
+
+ctypedef struct tree_node:
+    gsl_complex x
+    gsl_complex y
+    gsl_complex z
+    int depth
+
+ctypedef struct tree_stack:
+    tree_node *nodes
+    int n
+    int cap
+
+cdef rep_type mtdiscrete(gsl_complex x, gsl_complex y, gsl_complex z, int *nodecount) nogil
+cdef rep_type mtdiscretesplit(gsl_complex x, gsl_complex y, gsl_complex z,
+                              int *sinksteps, int *treenodes) nogil
+cdef rep_type mtdiscretebounded(gsl_complex x, gsl_complex y, gsl_complex z,
+                                int node_budget, double time_limit,
+                                int *sinksteps, int *treenodes, int *depth) nogil
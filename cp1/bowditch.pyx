@@ -3,6 +3,12 @@
 
 from gsl_complex cimport *
 from libc.math cimport fabs
+from libc.stdlib cimport realloc, free
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+cimport cython
+
+import numpy
+from cp1.parallel import run_chunks
 
 #cdef extern from "math.h":
 #    double fabs(double x) nogil
@@ -12,19 +18,20 @@ cdef int MAX_DEPTH=30000
 cdef double BOWDITCH_THRESHOLD=0.0001
 cdef double JORGENSEN_THRESHOLD=0.9999
 cdef double HUGE_TRACE=1.0e11
+# Number of nodes between checks of the clock in a bounded search
+cdef int CLOCK_INTERVAL=64
 
 # Status codes for best guess about representation's properties
 # Discrete really means "In Bowditch set, did not see any Jorgensen violations along the way"
 # Indiscrete means "Found a violation of Jorgensen's inequality, therefore not discrete"
-cdef enum rep_type:
-    cREP_DISCRETE = 1
-    cREP_INDISCRETE = 0
-    cREP_UNCERTAIN = 128
-
 REP_DISCRETE = 1
 REP_INDISCRETE = 0
 REP_UNCERTAIN = 128
 
+# Trace sizes at which the tests change their outcome
+JORGENSEN_LIMIT = JORGENSEN_THRESHOLD
+BOWDITCH_LIMIT = 3.0 + BOWDITCH_THRESHOLD
+
 cdef double bowditch_H(gsl_complex x) nogil:
     cdef double labs
 
@@ -37,6 +44,16 @@ cdef double bowditch_H(gsl_complex x) nogil:
     return fabs(2.0 * (labs + 1.0) / ((labs - 1.0)))
 
 
+cdef inline double _now() nogil:
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + 1e-9*ts.tv_nsec
+
+cdef inline int _out_of_time(double deadline, int count) nogil:
+    # Whether a deadline (0 for none) has passed, checking the clock
+    # only every CLOCK_INTERVAL counts
+    return deadline > 0.0 and count % CLOCK_INTERVAL == 0 and _now() > deadline
+
 cdef int edge_in_tree(gsl_complex x, gsl_complex y) nogil:
     if (gsl_complex_abs (x) <= (BOWDITCH_THRESHOLD + 3.0)) and \
        (gsl_complex_abs (y) <= (BOWDITCH_THRESHOLD + 1.0 + bowditch_H (x))):
@@ -49,84 +66,213 @@ cdef int edge_in_tree(gsl_complex x, gsl_complex y) nogil:
     return 0
 
 #----------------------------------------------------------------------#
-# mtdiscreterec(x,y,z,nodecount,depth)                                 #
+# mtdiscretetree(stack,nodecount)                                      #
+#                                                                      #
+# This is the core of the discreteness algorithm.  It looks through    #
+# the oriented Farey graph corresponding to the triples on the stack,  #
+# depth first.  If the Jorgensen inequality is violated at any stage,  #
+# the group is judged indiscrete.                                      #
 #                                                                      #
-# This is the recursive core of the discreteness algorithm.  It looks  #
-# through the oriented Farey graph corresponding to (x,y,z).  If the   #
-# Jorgensen inequality is violated at any stage, the group is judged   #
-# indiscrete.                                                          #
+# The search uses an explicit stack on the heap rather than recursion, #
+# so deep trees cannot overflow the C stack.  Nodes are visited in the #
+# same order as by a recursive search.                                 #
 #                                                                      #
 # RETURN: status code indicating discrete, indiscrete, or failure      #
-#         if not NULL, number of nodes visited returned in *nodecount  #
+#         if not NULL, number of nodes visited added to *nodecount     #
 #----------------------------------------------------------------------#
 
-cdef rep_type mtdiscreterec (gsl_complex x, gsl_complex y, gsl_complex z, int *nodecount, int depth) nogil:
-    cdef int edge_added
-    cdef rep_type r1, r2
+cdef int tree_push(tree_stack *st, gsl_complex x, gsl_complex y, gsl_complex z, int depth) nogil:
+    cdef tree_node *newnodes
+    if st.n == st.cap:
+        newnodes = <tree_node *>realloc(st.nodes, 2*(st.cap+32)*sizeof(tree_node))
+        if newnodes == NULL:
+            return -1
+        st.nodes = newnodes
+        st.cap = 2*(st.cap+32)
+    st.nodes[st.n].x = x
+    st.nodes[st.n].y = y
+    st.nodes[st.n].z = z
+    st.nodes[st.n].depth = depth
+    st.n = st.n + 1
+    return 0
 
-    if depth > MAX_DEPTH: 
-       # Fail due to max depth
+cdef rep_type mtdiscretetree(tree_stack *st, int *nodecount) nogil:
+    cdef gsl_complex x, y, z
+    cdef int depth
+    cdef int uncertain = 0
+
+    while st.n > 0:
+        st.n = st.n - 1
+        x = st.nodes[st.n].x
+        y = st.nodes[st.n].y
+        z = st.nodes[st.n].z
+        depth = st.nodes[st.n].depth
+
+        if depth > MAX_DEPTH:
+            # Fail due to max depth
+            uncertain = 1
+            continue
+
+        if gsl_complex_abs (x) < JORGENSEN_THRESHOLD:
+            # Jorgensen violation => indiscrete
+            return cREP_INDISCRETE
+
+        if (gsl_complex_abs(x) + gsl_complex_abs(y) + gsl_complex_abs(z)) > HUGE_TRACE:
+            uncertain = 1
+            continue
+
+        if nodecount != NULL:
+            nodecount[0] = nodecount[0] + 1
+
+        # Queue each direction not yet explored.  The subtree across
+        # (x,z) is pushed last so that it is investigated first.
+        if edge_in_tree(x,y):
+            if tree_push(st, gsl_complex_sub(gsl_complex_mul(x, y), z), x, y, depth+1) != 0:
+                return cREP_UNCERTAIN
+
+        if edge_in_tree(x,z):
+            if tree_push(st, gsl_complex_sub(gsl_complex_mul(x, z), y), z, x, depth+1) != 0:
+                return cREP_UNCERTAIN
+
+    if uncertain:
+        # Undecided somewhere, and no certificate of indiscreteness found.
         return cREP_UNCERTAIN
 
-    if gsl_complex_abs (x) < JORGENSEN_THRESHOLD:
-        # Jorgensen violation => indiscrete
-        return cREP_INDISCRETE
+    return cREP_DISCRETE
 
-    if (gsl_complex_abs(x) + gsl_complex_abs(y) + gsl_complex_abs(z)) > HUGE_TRACE:
-        return cREP_UNCERTAIN
+#----------------------------------------------------------------------#
+# mtdiscretetreebfs(queue,budget,deadline,nodecount,depthdone)         #
+#                                                                      #
+# As mtdiscretetree, but breadth first, treating the stack as a queue  #
+# and giving up when more than budget nodes (if budget >= 0) would be  #
+# examined or the clock passes deadline (if positive).  Because every  #
+# level of the tree is finished before the next is started, a search   #
+# which is cut short has still examined the whole tree to some depth.  #
+#                                                                      #
+# RETURN: status code indicating discrete, indiscrete, or failure      #
+#         if not NULL, number of nodes visited added to *nodecount     #
+#         number of tree levels examined completely in *depthdone      #
+#----------------------------------------------------------------------#
 
-    if nodecount != NULL:
-        nodecount[0] = nodecount[0] + 1
+cdef rep_type mtdiscretetreebfs(tree_stack *st, int budget, double deadline,
+                                int *nodecount, int *depthdone) nogil:
+    cdef gsl_complex x, y, z
+    cdef int depth
+    cdef int head = 0
+    cdef int count = 0
+    cdef int uncertain = 0
 
-    # For each direction not yet explored, call mtdiscreterec to
-    # investigate that subtree.  If definite indiscreteness is 
-    # indicated, return immediately.  Otherwise keep searching.
+    depthdone[0] = 0
+    while head < st.n:
+        x = st.nodes[head].x
+        y = st.nodes[head].y
+        z = st.nodes[head].z
+        depth = st.nodes[head].depth
 
-    r1 = cREP_DISCRETE
-    r2 = cREP_DISCRETE
+        # All nodes at lower depths have been examined
+        depthdone[0] = depth - 1
 
-    if edge_in_tree(x,z):
-        r1 = mtdiscreterec (gsl_complex_sub(gsl_complex_mul(x, z), y), z, x,nodecount,depth+1)
-        if r1 == cREP_INDISCRETE:
-            return r1
+        if (budget >= 0 and count >= budget) or _out_of_time(deadline, count):
+            return cREP_UNCERTAIN
+        head = head + 1
 
-    if edge_in_tree(x,y):
-        r2 = mtdiscreterec(gsl_complex_sub(gsl_complex_mul(x, y), z), x, y,nodecount,depth+1)
-        if r2 == cREP_INDISCRETE:
-            return r2
+        if depth > MAX_DEPTH:
+            uncertain = 1
+            continue
+
+        if gsl_complex_abs (x) < JORGENSEN_THRESHOLD:
+            return cREP_INDISCRETE
+
+        if (gsl_complex_abs(x) + gsl_complex_abs(y) + gsl_complex_abs(z)) > HUGE_TRACE:
+            uncertain = 1
+            continue
+
+        count = count + 1
+        if nodecount != NULL:
+            nodecount[0] = nodecount[0] + 1
+
+        if edge_in_tree(x,z):
+            if tree_push(st, gsl_complex_sub(gsl_complex_mul(x, z), y), z, x, depth+1) != 0:
+                return cREP_UNCERTAIN
+
+        if edge_in_tree(x,y):
+            if tree_push(st, gsl_complex_sub(gsl_complex_mul(x, y), z), x, y, depth+1) != 0:
+                return cREP_UNCERTAIN
 
-    if (r1 == cREP_UNCERTAIN) or (r2 == cREP_UNCERTAIN):
-        # Were undecided before, and no certificate of indiscreteness found later.
+    if st.n > 0:
+        depthdone[0] = st.nodes[st.n-1].depth
+
+    if uncertain:
         return cREP_UNCERTAIN
 
     return cREP_DISCRETE
 
 #----------------------------------------------------------------------#
-# mtdiscrete(x,y,z,nodecount)                                          #
+# mtdiscretesplit(x,y,z,sinksteps,treenodes)                           #
 #                                                                      #
 # External interface to the discreteness algorithm.  First look for a  #
-# sink, and begin investigating the Farey tree from there using the    #
-# recursive procedure mtdiscreterec.                                   #
+# sink, and begin investigating the Farey tree from there using       #
+# mtdiscretetree.                                                      #
 #                                                                      #
 # RETURN: status code indicating discrete, indiscrete, or failure      #
-#         if not NULL, number of nodes visited returned in *nodecount  #
+#         if not NULL, number of steps taken to find the sink returned #
+#         in *sinksteps, and number of tree nodes in *treenodes        #
 #----------------------------------------------------------------------#
 
 cdef rep_type mtdiscrete(gsl_complex x, gsl_complex y, gsl_complex z, int *nodecount) nogil:
+    # As mtdiscretesplit, returning the total count in *nodecount
+    cdef int sinksteps = 0
+    cdef int treenodes = 0
+    cdef rep_type res = mtdiscretesplit(x, y, z, &sinksteps, &treenodes)
+    if nodecount != NULL:
+        nodecount[0] = sinksteps + treenodes
+    return res
+
+cdef rep_type mtdiscretesplit(gsl_complex x, gsl_complex y, gsl_complex z,
+                              int *sinksteps, int *treenodes) nogil:
+    return _mtdiscrete(x, y, z, -1, 0.0, 0, sinksteps, treenodes, NULL)
+
+cdef rep_type mtdiscretebounded(gsl_complex x, gsl_complex y, gsl_complex z,
+                                int node_budget, double time_limit,
+                                int *sinksteps, int *treenodes, int *depth) nogil:
+    # As mtdiscretesplit, but examining at most node_budget nodes (sink
+    # steps and tree nodes together; no limit if negative) for at most
+    # time_limit seconds (no limit if zero or negative), searching the
+    # tree breadth first.  The number of tree levels examined
+    # completely is returned in *depth.
+    cdef double deadline = 0.0
+    if time_limit > 0.0:
+        deadline = _now() + time_limit
+    return _mtdiscrete(x, y, z, node_budget, deadline, 1, sinksteps, treenodes, depth)
+
+cdef rep_type _mtdiscrete(gsl_complex x, gsl_complex y, gsl_complex z,
+                          int budget, double deadline, int bfs,
+                          int *sinksteps, int *treenodes, int *depth) nogil:
     cdef gsl_complex w, t
-    cdef rep_type r1, r2, r3
     cdef int n = 0
     cdef int sink = 0
-
-    if nodecount != NULL:
-        nodecount[0] = 0
+    cdef int maxsteps = MAX_STEP_TO_SINK
+    cdef int depthdone = 0
+    cdef int stopped = 0
+
+    if sinksteps != NULL:
+        sinksteps[0] = 0
+    if treenodes != NULL:
+        treenodes[0] = 0
+    if depth != NULL:
+        depth[0] = 0
+    if budget >= 0 and budget < maxsteps:
+        maxsteps = budget
 
     # ----------------------------------------------------------------------
     # 1. LOCATE SINK
     # ----------------------------------------------------------------------
 
     w = gsl_complex_rect (3.0, 0.0)
-    while (n < MAX_STEP_TO_SINK) and (gsl_complex_abs(w) > JORGENSEN_THRESHOLD) and (sink < 3):
+    while (n < maxsteps) and (gsl_complex_abs(w) > JORGENSEN_THRESHOLD) and (sink < 3):
+        if _out_of_time(deadline, n):
+            stopped = 1
+            break
         n = n + 1
         w = gsl_complex_sub( gsl_complex_mul(y, z), x)
         if gsl_complex_abs(w) < gsl_complex_abs(x):
@@ -139,14 +285,19 @@ cdef rep_type mtdiscrete(gsl_complex x, gsl_complex y, gsl_complex z, int *nodec
         y = z
         z = t
 
-    if nodecount != NULL:
-        nodecount[0] = nodecount[0] + n
+    if (n >= maxsteps) and (gsl_complex_abs(w) > JORGENSEN_THRESHOLD) and (sink < 3):
+        # Only a step limit ended the search
+        stopped = 1
+
+    if sinksteps != NULL:
+        sinksteps[0] = n
 
     if gsl_complex_abs(w) < JORGENSEN_THRESHOLD:
         return cREP_INDISCRETE
 
-    if n >= MAX_STEP_TO_SINK:
-        # Failure to find sink is fatal.  Give up.
+    if n >= MAX_STEP_TO_SINK or stopped:
+        # Failure to find sink (within MAX_STEP_TO_SINK steps, or
+        # within the budget or time limit) is fatal.  Give up.
         return cREP_UNCERTAIN
 
     # At this point we know a sink was found successfully.
@@ -162,36 +313,56 @@ cdef rep_type mtdiscrete(gsl_complex x, gsl_complex y, gsl_complex z, int *nodec
 
 
     # ----------------------------------------------------------------------
-    # 3. RECURSIVE CALLS
+    # 3. TREE SEARCH
     # ----------------------------------------------------------------------
 
-    # If no edges are examined, we will fall back to this default return value
-    r1 = cREP_DISCRETE
-    r2 = cREP_DISCRETE
-    r3 = cREP_DISCRETE
+    # Subtrees across the edges (x,y), (x,z), (y,z), to be investigated
+    # in that order.  If no edges are examined, the result is discrete.
+    cdef tree_stack st
+    cdef rep_type res
+    st.nodes = NULL
+    st.n = 0
+    st.cap = 0
 
+    res = cREP_DISCRETE
+    if edge_in_tree(y,z):
+        if tree_push(&st, gsl_complex_sub(gsl_complex_mul(y, z), x), y, z, 1) != 0:
+            res = cREP_UNCERTAIN
+    if edge_in_tree(x,z):
+        if tree_push(&st, gsl_complex_sub(gsl_complex_mul(x, z), y), z, x, 1) != 0:
+            res = cREP_UNCERTAIN
     if edge_in_tree(x,y):
-        r1 = mtdiscreterec(gsl_complex_sub(gsl_complex_mul(x, y), z), x, y, nodecount, 1)
-        if r1 == cREP_INDISCRETE:
-            return r1
+        if tree_push(&st, gsl_complex_sub(gsl_complex_mul(x, y), z), x, y, 1) != 0:
+            res = cREP_UNCERTAIN
+
+    if res == cREP_DISCRETE:
+        if bfs:
+            if budget >= 0:
+                budget = budget - n
+            res = mtdiscretetreebfs(&st, budget, deadline, treenodes, &depthdone)
+            if depth != NULL:
+                depth[0] = depthdone
+        else:
+            res = mtdiscretetree(&st, treenodes)
+    free(st.nodes)
+    return res
 
-    if edge_in_tree(x,z):
-        r2 = mtdiscreterec(gsl_complex_sub(gsl_complex_mul(x, z), y), z, x, nodecount, 1)
-        if r2 == cREP_INDISCRETE:
-            return r2
 
-    if edge_in_tree(y,z):
-        r3 = mtdiscreterec (gsl_complex_sub(gsl_complex_mul(y, z), x), y, z, nodecount, 1)
-        if r3 == cREP_INDISCRETE:
-            return r3
-
-    if (r1 == cREP_UNCERTAIN) or (r2 == cREP_UNCERTAIN) or (r3 == cREP_UNCERTAIN):
-        return cREP_UNCERTAIN
-    
-    return cREP_DISCRETE
+cdef int _budget(node_budget) except -2:
+    # Node budget as passed to mtdiscretebounded (negative for none)
+    if node_budget is None:
+        return -1
+    if node_budget < 0:
+        raise ValueError('Node budget must be nonnegative, got %d.' % node_budget)
+    return node_budget
 
+def _triple(args):
+    try:
+        return [ complex(t) for t in args ]
+    except TypeError:
+        return [ complex(t) for t in args[0] ]
 
-def classify(*args):
+def classify(*args, node_budget=None, time_limit=None):
     '''Classify a representation as discrete, indiscrete, or undecided
     using Bowditch+Jorgensen test.
 
@@ -203,14 +374,14 @@ def classify(*args):
 
     x**2 + y**2 + z**2 == x*y*z
 
+    If node_budget or time_limit (seconds) is given, the search gives
+    up with REP_UNCERTAIN after examining that many nodes or after
+    that time, as for classify_bounded().
+
     Returns REP_DISCRETE, REP_INDISCRETE, or REP_UNCERTAIN
     '''
+    x,y,z = _triple(args)
 
-    try:
-        x,y,z = [ complex(t) for t in args ]
-    except TypeError:
-        x,y,z = [ complex(t) for t in args[0] ]
-        
     cdef int nodecount
     cdef rep_type res
     cdef gsl_complex cx, cy, cz
@@ -224,6 +395,111 @@ def classify(*args):
     cz.dat[0] = z.real
     cz.dat[1] = z.imag
 
-    res = mtdiscrete(cx,cy,cz,&nodecount)
-    return res, nodecount
+    if node_budget is None and time_limit is None:
+        res = mtdiscrete(cx,cy,cz,&nodecount)
+        return res, nodecount
+    res, sinksteps, treenodes, depth = _bounded(cx,cy,cz,node_budget,time_limit)
+    return res, sinksteps + treenodes
 
+cdef _bounded(gsl_complex x, gsl_complex y, gsl_complex z, node_budget, time_limit):
+    cdef int sinksteps, treenodes, depth
+    cdef rep_type res
+    cdef int budget = _budget(node_budget)
+    cdef double limit = 0.0 if time_limit is None else time_limit
+    with nogil:
+        res = mtdiscretebounded(x, y, z, budget, limit, &sinksteps, &treenodes, &depth)
+    return res, sinksteps, treenodes, depth
+
+def classify_stats(*args, node_budget=None, time_limit=None):
+    '''As classify(), but returns the number of steps taken to find the
+    sink of the Farey graph and the number of tree nodes examined
+    after that separately: (res, sinksteps, treenodes)'''
+    x,y,z = _triple(args)
+
+    cdef int sinksteps, treenodes
+    cdef rep_type res
+    cdef gsl_complex cx = gsl_complex_rect(x.real, x.imag)
+    cdef gsl_complex cy = gsl_complex_rect(y.real, y.imag)
+    cdef gsl_complex cz = gsl_complex_rect(z.real, z.imag)
+    if node_budget is None and time_limit is None:
+        res = mtdiscretesplit(cx, cy, cz, &sinksteps, &treenodes)
+        return res, sinksteps, treenodes
+    return _bounded(cx,cy,cz,node_budget,time_limit)[:3]
+
+def classify_bounded(*args, node_budget=None, time_limit=None):
+    '''As classify(), but with bounded cost: the Farey tree is searched
+    breadth first, and the search gives up with REP_UNCERTAIN once
+    node_budget nodes (sink steps and tree nodes together) have been
+    examined, or after time_limit seconds.  Either limit may be None
+    for no limit.
+
+    Returns (res, nodecount, depth), where depth is the number of
+    levels of the tree below the sink which were examined completely,
+    so that an uncertain result still certifies that no Jorgensen
+    violation occurs up to that depth.'''
+    x,y,z = _triple(args)
+    res, sinksteps, treenodes, depth = _bounded(gsl_complex_rect(x.real, x.imag),
+                                                gsl_complex_rect(y.real, y.imag),
+                                                gsl_complex_rect(z.real, z.imag),
+                                                node_budget, time_limit)
+    return res, sinksteps + treenodes, depth
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _classify_block(double complex[:,::1] T, unsigned char[::1] R, int[::1] NC,
+                          int i0, int i1, int bounded, int budget, double limit) nogil:
+    cdef int i, sinksteps, treenodes, depth
+    for i in range(i0, i1):
+        if bounded:
+            R[i] = <unsigned char>mtdiscretebounded(gsl_complex_rect(T[i,0].real, T[i,0].imag),
+                                                    gsl_complex_rect(T[i,1].real, T[i,1].imag),
+                                                    gsl_complex_rect(T[i,2].real, T[i,2].imag),
+                                                    budget, limit, &sinksteps, &treenodes, &depth)
+            NC[i] = sinksteps + treenodes
+        else:
+            R[i] = <unsigned char>mtdiscrete(gsl_complex_rect(T[i,0].real, T[i,0].imag),
+                                             gsl_complex_rect(T[i,1].real, T[i,1].imag),
+                                             gsl_complex_rect(T[i,2].real, T[i,2].imag),
+                                             &NC[i])
+
+def classify_many(xyz, threads=None, node_budget=None, time_limit=None):
+    '''Classify many representations at once (see classify).
+
+    xyz --- array of shape (...,3) of Markov triples
+
+    The triples are divided among threads worker threads (default: one
+    per CPU).  node_budget and time_limit bound the cost of each triple
+    as for classify_bounded().  Returns arrays rep and nodecount of
+    shape xyz.shape[:-1], with entries as returned by classify().'''
+    xyz = numpy.asarray(xyz, dtype=complex)
+    if xyz.shape[-1:] != (3,):
+        raise ValueError('Expected an array of triples, got shape %s.' % (xyz.shape,))
+    shape = xyz.shape[:-1]
+    cdef double complex[:,::1] T = numpy.ascontiguousarray(xyz.reshape(-1,3))
+    cdef int N = T.shape[0]
+    cdef int bounded = not (node_budget is None and time_limit is None)
+    cdef int budget = _budget(node_budget)
+    cdef double limit = 0.0 if time_limit is None else time_limit
+
+    rep = numpy.empty(N, dtype=numpy.uint8)
+    nodes = numpy.empty(N, dtype=numpy.intc)
+    cdef unsigned char[::1] R = rep
+    cdef int[::1] NC = nodes
+
+    def work(state, int i0, int i1):
+        with nogil:
+            _classify_block(T, R, NC, i0, i1, bounded, budget, limit)
+
+    run_chunks(work, N, threads)
+    return rep.reshape(shape), nodes.reshape(shape)
+
+def near_threshold(xyz, margin=1e-3):
+    '''Which of the triples in the array xyz (shape (...,3)) have a
+    trace whose absolute value is within a relative distance margin of
+    JORGENSEN_LIMIT or BOWDITCH_LIMIT, so that a small error in the
+    traces could change the result of classify()'''
+    a = numpy.abs(numpy.asarray(xyz, dtype=complex))
+    near = (numpy.abs(a - JORGENSEN_LIMIT) <= margin*JORGENSEN_LIMIT) | \
+           (numpy.abs(a - BOWDITCH_LIMIT) <= margin*BOWDITCH_LIMIT)
+    return near.any(axis=-1)
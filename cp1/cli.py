@@ -0,0 +1,278 @@
+'''Command line interface, run as "python -m cp1"
+
+Commands:
+
+  hol   Compute holonomy for a stream of (L,C) or (tau,C) records
+
+Each input record is a pair of complex numbers: the Riemann surface
+(L = lambda, or tau with --tau) and the quadratic differential C.
+Records are read in chunks which are processed by a pool of worker
+processes, and results are written in input order, so memory use is
+bounded by the chunk size and number of workers.
+
+Formats (--input-format, --output-format):
+
+  text  one record per line, as whitespace separated floats
+        (input: re(L) im(L) re(C) im(C); output: real and imaginary
+        parts of each trace, followed by rep and nodes with --classify)
+  raw   packed little-endian records (input: two complex128; output:
+        complex128 traces, followed by uint8 rep and int32 nodes with
+        --classify)
+  npy   NumPy .npy file (input: complex array of shape (N,2); output:
+        array of the raw output records).  Output in npy format
+        requires npy input, so that the number of records is known.
+'''
+from __future__ import print_function
+import sys
+import argparse
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+import numpy
+from numpy.lib import format as npformat
+
+import cp1.s04 as s04
+from cp1.t11 import s04_to_t11_many
+from cp1.bowditch import classify_many
+from cp1.slicekernel import HOLONOMY_FAILED
+
+_INPUT_DTYPE = numpy.dtype('<c16')
+_FORMATS = ['text', 'raw', 'npy']
+
+def _output_dtype(classify):
+    if classify:
+        return numpy.dtype([('traces','<c16',(3,)), ('rep','u1'), ('nodes','<i4')])
+    return numpy.dtype(('<c16',(3,)))
+
+# INPUT
+
+def _binary(f):
+    # Binary stream underlying a text stream (python 3)
+    return getattr(f,'buffer',f)
+
+def _read_text(f,chunk):
+    lines = []
+    for line in f:
+        line = line.strip()
+        if not line or line.startswith(b'#'):
+            continue
+        lines.append([ float(x) for x in line.split() ])
+        if len(lines) == chunk:
+            yield _text_records(lines)
+            lines = []
+    if lines:
+        yield _text_records(lines)
+
+def _text_records(lines):
+    a = numpy.array(lines,dtype=float)
+    if a.ndim != 2 or a.shape[1] != 4:
+        raise ValueError('Text input records must have four fields: re(L) im(L) re(C) im(C).')
+    return a[:,0::2] + 1j*a[:,1::2]
+
+def _read_exact(f,n):
+    # Read n bytes, or fewer at end of file
+    parts = []
+    while n > 0:
+        b = f.read(n)
+        if not b:
+            break
+        parts.append(b)
+        n -= len(b)
+    return b''.join(parts)
+
+def _read_raw(f,chunk,dtype=_INPUT_DTYPE,count=None):
+    size = 2*dtype.itemsize
+    while count is None or count > 0:
+        n = chunk if count is None else min(chunk,count)
+        b = _read_exact(f,n*size)
+        if not b:
+            break
+        if len(b) % size != 0:
+            raise ValueError('Incomplete record at end of raw input.')
+        a = numpy.frombuffer(b,dtype=dtype).reshape(-1,2)
+        yield a.astype(complex)
+        if count is not None:
+            count -= len(a)
+
+def _npy_header(f):
+    # Shape and dtype of an npy stream, leaving f at the start of the data
+    version = npformat.read_magic(f)
+    if version == (1,0):
+        shape, fortran, dtype = npformat.read_array_header_1_0(f)
+    else:
+        shape, fortran, dtype = npformat.read_array_header_2_0(f)
+    if len(shape) != 2 or shape[1] != 2 or dtype.kind != 'c' or fortran:
+        raise ValueError('npy input must be a C-ordered complex array of shape (N,2).')
+    return shape, dtype
+
+def _open_input(name):
+    if name == '-':
+        return _binary(sys.stdin)
+    return open(name,'rb')
+
+def _records(names,fmt,chunk,stdin=None):
+    '''Generator of chunks of input records, as complex arrays of shape
+    (n,2)'''
+    for name in names:
+        f = stdin if (name == '-' and stdin is not None) else _open_input(name)
+        if fmt == 'text':
+            chunks = _read_text(f,chunk)
+        elif fmt == 'raw':
+            chunks = _read_raw(f,chunk)
+        else:
+            shape, dtype = _npy_header(f)
+            chunks = _read_raw(f,chunk,dtype,count=shape[0])
+        for a in chunks:
+            yield a
+        if name != '-':
+            f.close()
+
+def _npy_count(names):
+    # Total number of records in npy input files
+    n = 0
+    for name in names:
+        if name == '-':
+            raise ValueError('npy output requires npy input files (not stdin), so the number of records is known.')
+        with open(name,'rb') as f:
+            n += _npy_header(f)[0][0]
+    return n
+
+# OUTPUT
+
+def _write_text(f,res,classify):
+    tr = res['traces'] if classify else res
+    cols = numpy.empty((len(tr),6))
+    cols[:,0::2] = tr.real
+    cols[:,1::2] = tr.imag
+    for k in range(len(tr)):
+        line = ' '.join('%.17g' % v for v in cols[k])
+        if classify:
+            line += ' %d %d' % (res['rep'][k],res['nodes'][k])
+        f.write(line.encode('ascii') + b'\n')
+
+# COMPUTATION
+
+def hol_chunk(job):
+    '''Compute the output records for one chunk of input records'''
+    data, opts = job
+    kwargs = { 'tol': opts['tol'], 'maxstep': opts['maxstep'], 'method': opts['method'] }
+    if opts['tau']:
+        traces = s04.s04_tau_hol_many(data[:,0],data[:,1],**kwargs)
+    else:
+        traces = s04.s04_lambda_hol_many(data[:,0],data[:,1],contours=3,**kwargs)
+    t11traces = s04_to_t11_many(traces)
+    res = numpy.empty(len(data),dtype=_output_dtype(opts['classify']))
+    out = t11traces if opts['t11'] else traces
+    if not opts['classify']:
+        res[:] = out
+        return res
+    res['traces'] = out
+    failed = ~numpy.isfinite(t11traces).all(axis=1)
+    t11traces[failed] = 0.0
+    res['rep'], res['nodes'] = classify_many(t11traces,threads=1,node_budget=opts['node_budget'],
+                                             time_limit=opts['time_limit'])
+    res['rep'][failed] = HOLONOMY_FAILED
+    res['nodes'][failed] = 0
+    return res
+
+def hol(args,stdin=None,stdout=None):
+    '''Run the hol command with parsed arguments args'''
+    opts = { 'tau': args.tau, 't11': args.t11, 'classify': args.classify,
+             'tol': args.tol, 'maxstep': args.maxstep, 'method': args.method,
+             'node_budget': args.node_budget, 'time_limit': args.time_limit }
+    names = args.input or ['-']
+    records = _records(names,args.input_format,args.chunk,stdin)
+
+    if stdout is None:
+        stdout = _binary(sys.stdout)
+    out = stdout if args.output in (None,'-') else None
+    close = False
+    dtype = _output_dtype(args.classify)
+    if args.output_format == 'npy':
+        if out is not None:
+            raise ValueError('npy output must be written to a file (-o).')
+        if args.input_format != 'npy':
+            raise ValueError('npy output requires npy input, so the number of records is known.')
+        arr = npformat.open_memmap(args.output,mode='w+',dtype=dtype,shape=(_npy_count(names),))
+    elif out is None:
+        out = open(args.output,'wb')
+        close = True
+
+    pos = [0]
+    def write(res):
+        if args.output_format == 'text':
+            _write_text(out,res,args.classify)
+        elif args.output_format == 'raw':
+            out.write(res.tobytes())
+        else:
+            arr[pos[0]:pos[0]+len(res)] = res
+        pos[0] += len(res)
+
+    processes = args.processes or cpu_count()
+    if processes == 1:
+        for data in records:
+            write(hol_chunk((data,opts)))
+    else:
+        # Keep a bounded number of chunks in flight, writing results in
+        # input order
+        pool = Pool(processes)
+        try:
+            pending = deque()
+            for data in records:
+                pending.append(pool.apply_async(hol_chunk,((data,opts),)))
+                while len(pending) >= 2*processes:
+                    write(pending.popleft().get())
+            while pending:
+                write(pending.popleft().get())
+        finally:
+            pool.terminate()
+
+    if args.output_format == 'npy':
+        arr.flush()
+    elif close:
+        out.close()
+    else:
+        out.flush()
+    return pos[0]
+
+def parser():
+    p = argparse.ArgumentParser(prog='python -m cp1',
+                                description='Holonomy of complex projective structures')
+    sub = p.add_subparsers(dest='command')
+    h = sub.add_parser('hol',help='Compute holonomy for a stream of (L,C) or (tau,C) records')
+    h.add_argument('input',nargs='*',
+                   help='Input files (default or "-": standard input)')
+    h.add_argument('-o','--output',
+                   help='Output file (default: standard output)')
+    h.add_argument('--tau',action='store_true',
+                   help='Records give tau (upper half plane) rather than lambda')
+    h.add_argument('--t11',action='store_true',
+                   help='Output punctured torus traces rather than four-punctured sphere traces')
+    h.add_argument('--classify',action='store_true',
+                   help='Append discreteness test results (rep, nodes) to each record')
+    h.add_argument('--node-budget',type=int,
+                   help='Maximum number of Farey tree nodes examined per record (with --classify)')
+    h.add_argument('--time-limit',type=float,
+                   help='Maximum time (seconds) spent classifying each record (with --classify)')
+    h.add_argument('-i','--input-format',choices=_FORMATS,default='text')
+    h.add_argument('-f','--output-format',choices=_FORMATS,default='text')
+    h.add_argument('-j','--processes',type=int,
+                   help='Number of worker processes (default is one per CPU)')
+    h.add_argument('--chunk',type=int,default=1024,
+                   help='Number of records per chunk of work')
+    h.add_argument('--tol',type=float,default=0.000001,
+                   help='ODE solver tolerance')
+    h.add_argument('--maxstep',type=int,default=5000,
+                   help='Maximum number of ODE steps per segment')
+    h.add_argument('--method',choices=['rk8pd','magnus4','magnus6'],default='rk8pd',
+                   help='ODE solver')
+    return p
+
+def main(argv=None,stdin=None,stdout=None):
+    args = parser().parse_args(argv)
+    if args.command == 'hol':
+        hol(args,stdin,stdout)
+    else:
+        parser().print_help()
+        return 1
+    return 0
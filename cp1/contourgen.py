@@ -1,4 +1,6 @@
 '''Integration contours for the four-puncture sphere'''
+import cmath
+from math import pi, cos, ceil
 
 # ----------------------------------------------------------------------
 # SIMPLE CONTOURS
@@ -155,3 +157,256 @@ def advanced(L,n):
     contours.append(gamma)
 
     return contours
+
+# ----------------------------------------------------------------------
+# CLEARANCE CONTOURS
+#
+# The ODE solver takes small steps near the punctures, where phi has
+# double poles, so contours that stay far from them need fewer steps.
+# Each contour above encloses two of the punctures 0, 1, L; it is
+# replaced by the boundary of a neighbourhood of a "core" path joining
+# these two, made of one or two straight segments, with the width
+# chosen to keep the same distance from the core's endpoints as from
+# the third puncture.
+#
+# The new contour is homotopic to the old one when the core does not
+# cross (algebraically) a ray from the third puncture to infinity
+# that does not meet the old contour.  Among the cores passing this
+# test, the one minimizing length/clearance is used, which is roughly
+# proportional to the number of ODE steps needed.
+# ----------------------------------------------------------------------
+
+_RAY_ANGLES = 72
+_CAP_PIECES = 3
+_CORE_ANGLES = 16
+_CORE_RADII = (0.25, 0.5, 1.0, 1.5)
+_MIN_TURN_COS = -0.5
+
+def _winding(gamma,p):
+    # Winding number of the closed polygon gamma around p
+    total = 0.0
+    for z0,z1 in zip(gamma,list(gamma[1:]) + [gamma[0]]):
+        total += cmath.phase((z1 - p)/(z0 - p))
+    return int(round(total/(2.0*pi)))
+
+def _cross(a,b):
+    # z-component of the cross product of a and b
+    return a.real*b.imag - a.imag*b.real
+
+def _ray_crossing(p0,p1,c,u):
+    # Sign of the crossing of the segment p0,p1 with the ray c + t*u,
+    # t >= 0, or 0 if they do not cross
+    d = p1 - p0
+    den = _cross(d,u)
+    if den == 0.0:
+        return 0
+    s = _cross(c - p0,u)/den
+    t = _cross(c - p0,d)/den
+    if 0.0 <= s <= 1.0 and t >= 0.0:
+        return 1 if den > 0.0 else -1
+    return 0
+
+def _seg_dist(p,a,b):
+    # Distance from p to the segment a,b
+    d = b - a
+    t = ((p - a)*d.conjugate()).real/abs(d)**2
+    t = min(1.0,max(0.0,t))
+    return abs(p - (a + t*d))
+
+def _free_ray(gamma,c):
+    # Direction of a ray from c to infinity not meeting the closed
+    # polygon gamma, in the middle of the widest range of such
+    # directions; None if there is none
+    closed = list(gamma) + [gamma[0]]
+    free = []
+    for k in range(_RAY_ANGLES):
+        u = cmath.exp(2j*pi*k/_RAY_ANGLES)
+        free.append(not any( _cross(p1 - p0,u) != 0.0 and _ray_crossing(p0,p1,c,u) != 0
+                             for p0,p1 in zip(closed[:-1],closed[1:]) ))
+    if not any(free):
+        return None
+    if all(free):
+        return 1.0
+    # Longest run of free directions, cyclically
+    best = (0,0)
+    start = free.index(False)
+    run = 0
+    for j in range(1,_RAY_ANGLES+1):
+        k = (start + j) % _RAY_ANGLES
+        if free[k]:
+            run += 1
+            if run > best[0]:
+                best = (run,k)
+        else:
+            run = 0
+    mid = best[1] - 0.5*(best[0] - 1)
+    return cmath.exp(2j*pi*mid/_RAY_ANGLES)
+
+def _best_core(a,b,c,u):
+    # Path from a to b, as a list of vertices, homotopic to those not
+    # crossing the ray c + t*u, minimizing length/distance to c
+    m = 0.5*(a + b)
+    h = abs(b - a)
+    cores = [[a,b]]
+    for rho in _CORE_RADII:
+        for k in range(_CORE_ANGLES):
+            cores.append([a, m + rho*h*cmath.exp(2j*pi*k/_CORE_ANGLES), b])
+    best = None
+    for core in cores:
+        if min( abs(p1 - p0) for p0,p1 in zip(core[:-1],core[1:]) ) < 1e-3*h:
+            continue
+        if sum( _ray_crossing(p0,p1,c,u) for p0,p1 in zip(core[:-1],core[1:]) ) != 0:
+            continue
+        if len(core) == 3:
+            d0 = core[1] - core[0]
+            d1 = core[2] - core[1]
+            # Avoid sharp turns, where the neighbourhood degenerates
+            if (d0*d1.conjugate()).real < _MIN_TURN_COS*abs(d0)*abs(d1):
+                continue
+        dist = min( _seg_dist(c,p0,p1) for p0,p1 in zip(core[:-1],core[1:]) )
+        length = sum( abs(p1 - p0) for p0,p1 in zip(core[:-1],core[1:]) )
+        if dist == 0.0:
+            continue
+        score = length/dist
+        if best is None or score < best[0]:
+            best = (score,core,dist)
+    return best
+
+def _right_side(core,r):
+    # Vertices of the boundary of the r-neighbourhood of the path core
+    # along its right side, and around its last point (anticlockwise)
+    res = []
+    dirs = [ (p1 - p0)/abs(p1 - p0) for p0,p1 in zip(core[:-1],core[1:]) ]
+    for k in range(1,len(core)-1):
+        n0 = -1j*dirs[k-1]
+        n1 = -1j*dirs[k]
+        if _cross(dirs[k-1],dirs[k]) > 0.0:
+            # Turning left: the right side goes around the vertex
+            res.extend(_arc(core[k],r,cmath.phase(n0),cmath.phase(n1)))
+        else:
+            # Turning right: the offset lines meet at a corner
+            res.append(core[k] + r*(n0 + n1)/(1.0 + (n0*n1.conjugate()).real))
+    a0 = cmath.phase(-1j*dirs[-1])
+    res.extend(_arc(core[-1],r,a0,a0 + pi))
+    return res
+
+def _arc(p,r,a0,a1):
+    # Corners of a polygon circumscribed about the arc of the circle
+    # with center p, radius r from angle a0 anticlockwise to a1
+    while a1 < a0:
+        a1 += 2.0*pi
+    n = max(1,int(ceil((a1 - a0)/(pi/_CAP_PIECES) - 1e-9)))
+    step = (a1 - a0)/n
+    R = r/cos(0.5*step)
+    return [ p + R*cmath.exp(1j*(a0 + (k + 0.5)*step)) for k in range(n) ]
+
+def contour_core(gamma,L):
+    '''Path (a list of vertices) joining the two punctures among 0, 1, L
+    enclosed by the closed polygon gamma, such that gamma is homotopic
+    to the boundary of a small neighbourhood of the path.  Returns the
+    path, the third puncture and its distance from the path, or None
+    if gamma does not enclose exactly two punctures or no path is
+    found.'''
+    punctures = [0.0j, 1.0+0.0j, complex(L)]
+    inside = [ _winding(gamma,p) != 0 for p in punctures ]
+    if sum(inside) != 2:
+        return None
+    a, b = [ p for p,i in zip(punctures,inside) if i ]
+    c = punctures[inside.index(False)]
+    u = _free_ray(gamma,c)
+    if u is None:
+        return None
+    best = _best_core(a,b,c,u)
+    if best is None:
+        return None
+    score, core, dist = best
+    return core, c, dist
+
+def clearance_contour(gamma,L):
+    '''Closed polygon homotopic to the closed polygon gamma, which must
+    enclose two of the punctures 0, 1, L, keeping as far from the
+    punctures as possible.  Returns gamma itself if it does not enclose
+    exactly two punctures or no such polygon is found.'''
+    res = contour_core(gamma,L)
+    if res is None:
+        return gamma
+    core, c, dist = res
+    r = 0.5*dist
+    return _right_side(core,r) + _right_side(core[::-1],r)
+
+def clearance(L,n,fund_domain=False):
+    '''Contours homotopic to simple(L,n) (or advanced(L,n) if
+    fund_domain is true) which keep further from the punctures'''
+    if fund_domain:
+        contours = advanced(L,n)
+    else:
+        contours = simple(L,n)
+    return [ clearance_contour(gamma,L) for gamma in contours ]
+
+CONTOUR_MODES = ('rectangular', 'clearance')
+
+def generate(L,n,fund_domain=False,mode='rectangular'):
+    '''The n contours for L used by S04: the axis-aligned contours of
+    simple() or advanced() (if fund_domain is true) when mode is
+    'rectangular', or the homotopic ones of clearance() when mode is
+    'clearance'.'''
+    if mode == 'rectangular':
+        if fund_domain:
+            return advanced(L,n)
+        return simple(L,n)
+    elif mode == 'clearance':
+        return clearance(L,n,fund_domain)
+    raise ValueError('Unknown contour mode %s, must be one of %s.' % (mode,', '.join(CONTOUR_MODES)))
+
+# ----------------------------------------------------------------------
+# SHARED SEGMENTS
+#
+# The contours above often run along the same lines.  Splitting every
+# edge at the vertices of the other contours that lie on it turns the
+# overlaps into identical segments, which then only need to be
+# integrated once.
+# ----------------------------------------------------------------------
+
+_SPLIT_EPSILON = 1e-12
+
+def split_segments(contours):
+    '''Decompose closed polygonal contours into a list of distinct
+    segments (p0,p1).  Returns the segments and, for each contour, a
+    list of pairs (index, reversed) describing it as a sequence of
+    segments, each traversed forwards or backwards.'''
+    verts = []
+    for gamma in contours:
+        for v in gamma:
+            if v not in verts:
+                verts.append(v)
+
+    segs = []
+    index = {}
+    paths = []
+    for gamma in contours:
+        closed = list(gamma) + [gamma[0]]
+        path = []
+        for p0,p1 in zip(closed[:-1],closed[1:]):
+            d = p1 - p0
+            if abs(d) < _SPLIT_EPSILON:
+                continue
+            # Vertices in the interior of this edge, in order
+            inner = []
+            for v in verts:
+                w = (v - p0)/d
+                if (_SPLIT_EPSILON < w.real < 1.0 - _SPLIT_EPSILON) and \
+                   (abs(w.imag) < _SPLIT_EPSILON):
+                    inner.append((w.real,v))
+            inner.sort(key=lambda tv: tv[0])
+            pts = [p0] + [ v for t,v in inner ] + [p1]
+            for q0,q1 in zip(pts[:-1],pts[1:]):
+                if (q0,q1) in index:
+                    path.append((index[(q0,q1)],False))
+                elif (q1,q0) in index:
+                    path.append((index[(q1,q0)],True))
+                else:
+                    index[(q0,q1)] = len(segs)
+                    segs.append((q0,q1))
+                    path.append((len(segs)-1,False))
+        paths.append(path)
+    return segs, paths
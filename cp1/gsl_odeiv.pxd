@@ -60,7 +60,9 @@ cdef extern from "gsl/gsl_odeiv.h":
 
     gsl_odeiv_control * gsl_odeiv_control_scaled_new(double eps_abs, double eps_rel, double a_y, double a_dydt,  double scale_abs[], size_t dim) nogil
 
-    ctypedef struct gsl_odeiv_evolve
+    ctypedef struct gsl_odeiv_evolve:
+        size_t count
+        size_t failed_steps
 
     gsl_odeiv_evolve * gsl_odeiv_evolve_alloc(size_t dim) nogil
     int gsl_odeiv_evolve_apply(gsl_odeiv_evolve *, gsl_odeiv_control * con, gsl_odeiv_step * step,  gsl_odeiv_system * dydt, double * t, double t1, double * h, double y[]) nogil
@@ -0,0 +1,196 @@
+'''Persistent cache of holonomy traces in an SQLite database
+
+Entries are keyed by the exact values of L and C and a string
+describing the solver settings (see S04), so that a point computed
+once, in any process, is later found by lookup.  Several processes and
+threads may read and write the same database at the same time.'''
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy
+
+_SCHEMA = '''CREATE TABLE IF NOT EXISTS traces (
+    settings TEXT NOT NULL,
+    Lre REAL NOT NULL, Lim REAL NOT NULL,
+    Cre REAL NOT NULL, Cim REAL NOT NULL,
+    traces BLOB NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (settings, Lre, Lim, Cre, Cim))'''
+
+_INDEX = 'CREATE INDEX IF NOT EXISTS traces_used ON traces (used)'
+
+class HolonomyCache(object):
+    '''Traces of holonomy stored in the SQLite database at path.
+
+    If max_entries is given, the least recently used entries are
+    discarded when there are more; the count is only checked after
+    about max_entries/8 further insertions, so the database may
+    briefly hold that many extra entries.  Lookups do not write to the
+    database: the times entries were used are kept by each thread
+    and written with its next put_many() (or flush()).  Concurrent
+    writers wait up to timeout seconds for each other.'''
+    def __init__(self,path,max_entries=None,timeout=60.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        # Upper bound on the number of entries, or None if unknown;
+        # only changed inside write transactions, which SQLite
+        # serializes
+        self._count = None
+        with self._write() as db:
+            db.execute(_SCHEMA)
+            db.execute(_INDEX)
+
+    def _connection(self):
+        # One connection per thread, with transactions managed by
+        # _write()
+        db = getattr(self._local,'db',None)
+        if db is None:
+            db = sqlite3.connect(self.path,timeout=self.timeout,isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TEMP TABLE IF NOT EXISTS lookup (i INTEGER, Lre REAL, Lim REAL, Cre REAL, Cim REAL)')
+            self._local.db = db
+            self._local.used = {}
+        return db
+
+    @contextmanager
+    def _read(self):
+        # Deferred transaction, which only writes to the TEMP lookup
+        # table and so does not take the database write lock
+        db = self._connection()
+        db.execute('BEGIN')
+        try:
+            yield db
+        except:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @contextmanager
+    def _write(self):
+        # Transaction taking the write lock at the start, so that it
+        # waits for other writers rather than failing
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM traces').fetchone()[0]
+
+    def get_many(self,settings,L,C,n):
+        '''Look up the n traces for each pair of elements of the arrays L
+        and C (broadcast together).  Returns a complex array of shape
+        L.shape + (n,), containing nan where there is no entry, and a
+        boolean array which is true where there is one.'''
+        L, C = numpy.broadcast_arrays(numpy.asarray(L,dtype=complex),numpy.asarray(C,dtype=complex))
+        shape = L.shape
+        L = L.ravel()
+        C = C.ravel()
+        res = numpy.full((len(L),n),numpy.nan,dtype=complex)
+        found = numpy.zeros(len(L),dtype=bool)
+        with self._read() as db:
+            db.execute('DELETE FROM lookup')
+            db.executemany('INSERT INTO lookup VALUES (?,?,?,?,?)',
+                           ( (i, L[i].real, L[i].imag, C[i].real, C[i].imag) for i in range(len(L)) ))
+            rows = db.execute('''SELECT lookup.i, traces.traces FROM lookup JOIN traces
+                                 ON traces.settings = ? AND traces.Lre = lookup.Lre AND traces.Lim = lookup.Lim
+                                 AND traces.Cre = lookup.Cre AND traces.Cim = lookup.Cim''',
+                              (settings,)).fetchall()
+        now = time.time()
+        used = self._local.used
+        for i, blob in rows:
+            t = numpy.frombuffer(blob,dtype=complex)
+            if len(t) == n:
+                res[i] = t
+                found[i] = True
+            used[(settings, L[i].real, L[i].imag, C[i].real, C[i].imag)] = now
+        nfound = int(found.sum())
+        self.hits += nfound
+        self.misses += len(L) - nfound
+        return res.reshape(shape + (n,)), found.reshape(shape)
+
+    def put_many(self,settings,L,C,traces):
+        '''Store traces (an array of shape L.shape + (n,)) for the pairs
+        of elements of the arrays L and C.  Rows which are not finite
+        (failed integrations) are not stored.'''
+        L, C = numpy.broadcast_arrays(numpy.asarray(L,dtype=complex),numpy.asarray(C,dtype=complex))
+        L = L.ravel()
+        C = C.ravel()
+        traces = numpy.asarray(traces,dtype=complex).reshape(len(L),-1)
+        ok = numpy.isfinite(traces).all(axis=1)
+        rows = numpy.nonzero(ok)[0]
+        now = time.time()
+        with self._write() as db:
+            self._flush_used(db)
+            db.executemany('INSERT OR REPLACE INTO traces VALUES (?,?,?,?,?,?,?)',
+                           ( (settings, L[i].real, L[i].imag, C[i].real, C[i].imag,
+                              sqlite3.Binary(numpy.ascontiguousarray(traces[i]).tobytes()), now)
+                             for i in rows ))
+            if self._count is not None:
+                # Replaced rows are counted too, so this is an upper bound
+                self._count += len(rows)
+            max_entries = self.max_entries
+            if max_entries is not None and (self._count is None or
+                                            self._count > max_entries + max_entries//8):
+                self._evict(db,max_entries)
+
+    def get(self,settings,L,C,n):
+        '''Traces for one point as a list, or None if not cached'''
+        res, found = self.get_many(settings,[L],[C],n)
+        if not found[0]:
+            return None
+        return list(res[0])
+
+    def put(self,settings,L,C,traces):
+        '''Store the traces for one point'''
+        self.put_many(settings,[L],[C],[traces])
+
+    def _flush_used(self,db):
+        # Write the use times recorded by get_many() in this thread,
+        # inside a write transaction
+        used = self._local.used
+        if used:
+            db.executemany('''UPDATE traces SET used = ? WHERE settings = ? AND Lre = ? AND Lim = ?
+                              AND Cre = ? AND Cim = ? AND used < ?''',
+                           ( (t,) + key + (t,) for key, t in used.items() ))
+            used.clear()
+
+    def _evict(self,db,max_entries):
+        # Inside a write transaction, after _flush_used()
+        count = db.execute('SELECT COUNT(*) FROM traces').fetchone()[0]
+        if count > max_entries:
+            db.execute('DELETE FROM traces WHERE rowid IN (SELECT rowid FROM traces ORDER BY used LIMIT ?)',
+                       (count - max_entries,))
+            count = max_entries
+        self._count = count
+
+    def flush(self):
+        '''Write the times entries were used by lookups in this thread
+        to the database (done anyway by put_many())'''
+        with self._write() as db:
+            self._flush_used(db)
+
+    def resize(self,max_entries):
+        '''Change the maximum number of entries (None for no limit)'''
+        self.max_entries = max_entries
+        if max_entries is not None:
+            with self._write() as db:
+                self._flush_used(db)
+                self._evict(db,max_entries)
+
+    def clear(self):
+        '''Remove all entries'''
+        with self._write() as db:
+            self._local.used.clear()
+            db.execute('DELETE FROM traces')
+            self._count = 0
@@ -0,0 +1,46 @@
+'''Run compiled loops over blocks of points in several threads'''
+import threading
+from multiprocessing import cpu_count
+
+# The compiled loops release the GIL, so plain Python threads give
+# real parallelism without any extra build requirements.
+
+def run_chunks(work,N,threads=None,chunk_size=256,init=None):
+    '''Call work(state,i0,i1) for consecutive blocks [i0,i1) covering
+    range(N), using threads worker threads (default: one per CPU).
+
+    Blocks are handed out to the threads as they become free, since
+    the cost of a point can vary a lot.  If init is given, each thread
+    calls it once and passes the result as state (e.g. a per-thread
+    integrator); otherwise state is None.  The first exception raised
+    in a worker is re-raised.'''
+    if threads is None:
+        threads = cpu_count()
+    threads = max(1,min(threads,(N + chunk_size - 1) // chunk_size))
+
+    chunks = iter(range(0,N,chunk_size))
+    lock = threading.Lock()
+    errors = []
+
+    def worker():
+        try:
+            state = init() if init is not None else None
+            while not errors:
+                with lock:
+                    i0 = next(chunks,None)
+                if i0 is None:
+                    return
+                work(state,i0,min(i0+chunk_size,N))
+        except Exception as e:
+            errors.append(e)
+
+    if threads == 1:
+        worker()
+    else:
+        workers = [ threading.Thread(target=worker) for i in range(threads) ]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    if errors:
+        raise errors[0]
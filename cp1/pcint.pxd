@@ -0,0 +1,76 @@
+from gsl_complex cimport *
+from gsl_odeiv cimport *
+
+ctypedef struct pc_seg_odef_params:
+    gsl_complex L
+    gsl_complex C
+    gsl_complex p0
+    gsl_complex p1
+
+ctypedef struct step_schedule:
+    double *h
+    int n
+    int cap
+
+ctypedef struct int_stats:
+    long accepted
+    long rejected
+    long segments
+    long failed
+    double hmin
+
+ctypedef struct seg_record:
+    double complex C
+    double complex p0
+    double complex p1
+    long accepted
+    long rejected
+    double hmin
+    int ok
+
+cdef class SL2C:
+    cdef double y[8]
+
+cdef class _Schedule:
+    cdef step_schedule s
+
+cdef class _ScheduleList:
+    cdef step_schedule **ptrs
+    cdef int n
+    cdef list refs
+
+cdef class pcint:
+    cdef gsl_odeiv_step *step
+    cdef gsl_odeiv_control *control
+    cdef gsl_odeiv_evolve *evolve
+    cdef gsl_odeiv_system sys
+    cdef pc_seg_odef_params P
+    cdef gsl_odeiv_step *vstep
+    cdef gsl_odeiv_control *vcontrol
+    cdef gsl_odeiv_evolve *vevolve
+    cdef gsl_odeiv_system vsys
+    cdef double initstep
+    cdef int maxstep
+    cdef int method
+    cdef double atol
+    cdef double rtol
+    cdef int reuse_steps
+    cdef dict schedules
+    cdef public long nsteps
+    cdef int collect_stats
+    cdef int_stats st
+    cdef seg_record *records
+    cdef long nrecords
+    cdef long reccap
+
+    cdef int _alloc_var(self) except -1
+    cdef void _stats_record(self, double complex p0, double complex p1, long accepted, long rejected,
+                            double hmin, int ok) nogil
+    cdef _Schedule _schedule(self, L, p0, p1)
+    cdef _ScheduleList _path_schedules(self, L, verts, close)
+    cdef int _seg(self, double y[], double complex p0, double complex p1, int maxstep,
+                  step_schedule *sched) nogil
+    cdef int _seg_var(self, double y[], double complex p0, double complex p1, int maxstep) nogil
+    cdef int _seg_magnus(self, double y[], double complex p0, double complex p1, int maxstep) nogil
+    cdef int _path(self, double y[], double complex *verts, int nverts, int close, int maxstep,
+                   step_schedule **scheds) nogil
@@ -2,12 +2,12 @@
 
 from gsl_complex cimport *
 from gsl_odeiv cimport *
+from libc.math cimport NAN, INFINITY, sqrt, pow, fabs, floor, fmod
+from libc.stdlib cimport realloc, calloc, free
+from libc.string cimport memcpy
+cimport cython
 
-ctypedef struct pc_seg_odef_params:
-    gsl_complex L
-    gsl_complex C
-    gsl_complex p0
-    gsl_complex p1
+import numpy
 
 # Necessary to include "const" qualifier in generated c
 cdef extern from *:
@@ -72,6 +72,195 @@ cdef int pc_seg_odef (double t, const_double y[], double f[], void *P) nogil:
     return GSL_SUCCESS
 
 
+# ----------------------------------------------------------------------
+# MAGNUS INTEGRATORS
+#
+# The equation is linear, Y' = Y A(t) with A = [[0, a*phi],[a, 0]]
+# (a = p1-p0; see pc_seg_odef), so it can be solved by Magnus
+# integrators: each step multiplies by the exponential of a traceless
+# matrix built from A at the Gauss points of the step, which stays
+# exactly in SL(2,C).  We work with B = A^T = [[0, a],[a*phi, 0]] (see
+# magnus_B), for which Y^T' = B Y^T, and use the formulas of
+# Blanes, Casas and Ros for the left-multiplication convention.  The
+# step size is controlled by step doubling.
+# ----------------------------------------------------------------------
+
+cdef enum:
+    METHOD_RK8PD = 0
+    METHOD_MAGNUS4 = 4
+    METHOD_MAGNUS6 = 6
+
+_METHODS = { 'rk8pd': METHOD_RK8PD,
+             'magnus4': METHOD_MAGNUS4,
+             'magnus6': METHOD_MAGNUS6 }
+
+cdef double MAGNUS_HMIN = 1.0e-12
+
+@cython.cdivision(True)
+cdef inline double complex pc_phi(double complex z, double complex L, double complex C) nogil:
+    # phi = -0.25/((z*(z-1))**2) - 0.25/(z-L)**2 - 0.5*C/(z*(z-1)*(z-L))
+    cdef double complex zz1 = z*(z - 1.0)
+    cdef double complex zL = z - L
+    return -0.25/(zz1*zz1) - 0.25/(zL*zL) - 0.5*C/(zz1*zL)
+
+# 2x2 matrices are stored row-major as double complex[4]
+
+cdef inline void mat_comm(double complex *X, double complex *Y, double complex *out) nogil:
+    # out = XY - YX
+    out[0] = X[1]*Y[2] - Y[1]*X[2]
+    out[1] = X[0]*Y[1] + X[1]*Y[3] - Y[0]*X[1] - Y[1]*X[3]
+    out[2] = X[2]*Y[0] + X[3]*Y[2] - Y[2]*X[0] - Y[3]*X[2]
+    out[3] = X[2]*Y[1] - Y[2]*X[1]
+
+cdef inline void magnus_B(double complex z, double complex a, double complex L, double complex C,
+                          double complex *B) nogil:
+    B[0] = 0.0
+    B[1] = a
+    B[2] = a*pc_phi(z, L, C)
+    B[3] = 0.0
+
+@cython.cdivision(True)
+cdef void magnus_omega(double complex p0, double complex a, double complex L, double complex C,
+                       double t, double h, int order, double complex *omega) nogil:
+    cdef double complex A1[4]
+    cdef double complex A2[4]
+    cdef double complex A3[4]
+    cdef double complex a1[4]
+    cdef double complex a2[4]
+    cdef double complex a3[4]
+    cdef double complex c1[4]
+    cdef double complex c2[4]
+    cdef double complex u[4]
+    cdef double complex v[4]
+    cdef double c
+    cdef int i
+
+    if order == METHOD_MAGNUS4:
+        # Two Gauss points:  h/2 (A1+A2) + sqrt(3)/12 h^2 [A2,A1]
+        c = sqrt(3.0)/6.0
+        magnus_B(p0 + a*(t + (0.5-c)*h), a, L, C, A1)
+        magnus_B(p0 + a*(t + (0.5+c)*h), a, L, C, A2)
+        mat_comm(A2, A1, c1)
+        for i in range(4):
+            omega[i] = 0.5*h*(A1[i] + A2[i]) + (sqrt(3.0)/12.0)*h*h*c1[i]
+        return
+
+    # Three Gauss points
+    c = sqrt(15.0)/10.0
+    magnus_B(p0 + a*(t + (0.5-c)*h), a, L, C, A1)
+    magnus_B(p0 + a*(t + 0.5*h), a, L, C, A2)
+    magnus_B(p0 + a*(t + (0.5+c)*h), a, L, C, A3)
+    for i in range(4):
+        a1[i] = h*A2[i]
+        a2[i] = (sqrt(15.0)/3.0)*h*(A3[i] - A1[i])
+        a3[i] = (10.0/3.0)*h*(A3[i] - 2.0*A2[i] + A1[i])
+    # C1 = [a1,a2], C2 = -1/60 [a1, 2 a3 + C1]
+    mat_comm(a1, a2, c1)
+    for i in range(4):
+        u[i] = 2.0*a3[i] + c1[i]
+    mat_comm(a1, u, c2)
+    for i in range(4):
+        c2[i] = -c2[i]/60.0
+    # omega = a1 + a3/12 + 1/240 [-20 a1 - a3 + C1, a2 + C2]
+    for i in range(4):
+        u[i] = -20.0*a1[i] - a3[i] + c1[i]
+        v[i] = a2[i] + c2[i]
+    mat_comm(u, v, c2)
+    for i in range(4):
+        omega[i] = a1[i] + a3[i]/12.0 + c2[i]/240.0
+
+@cython.cdivision(True)
+cdef void magnus_apply(double complex *Y, double complex *omega, double complex *out) nogil:
+    # out = Y exp(omega)^T, for traceless omega
+    cdef double complex s2 = omega[0]*omega[0] + omega[1]*omega[2]
+    cdef double complex ch, sh
+    cdef gsl_complex gs
+    cdef double complex E[4]
+    if abs(s2) < 1.0e-6:
+        ch = 1.0 + s2*(0.5 + s2*(1.0/24.0 + s2/720.0))
+        sh = 1.0 + s2*(1.0/6.0 + s2*(1.0/120.0 + s2/5040.0))
+    else:
+        gs = gsl_complex_sqrt(gsl_complex_rect(s2.real, s2.imag))
+        ch = GSL_REAL(gsl_complex_cosh(gs)) + 1j*GSL_IMAG(gsl_complex_cosh(gs))
+        sh = (GSL_REAL(gsl_complex_sinh(gs)) + 1j*GSL_IMAG(gsl_complex_sinh(gs))) / \
+             (GSL_REAL(gs) + 1j*GSL_IMAG(gs))
+    E[0] = ch + sh*omega[0]
+    E[1] = sh*omega[1]
+    E[2] = sh*omega[2]
+    E[3] = ch + sh*omega[3]
+    out[0] = Y[0]*E[0] + Y[1]*E[1]
+    out[1] = Y[0]*E[2] + Y[1]*E[3]
+    out[2] = Y[2]*E[0] + Y[3]*E[1]
+    out[3] = Y[2]*E[2] + Y[3]*E[3]
+
+cdef void magnus_step(double complex *Y, double complex p0, double complex a,
+                      double complex L, double complex C, double t, double h, int order,
+                      double complex *out) nogil:
+    cdef double complex omega[4]
+    magnus_omega(p0, a, L, C, t, h, order, omega)
+    magnus_apply(Y, omega, out)
+
+# ----------------------------------------------------------------------
+# VARIATIONAL EQUATIONS
+#
+# The derivative V = dY/dC satisfies V' = V A + Y dA/dC, where only phi
+# depends on C, with dphi/dC = -0.5/(z*(z-1)*(z-L)).  The system for
+# (Y,V) has 16 real components: y[0:8] as for pc_seg_odef, and
+# y[8:16] the derivative of y[0:8] with respect to C.
+# ----------------------------------------------------------------------
+
+@cython.cdivision(True)
+cdef int pc_seg_odef_var(double t, const_double y[], double f[], void *P) nogil:
+    cdef pc_seg_odef_params *params = (<pc_seg_odef_params *>P)
+    cdef double complex L = GSL_REAL(params.L) + 1j*GSL_IMAG(params.L)
+    cdef double complex C = GSL_REAL(params.C) + 1j*GSL_IMAG(params.C)
+    cdef double complex p0 = GSL_REAL(params.p0) + 1j*GSL_IMAG(params.p0)
+    cdef double complex a = GSL_REAL(params.p1) + 1j*GSL_IMAG(params.p1) - p0
+    cdef double complex z = p0 + a*t
+    cdef double complex phi = pc_phi(z, L, C)
+    cdef double complex dphi = -0.5/(z*(z - 1.0)*(z - L))
+    cdef double complex u[4]
+    cdef double complex v[4]
+    cdef double complex out[8]
+    cdef int i
+
+    for i in range(4):
+        u[i] = <double>y[2*i] + 1j*<double>y[2*i+1]
+        v[i] = <double>y[8+2*i] + 1j*<double>y[9+2*i]
+
+    out[0] = a*u[1]
+    out[1] = a*phi*u[0]
+    out[2] = a*u[3]
+    out[3] = a*phi*u[2]
+    out[4] = a*v[1]
+    out[5] = a*(phi*v[0] + dphi*u[0])
+    out[6] = a*v[3]
+    out[7] = a*(phi*v[2] + dphi*u[2])
+
+    for i in range(8):
+        f[2*i] = out[i].real
+        f[2*i+1] = out[i].imag
+
+    return GSL_SUCCESS
+
+cdef void matrix_from_y(double *y, m):
+    # Fill the 2x2 complex array m from 8 doubles
+    m[0,0] = y[0] + 1j*y[1]
+    m[0,1] = y[2] + 1j*y[3]
+    m[1,0] = y[4] + 1j*y[5]
+    m[1,1] = y[6] + 1j*y[7]
+
+cdef void matrix_to_y(m, double *y):
+    # Store a 2x2 complex matrix (nested sequences) as 8 doubles
+    y[0] = m[0][0].real
+    y[1] = m[0][0].imag
+    y[2] = m[0][1].real
+    y[3] = m[0][1].imag
+    y[4] = m[1][0].real
+    y[5] = m[1][0].imag
+    y[6] = m[1][1].real
+    y[7] = m[1][1].imag
+
 cdef void make_eye(double *m) nogil:
     m[0] = 1.0  # re(a)
     m[1] = 0.0  # im(a)
@@ -82,19 +271,212 @@ cdef void make_eye(double *m) nogil:
     m[6] = 1.0  # re(d)
     m[7] = 0.0  # im(d)
 
+cdef inline void mul_y(double *p, double *q, double *out) nogil:
+    # Matrix product of p and q (8 doubles each), stored in out
+    cdef double complex a = (p[0] + 1j*p[1])*(q[0] + 1j*q[1]) + (p[2] + 1j*p[3])*(q[4] + 1j*q[5])
+    cdef double complex b = (p[0] + 1j*p[1])*(q[2] + 1j*q[3]) + (p[2] + 1j*p[3])*(q[6] + 1j*q[7])
+    cdef double complex c = (p[4] + 1j*p[5])*(q[0] + 1j*q[1]) + (p[6] + 1j*p[7])*(q[4] + 1j*q[5])
+    cdef double complex d = (p[4] + 1j*p[5])*(q[2] + 1j*q[3]) + (p[6] + 1j*p[7])*(q[6] + 1j*q[7])
+    out[0] = a.real
+    out[1] = a.imag
+    out[2] = b.real
+    out[3] = b.imag
+    out[4] = c.real
+    out[5] = c.imag
+    out[6] = d.real
+    out[7] = d.imag
+
+cdef class SL2C:
+    '''A 2x2 complex matrix (normally of determinant 1), stored in the
+    form used by the integrator so that pcint.seg_int can read and
+    write it without creating Python objects.
+
+    SL2C() is the identity; SL2C(m) copies a 2x2 matrix given as an
+    SL2C, a NumPy array or nested sequences.  Elements are m[i,j] (or
+    m[i][j]), and numpy.asarray(m) converts to an array.'''
+
+    def __cinit__(self, m=None):
+        if m is None:
+            make_eye(self.y)
+        elif isinstance(m, SL2C):
+            memcpy(self.y, (<SL2C>m).y, 8*sizeof(double))
+        else:
+            matrix_to_y(m, self.y)
+
+    def __reduce__(self):
+        return (SL2C, (self.tolist(),))
+
+    def __repr__(self):
+        return 'SL2C(%r)' % (self.tolist(),)
+
+    def __getitem__(self, idx):
+        cdef int i, j
+        if isinstance(idx, tuple):
+            i, j = idx
+            if not (0 <= i < 2 and 0 <= j < 2):
+                raise IndexError('Matrix index out of range.')
+            return self.y[4*i+2*j] + 1j*self.y[4*i+2*j+1]
+        i = idx
+        if not 0 <= i < 2:
+            raise IndexError('Matrix index out of range.')
+        return (self.y[4*i] + 1j*self.y[4*i+1], self.y[4*i+2] + 1j*self.y[4*i+3])
+
+    def __len__(self):
+        return 2
+
+    def __array__(self, dtype=None, copy=None):
+        m = numpy.empty((2,2), dtype=complex)
+        matrix_from_y(self.y, m)
+        if dtype is not None:
+            m = m.astype(dtype)
+        return m
+
+    def tolist(self):
+        '''The matrix as nested lists'''
+        return [ [ self.y[0] + 1j*self.y[1], self.y[2] + 1j*self.y[3] ],
+                 [ self.y[4] + 1j*self.y[5], self.y[6] + 1j*self.y[7] ] ]
+
+    def trace(self):
+        '''Trace of the matrix'''
+        return (self.y[0] + self.y[6]) + 1j*(self.y[1] + self.y[7])
+
+    def det(self):
+        '''Determinant of the matrix'''
+        return (self.y[0] + 1j*self.y[1])*(self.y[6] + 1j*self.y[7]) - \
+               (self.y[2] + 1j*self.y[3])*(self.y[4] + 1j*self.y[5])
+
+    def inverse(self):
+        '''Inverse of the matrix, assuming it has determinant 1'''
+        cdef SL2C res = SL2C.__new__(SL2C)
+        res.y[0] = self.y[6]
+        res.y[1] = self.y[7]
+        res.y[2] = -self.y[2]
+        res.y[3] = -self.y[3]
+        res.y[4] = -self.y[4]
+        res.y[5] = -self.y[5]
+        res.y[6] = self.y[0]
+        res.y[7] = self.y[1]
+        return res
+
+    def __mul__(x, y):
+        if not (isinstance(x, SL2C) and isinstance(y, SL2C)):
+            return NotImplemented
+        cdef SL2C res = SL2C.__new__(SL2C)
+        mul_y((<SL2C>x).y, (<SL2C>y).y, res.y)
+        return res
+
+    def imul(self, SL2C other):
+        '''Replace the matrix by its product with other (on the right),
+        in place; returns self'''
+        cdef double tmp[8]
+        mul_y(self.y, other.y, tmp)
+        memcpy(self.y, tmp, 8*sizeof(double))
+        return self
+
+    def set_identity(self):
+        '''Replace the matrix by the identity, in place'''
+        make_eye(self.y)
+
+# Step schedules: the sizes of the steps accepted by the adaptive
+# integrator along a segment.  For nearby values of C the same steps
+# can be replayed without step size control, checking only the error
+# estimate of each step.
+cdef int sched_append(step_schedule *sched, double h) nogil:
+    cdef double *newh
+    if sched.n == sched.cap:
+        newh = <double *>realloc(sched.h, 2*(sched.cap+8)*sizeof(double))
+        if newh == NULL:
+            return -1
+        sched.h = newh
+        sched.cap = 2*(sched.cap+8)
+    sched.h[sched.n] = h
+    sched.n = sched.n + 1
+    return 0
+
+cdef class _Schedule:
+    '''Step schedule for one segment'''
+    def __cinit__(self):
+        self.s.h = NULL
+        self.s.n = 0
+        self.s.cap = 0
+
+    def __dealloc__(self):
+        free(self.s.h)
+
+cdef class _ScheduleList:
+    '''Step schedules for the segments of a polygonal path'''
+    def __cinit__(self, int n):
+        self.n = n
+        self.ptrs = <step_schedule **>calloc(n+1, sizeof(step_schedule *))
+        if self.ptrs == NULL:
+            raise MemoryError()
+        self.refs = []
+
+    def __dealloc__(self):
+        free(self.ptrs)
+
+cdef inline void store_matrix(double complex *m, double *y) nogil:
+    m[0] = y[0] + 1j*y[1]
+    m[1] = y[2] + 1j*y[3]
+    m[2] = y[4] + 1j*y[5]
+    m[3] = y[6] + 1j*y[7]
+
+cdef inline void store_nan(double complex *m) nogil:
+    m[0] = NAN
+    m[1] = NAN
+    m[2] = NAN
+    m[3] = NAN
+
+cdef inline void stats_record(int_stats *st, long accepted, long rejected, double hmin, int ok) nogil:
+    # Add the counts for one segment to st
+    st.segments = st.segments + 1
+    st.accepted = st.accepted + accepted
+    st.rejected = st.rejected + rejected
+    if not ok:
+        st.failed = st.failed + 1
+    if hmin < st.hmin:
+        st.hmin = hmin
+
+cdef inline void stats_clear(int_stats *st) nogil:
+    st.accepted = 0
+    st.rejected = 0
+    st.segments = 0
+    st.failed = 0
+    st.hmin = INFINITY
+
 cdef class pcint:
-    '''Integrate a projective connection along a segment, for the 4-punctured sphere universal family'''
-    cdef gsl_odeiv_step *step
-    cdef gsl_odeiv_control *control
-    cdef gsl_odeiv_evolve *evolve
-    cdef gsl_odeiv_system sys
-    cdef pc_seg_odef_params P
-    cdef double initstep
-    cdef int maxstep
-
-    def __cinit__(self, double atol=0.00001, double rtol=0.0, double initstep=0.01, int maxstep=5000):
+    '''Integrate a projective connection along a segment, for the 4-punctured sphere universal family
+
+    The ODE is solved by GSL's adaptive rk8pd integrator, or by a
+    Magnus integrator of order 4 or 6 (method='magnus4' or
+    'magnus6'), which is usually much faster for large C.
+
+    The attribute nsteps counts the steps taken by successful segment
+    integrations; it may be reset to 0 at any time.  If collect_stats
+    is true, more detailed counts are kept (see stats()), and if it is
+    'segments', also a record for each segment integrated (see
+    segment_stats()).'''
+
+    def __cinit__(self, double atol=0.00001, double rtol=0.0, double initstep=0.01, int maxstep=5000, reuse_steps=False,
+                  method='rk8pd', collect_stats=False):
+        if method not in _METHODS:
+            raise ValueError('Unknown integration method %s, must be one of %s.' % (method, ', '.join(sorted(_METHODS))))
+        self.method = _METHODS[method]
+        self.atol = atol
+        self.rtol = rtol
         self.initstep = initstep
         self.maxstep = maxstep
+        self.reuse_steps = 1 if reuse_steps else 0
+        self.schedules = {}
+        self.nsteps = 0
+        if collect_stats == 'segments':
+            self.collect_stats = 2
+        else:
+            self.collect_stats = 1 if collect_stats else 0
+        stats_clear(&self.st)
+        self.records = NULL
+        self.nrecords = 0
+        self.reccap = 0
         self.step = gsl_odeiv_step_alloc(gsl_odeiv_step_rk8pd, 8)  # (type, rank)
         self.control = gsl_odeiv_control_standard_new(atol, rtol, 0.0, 0.0)
         self.evolve  = gsl_odeiv_evolve_alloc(8)
@@ -102,6 +484,15 @@ cdef class pcint:
         self.sys.jacobian = NULL
         self.sys.dimension = 8
         self.sys.params = &self.P
+        # The solver for the variational system is allocated on first
+        # use (see _alloc_var), since few integrators need it
+        self.vstep = NULL
+        self.vcontrol = NULL
+        self.vevolve = NULL
+        self.vsys.function = pc_seg_odef_var
+        self.vsys.jacobian = NULL
+        self.vsys.dimension = 16
+        self.vsys.params = &self.P
     
     def __dealloc__(self):
         if self.step != NULL:
@@ -110,19 +501,351 @@ cdef class pcint:
             gsl_odeiv_control_free(self.control)
         if self.evolve != NULL:
             gsl_odeiv_evolve_free(self.evolve)
+        if self.vstep != NULL:
+            gsl_odeiv_step_free(self.vstep)
+        if self.vcontrol != NULL:
+            gsl_odeiv_control_free(self.vcontrol)
+        if self.vevolve != NULL:
+            gsl_odeiv_evolve_free(self.vevolve)
+        free(self.records)
 
-    def seg_int(self, L, C, p0, p1, init=None, maxstep=None):
-        self.P.L = gsl_complex_rect(L.real, L.imag)
-        self.P.C = gsl_complex_rect(C.real, C.imag)
+    cdef int _alloc_var(self) except -1:
+        # Allocate the rk8pd solver for the variational system, if not
+        # done already
+        if self.vstep == NULL:
+            self.vstep = gsl_odeiv_step_alloc(gsl_odeiv_step_rk8pd, 16)
+        if self.vcontrol == NULL:
+            self.vcontrol = gsl_odeiv_control_standard_new(self.atol, self.rtol, 0.0, 0.0)
+        if self.vevolve == NULL:
+            self.vevolve = gsl_odeiv_evolve_alloc(16)
+        if self.vstep == NULL or self.vcontrol == NULL or self.vevolve == NULL:
+            raise MemoryError()
+        return 0
+
+    def clear_schedules(self):
+        '''Forget all recorded step schedules'''
+        self.schedules = {}
+
+    def stats(self):
+        '''Statistics of the segment integrations since the last call to
+        reset_stats(), if collect_stats is enabled: a dict with the
+        numbers of accepted and rejected steps, of segments, and of
+        failed segments (including those exceeding maxstep), and the
+        smallest step size used, hmin (ignoring the final step of a
+        segment, which is shortened to end at the endpoint).'''
+        return { 'accepted': self.st.accepted,
+                 'rejected': self.st.rejected,
+                 'segments': self.st.segments,
+                 'failed': self.st.failed,
+                 'hmin': self.st.hmin }
+
+    def segment_stats(self):
+        '''Record of each segment integration since the last call to
+        reset_stats(), if collect_stats is 'segments': a list of tuples
+        (C, p0, p1, accepted, rejected, hmin, ok), with the counts of
+        stats() for that segment, and ok false if it failed.'''
+        cdef long k
+        cdef seg_record *r
+        res = []
+        for k in range(self.nrecords):
+            r = &self.records[k]
+            res.append((r.C, r.p0, r.p1, r.accepted, r.rejected, r.hmin, bool(r.ok)))
+        return res
+
+    def reset_stats(self):
+        '''Set all statistics to zero'''
+        stats_clear(&self.st)
+        self.nrecords = 0
+
+    cdef void _stats_record(self, double complex p0, double complex p1, long accepted, long rejected,
+                            double hmin, int ok) nogil:
+        # Add the counts for one segment to the statistics, and to the
+        # segment records if they are kept (dropping the record if
+        # there is no memory for it)
+        cdef seg_record *newr
+        cdef seg_record *r
+        stats_record(&self.st, accepted, rejected, hmin, ok)
+        if self.collect_stats < 2:
+            return
+        if self.nrecords == self.reccap:
+            newr = <seg_record *>realloc(self.records, 2*(self.reccap+8)*sizeof(seg_record))
+            if newr == NULL:
+                return
+            self.records = newr
+            self.reccap = 2*(self.reccap+8)
+        r = &self.records[self.nrecords]
+        r.C = GSL_REAL(self.P.C) + 1j*GSL_IMAG(self.P.C)
+        r.p0 = p0
+        r.p1 = p1
+        r.accepted = accepted
+        r.rejected = rejected
+        r.hmin = hmin
+        r.ok = ok
+        self.nrecords = self.nrecords + 1
+
+    cdef _Schedule _schedule(self, L, p0, p1):
+        # Step schedule for a segment, or None if reuse_steps is off
+        if not self.reuse_steps:
+            return None
+        key = (complex(L), complex(p0), complex(p1))
+        sc = self.schedules.get(key)
+        if sc is None:
+            sc = _Schedule()
+            self.schedules[key] = sc
+        return sc
+
+    cdef _ScheduleList _path_schedules(self, L, verts, close):
+        # Step schedules for the segments of a path, or None if
+        # reuse_steps is off
+        if not self.reuse_steps:
+            return None
+        cdef int nverts = len(verts)
+        cdef int k
+        cdef _Schedule sc
+        cdef _ScheduleList sl = _ScheduleList(nverts)
+        for k in range(nverts):
+            if k < nverts-1:
+                sc = self._schedule(L, verts[k], verts[k+1])
+            elif close and nverts > 1:
+                sc = self._schedule(L, verts[k], verts[0])
+            else:
+                break
+            sl.refs.append(sc)
+            sl.ptrs[k] = &sc.s
+        return sl
+
+    cdef int _seg(self, double y[], double complex p0, double complex p1, int maxstep, step_schedule *sched) nogil:
+        # Integrate along one segment, updating y in place.  L and C
+        # must already be set in self.P.  If sched is not NULL, replay
+        # the steps it contains, or record a new schedule if that
+        # fails.  Returns GSL_SUCCESS or -1.
         self.P.p0 = gsl_complex_rect(p0.real, p0.imag)
         self.P.p1 = gsl_complex_rect(p1.real, p1.imag)
 
-        cdef double t, h, y[8]
+        if self.method != METHOD_RK8PD:
+            return self._seg_magnus(y, p0, p1, maxstep)
+
+        cdef double t, h, hadj, tprev
+        cdef double y0[8]
+        cdef double yerr[8]
+        cdef double dydt[8]
+        cdef int status
+        cdef int n, i
+
+        cdef long rejected = 0
+        cdef double hmin = INFINITY
+        cdef size_t failed0
+
+        if sched != NULL and sched.n > 0:
+            for i in range(8):
+                y0[i] = y[i]
+            t = 0.0
+            status = GSL_SUCCESS
+            for n in range(sched.n):
+                if n == sched.n - 1:
+                    h = 1.0 - t
+                else:
+                    h = sched.h[n]
+                    if h < hmin:
+                        hmin = h
+                status = gsl_odeiv_step_apply(self.step, t, h, y, yerr, NULL, dydt, &self.sys)
+                if status != GSL_SUCCESS:
+                    break
+                hadj = h
+                if gsl_odeiv_control_hadjust(self.control, self.step, y, yerr, dydt, &hadj) == GSL_ODEIV_HADJ_DEC:
+                    status = -1
+                    break
+                t = t + h
+            if status == GSL_SUCCESS:
+                self.nsteps = self.nsteps + sched.n
+                if self.collect_stats:
+                    self._stats_record(p0, p1, sched.n, 0, hmin, 1)
+                return GSL_SUCCESS
+            # Replay failed; start over with adaptive steps
+            for i in range(8):
+                y[i] = y0[i]
+            rejected = 1
+            hmin = INFINITY
+
         t = 0.0
         h = self.initstep
+        if sched != NULL:
+            sched.n = 0
+
+        n = 0
+        status = GSL_SUCCESS
+        failed0 = self.evolve.failed_steps
+        while (t < 1.0) and (n < maxstep):
+            tprev = t
+            status = gsl_odeiv_evolve_apply(self.evolve,
+                                            self.control,
+                                            self.step,
+                                            &self.sys,
+                                            &t, 1.0, &h, y)
+
+            if (status != GSL_SUCCESS):
+                break
+
+            n = n + 1
+            if sched != NULL:
+                if sched_append(sched, t - tprev) != 0:
+                    sched = NULL
+            if (t < 1.0) and (t - tprev < hmin):
+                hmin = t - tprev
+
+        if self.collect_stats:
+            self._stats_record(p0, p1, n, rejected + self.evolve.failed_steps - failed0, hmin,
+                               (n < maxstep) and (status == GSL_SUCCESS))
+
+        if (n == maxstep) or (status != GSL_SUCCESS):
+            if sched != NULL:
+                sched.n = 0
+            return -1
+
+        self.nsteps = self.nsteps + n
+        return GSL_SUCCESS
+
+    @cython.cdivision(True)
+    cdef int _seg_magnus(self, double y[], double complex p0, double complex p1, int maxstep) nogil:
+        # Integrate along one segment with a Magnus integrator, updating
+        # y in place.  Returns GSL_SUCCESS or -1.
+        cdef double complex L = GSL_REAL(self.P.L) + 1j*GSL_IMAG(self.P.L)
+        cdef double complex C = GSL_REAL(self.P.C) + 1j*GSL_IMAG(self.P.C)
+        cdef double complex a = p1 - p0
+        cdef double complex Y[4]
+        cdef double complex Yfull[4]
+        cdef double complex Yhalf[4]
+        cdef double complex Ytmp[4]
+        cdef double t = 0.0
+        cdef double h = self.initstep
+        cdef double err, e, fac
+        cdef int n = 0
+        cdef int attempts = 0
+        cdef int last
+        cdef int i
+        cdef int order = self.method
+        cdef double hmin = INFINITY
+
+        for i in range(4):
+            Y[i] = y[2*i] + 1j*y[2*i+1]
+
+        while (t < 1.0) and (n < maxstep):
+            attempts = attempts + 1
+            if (attempts > 10*maxstep) or (h < MAGNUS_HMIN):
+                if self.collect_stats:
+                    self._stats_record(p0, p1, n, attempts - 1 - n, hmin, 0)
+                return -1
+            last = 0
+            if t + h >= 1.0:
+                h = 1.0 - t
+                last = 1
+
+            # One full step and two half steps
+            magnus_step(Y, p0, a, L, C, t, h, order, Yfull)
+            magnus_step(Y, p0, a, L, C, t, 0.5*h, order, Ytmp)
+            magnus_step(Ytmp, p0, a, L, C, t + 0.5*h, 0.5*h, order, Yhalf)
 
-        if init == None:
+            err = 0.0
+            for i in range(4):
+                e = abs(Yfull[i] - Yhalf[i]) / (self.atol + self.rtol*abs(Yhalf[i]))
+                if e > err:
+                    err = e
+
+            if err <= 1.0:
+                for i in range(4):
+                    Y[i] = Yhalf[i]
+                if last:
+                    t = 1.0
+                else:
+                    t = t + h
+                    if h < hmin:
+                        hmin = h
+                n = n + 1
+                fac = 4.0
+                if err > 0.0:
+                    fac = 0.9*pow(err, -1.0/(order+1))
+                    if fac > 4.0:
+                        fac = 4.0
+            else:
+                fac = 0.9*pow(err, -1.0/(order+1))
+                if fac < 0.2:
+                    fac = 0.2
+            h = h*fac
+
+        if self.collect_stats:
+            self._stats_record(p0, p1, n, attempts - n, hmin, t >= 1.0)
+
+        if t < 1.0:
+            return -1
+
+        for i in range(4):
+            y[2*i] = Y[i].real
+            y[2*i+1] = Y[i].imag
+        self.nsteps = self.nsteps + n
+        return GSL_SUCCESS
+
+    cdef int _seg_var(self, double y[], double complex p0, double complex p1, int maxstep) nogil:
+        # Integrate the variational system (16 components, see
+        # pc_seg_odef_var) along one segment with the adaptive rk8pd
+        # solver, updating y in place.  Returns GSL_SUCCESS or -1.
+        self.P.p0 = gsl_complex_rect(p0.real, p0.imag)
+        self.P.p1 = gsl_complex_rect(p1.real, p1.imag)
+
+        cdef double t = 0.0
+        cdef double h = self.initstep
+        cdef int n = 0
+        cdef int status = GSL_SUCCESS
+        while (t < 1.0) and (n < maxstep):
+            status = gsl_odeiv_evolve_apply(self.vevolve,
+                                            self.vcontrol,
+                                            self.vstep,
+                                            &self.vsys,
+                                            &t, 1.0, &h, y)
+            if (status != GSL_SUCCESS):
+                break
+            n = n + 1
+
+        if (n == maxstep) or (status != GSL_SUCCESS):
+            return -1
+
+        self.nsteps = self.nsteps + n
+        return GSL_SUCCESS
+
+    cdef int _path(self, double y[], double complex *verts, int nverts, int close, int maxstep,
+                   step_schedule **scheds) nogil:
+        # Integrate along a polygonal path, updating y in place.  If
+        # scheds is not NULL it holds a step schedule for each segment.
+        cdef int k
+        cdef step_schedule *sched = NULL
+        for k in range(nverts-1):
+            if scheds != NULL:
+                sched = scheds[k]
+            if self._seg(y, verts[k], verts[k+1], maxstep, sched) != GSL_SUCCESS:
+                return -1
+        if close and nverts > 1:
+            if scheds != NULL:
+                sched = scheds[nverts-1]
+            if self._seg(y, verts[nverts-1], verts[0], maxstep, sched) != GSL_SUCCESS:
+                return -1
+        return GSL_SUCCESS
+
+    def seg_int(self, L, C, p0, p1, init=None, maxstep=None, out=None):
+        '''Integrate along the segment from p0 to p1, starting from the
+        matrix init (default: identity), which may be an SL2C.
+
+        Returns the resulting matrix as nested lists, or None if the
+        integration failed.  If out is an SL2C, the result is stored in
+        it instead and out is returned; out may be the same object as
+        init, so that a path can be followed without allocating.'''
+        self.P.L = gsl_complex_rect(L.real, L.imag)
+        self.P.C = gsl_complex_rect(C.real, C.imag)
+
+        cdef double y[8]
+
+        if init is None:
             make_eye(y)
+        elif isinstance(init, SL2C):
+            memcpy(y, (<SL2C>init).y, 8*sizeof(double))
         else:
             y[0] = init[0][0].real
             y[1] = init[0][0].imag
@@ -139,53 +862,207 @@ cdef class pcint:
         else:
             MS = maxstep
 
-        cdef int status
-        cdef int n
-        n = 0
-        status = GSL_SUCCESS
-        while (t < 1.0) and (n < MS):
-            status = gsl_odeiv_evolve_apply(self.evolve,
-                                            self.control,
-                                            self.step,
-                                            &self.sys,
-                                            &t, 1.0, &h, y)
-
-            if (status != GSL_SUCCESS):
-                break
-
-            n = n + 1
+        cdef _Schedule sc = self._schedule(L, p0, p1)
+        cdef step_schedule *sched = NULL
+        if sc is not None:
+            sched = &sc.s
 
-        if (n == MS) or (status != GSL_SUCCESS):
+        if self._seg(y, p0, p1, MS, sched) != GSL_SUCCESS:
             return None
 
+        if out is not None:
+            memcpy((<SL2C?>out).y, y, 8*sizeof(double))
+            return out
+
         return [ [ y[0] + 1j*y[1], y[2] + 1j*y[3] ],
                  [ y[4] + 1j*y[5], y[6] + 1j*y[7] ] ]
 
+    def seg_int_var(self, L, C, p0, p1, init=None, dinit=None, maxstep=None):
+        '''Integrate along a segment as seg_int, together with the
+        derivative of the solution with respect to C.  The initial value
+        and its derivative are init (default: identity) and dinit
+        (default: zero).  The rk8pd solver is always used.
+
+        Returns a pair of 2x2 complex arrays (matrix, derivative), or
+        None if the integration failed.'''
+        return self.pl_int_var(L, C, [p0, p1], init=init, dinit=dinit, maxstep=maxstep)
+
+    def pl_int_var(self, L, C, verts, close=False, init=None, dinit=None, maxstep=None):
+        '''Integrate along the polygonal path with vertices verts (which
+        returns to its first vertex if close is true), together with the
+        derivative of the solution with respect to C; see seg_int_var.'''
+        cdef double y[16]
+        cdef int k, MS
+        cdef int nverts = len(verts)
+
+        self._alloc_var()
+
+        if init is None:
+            make_eye(y)
+        else:
+            matrix_to_y(init, y)
+        if dinit is None:
+            for k in range(8):
+                y[8+k] = 0.0
+        else:
+            matrix_to_y(dinit, &y[8])
+
+        if maxstep is None:
+            MS = self.maxstep
+        else:
+            MS = maxstep
+
+        self.P.L = gsl_complex_rect(L.real, L.imag)
+        self.P.C = gsl_complex_rect(C.real, C.imag)
+
+        segs = list(zip(verts[:-1], verts[1:]))
+        if close and nverts > 1:
+            segs.append((verts[-1], verts[0]))
+        for p0,p1 in segs:
+            if self._seg_var(y, p0, p1, MS) != GSL_SUCCESS:
+                return None
+
+        m = numpy.empty((2,2), dtype=complex)
+        dm = numpy.empty((2,2), dtype=complex)
+        matrix_from_y(y, m)
+        matrix_from_y(&y[8], dm)
+        return m, dm
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def pl_int_many(self, L, C, verts, close=False, maxstep=None):
+        '''Integrate along the polygonal path with vertices verts, for
+        each value in the array C.  With close=True the path returns to
+        its first vertex.
+
+        Returns an (N,2,2) complex array of holonomy matrices, where N
+        is the number of values of C.  Matrices for which the
+        integration failed are filled with nan.'''
+        cdef double complex[::1] Cv = numpy.ascontiguousarray(numpy.ravel(C), dtype=complex)
+        cdef double complex[::1] V = numpy.ascontiguousarray(verts, dtype=complex)
+        cdef int N = Cv.shape[0]
+        cdef int nverts = V.shape[0]
+        cdef int cl = 1 if close else 0
+
+        if nverts < 1:
+            raise ValueError('Path must have at least one vertex.')
+
+        res = numpy.empty((N,2,2), dtype=complex)
+        cdef double complex[:,:,::1] out = res
+
+        cdef int MS
+        if maxstep == None:
+            MS = self.maxstep
+        else:
+            MS = maxstep
+
+        self.P.L = gsl_complex_rect(L.real, L.imag)
+
+        cdef _ScheduleList sl = self._path_schedules(L, verts, close)
+        cdef step_schedule **scheds = NULL
+        if sl is not None:
+            scheds = sl.ptrs
+
+        cdef int i
+        cdef double y[8]
+        with nogil:
+            for i in range(N):
+                self.P.C = gsl_complex_rect(Cv[i].real, Cv[i].imag)
+                make_eye(y)
+                if self._path(y, &V[0], nverts, cl, MS, scheds) != GSL_SUCCESS:
+                    store_nan(&out[i,0,0])
+                else:
+                    store_matrix(&out[i,0,0], y)
+
+        return res
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def seg_int_many(self, L, C, p0, p1, maxstep=None):
+        '''Integrate along each of the segments from p0[k] to p1[k],
+        starting from the identity matrix, for a single value of C.
+
+        Returns a (K,2,2) complex array of transfer matrices, where K is
+        the number of segments.  Matrices for which the integration
+        failed are filled with nan.'''
+        cdef double complex[::1] P0 = numpy.ascontiguousarray(numpy.ravel(p0), dtype=complex)
+        cdef double complex[::1] P1 = numpy.ascontiguousarray(numpy.ravel(p1), dtype=complex)
+        cdef int K = P0.shape[0]
+
+        if P1.shape[0] != K:
+            raise ValueError('p0 and p1 must have the same length.')
 
-LAMBDA_ITER_MAX = 200
-DBL_EPSILON = 2.2204460492503131e-16
-M_PI = 3.14159265358979323846264338328
-M_PI_4 = 0.78539816339744830961566084582
+        res = numpy.empty((K,2,2), dtype=complex)
+        cdef double complex[:,:,::1] out = res
 
-cdef gsl_complex _modularlambda(gsl_complex tau):
+        cdef int MS
+        if maxstep == None:
+            MS = self.maxstep
+        else:
+            MS = maxstep
+
+        self.P.L = gsl_complex_rect(L.real, L.imag)
+        self.P.C = gsl_complex_rect(C.real, C.imag)
+
+        # Step schedules, if enabled
+        cdef _ScheduleList sl = _ScheduleList(K)
+        cdef _Schedule sc
+        cdef int k
+        if self.reuse_steps:
+            for k in range(K):
+                sc = self._schedule(L, P0[k], P1[k])
+                sl.refs.append(sc)
+                sl.ptrs[k] = &sc.s
+
+        cdef double y[8]
+        with nogil:
+            for k in range(K):
+                make_eye(y)
+                if self._seg(y, P0[k], P1[k], MS, sl.ptrs[k]) != GSL_SUCCESS:
+                    store_nan(&out[k,0,0])
+                else:
+                    store_matrix(&out[k,0,0], y)
+
+        return res
+
+
+cdef int _LAMBDA_ITER_MAX = 200
+cdef double _DBL_EPSILON = 2.2204460492503131e-16
+cdef double _M_PI = 3.14159265358979323846264338328
+cdef double _M_PI_4 = 0.78539816339744830961566084582
+
+LAMBDA_ITER_MAX = _LAMBDA_ITER_MAX
+DBL_EPSILON = _DBL_EPSILON
+M_PI = _M_PI
+M_PI_4 = _M_PI_4
+
+# Reduction of tau to the fundamental domain of PSL_2(Z), with the same
+# tolerance and limit as s04._tau_reduce
+cdef double LAMBDA_FD_EPSILON = 1e-12
+cdef enum:
+    LAMBDA_REDUCE_MAX = 100
+
+# Theta series for lambda(tau); converges quickly when Im(tau) is large.
+# Returns 0 on success, -1 if either series fails to converge.
+cdef int _modularlambda_series(gsl_complex tau, gsl_complex *L) nogil:
     cdef int n=0
 
-    cdef gsl_complex q = gsl_complex_exp(gsl_complex_mul_imag(tau,M_PI))
+    cdef gsl_complex q = gsl_complex_exp(gsl_complex_mul_imag(tau,_M_PI))
     cdef gsl_complex q2 = gsl_complex_mul(q,q)
-    cdef gsl_complex q14 = gsl_complex_exp(gsl_complex_mul_imag(tau,M_PI_4))
+    cdef gsl_complex q14 = gsl_complex_exp(gsl_complex_mul_imag(tau,_M_PI_4))
 
     cdef gsl_complex accum = gsl_complex_rect(0.0,0.0)
     cdef gsl_complex nextm = q2
     cdef gsl_complex qpower = gsl_complex_rect(1.0,0.0)
 
-    while ((gsl_complex_abs(qpower) > 2.0*DBL_EPSILON) and (n < LAMBDA_ITER_MAX)):
+    while ((gsl_complex_abs(qpower) > 2.0*_DBL_EPSILON) and (n < _LAMBDA_ITER_MAX)):
         accum = gsl_complex_add(accum, qpower)
         qpower = gsl_complex_mul(qpower, nextm)
         nextm = gsl_complex_mul(nextm, q2)
         n = n + 1
 
-    if (n >= LAMBDA_ITER_MAX):
-        return gsl_complex_rect(0.0,0.0)
+    if (n >= _LAMBDA_ITER_MAX):
+        return -1
 
     cdef gsl_complex theta2 = gsl_complex_mul_real(gsl_complex_mul(q14,accum),2.0)
   
@@ -194,22 +1071,90 @@ cdef gsl_complex _modularlambda(gsl_complex tau):
     qpower = q
   
     n = 0
-    while ((gsl_complex_abs(qpower) > 2.0*DBL_EPSILON) and (n < LAMBDA_ITER_MAX)):
+    while ((gsl_complex_abs(qpower) > 2.0*_DBL_EPSILON) and (n < _LAMBDA_ITER_MAX)):
         accum = gsl_complex_add(accum, qpower)
         qpower = gsl_complex_mul(qpower, nextm)
         nextm = gsl_complex_mul(nextm, q2)
         n = n + 1
 
-    if (n >= LAMBDA_ITER_MAX):
-        return(gsl_complex_rect(0.0,0.0));
+    if (n >= _LAMBDA_ITER_MAX):
+        return -1
 
     cdef gsl_complex theta3 = gsl_complex_mul_real(accum,2.0)
 
     cdef gsl_complex x = gsl_complex_div(theta2,theta3)
-    return gsl_complex_mul(gsl_complex_mul(x,x), gsl_complex_mul(x,x))
+    L[0] = gsl_complex_mul(gsl_complex_mul(x,x), gsl_complex_mul(x,x))
+    return 0
+
+# Compute lambda(tau) by moving tau into the fundamental domain and
+# using lambda(tau+1) = lambda/(lambda-1), lambda(-1/tau) = 1-lambda.
+# Returns 0 on success, -1 on failure (tau not in the upper half plane,
+# too many transformations, or non-convergence of the series).
+cdef int _modularlambda(gsl_complex tau, gsl_complex *L) nogil:
+    cdef int ops[2*LAMBDA_REDUCE_MAX]
+    cdef int nops = 0
+    cdef int N = 0
+    cdef double k
+    cdef gsl_complex one = gsl_complex_rect(1.0,0.0)
+
+    if not (GSL_IMAG(tau) > 0.0):
+        return -1
+
+    # ops[i] is 0 for tau -> -1/tau, 1 for an odd translation
+    while (gsl_complex_abs(tau) < 1.0 - LAMBDA_FD_EPSILON) or \
+          (fabs(GSL_REAL(tau)) > 0.5 + LAMBDA_FD_EPSILON):
+        if gsl_complex_abs(tau) < 1.0 - LAMBDA_FD_EPSILON:
+            tau = gsl_complex_div(gsl_complex_rect(-1.0,0.0),tau)
+            ops[nops] = 0
+            nops = nops + 1
+        if fabs(GSL_REAL(tau)) > 0.5 + LAMBDA_FD_EPSILON:
+            k = floor(GSL_REAL(tau) + 0.5)
+            tau = gsl_complex_sub_real(tau,k)
+            if fmod(k,2.0) != 0.0:
+                ops[nops] = 1
+                nops = nops + 1
+        N = N + 1
+        if N >= LAMBDA_REDUCE_MAX:
+            return -1
+
+    if _modularlambda_series(tau, L) != 0:
+        return -1
+
+    while nops > 0:
+        nops = nops - 1
+        if ops[nops] == 0:
+            L[0] = gsl_complex_sub(one, L[0])
+        else:
+            L[0] = gsl_complex_div(L[0], gsl_complex_sub(L[0], one))
+    return 0
 
 def modularlambda(t):
+    '''The modular lambda function, lambda(t) = (theta_2(t)/theta_3(t))^4.
+    Raises ValueError if t is not in the upper half plane or the
+    computation fails.'''
     cdef gsl_complex tau, L
     tau = gsl_complex_rect(t.real,t.imag)
-    L = _modularlambda(tau)
+    if _modularlambda(tau, &L) != 0:
+        raise ValueError('Unable to compute modular lambda function at tau=%s.' % t)
     return complex(L.dat[0],L.dat[1])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def modularlambda_many(t):
+    '''The modular lambda function of each element of the array t.
+    Entries for which the computation fails (see modularlambda) are
+    NaN.'''
+    t = numpy.asarray(t, dtype=complex)
+    shape = t.shape
+    cdef double complex[::1] T = numpy.ascontiguousarray(t.ravel())
+    res = numpy.empty(T.shape[0], dtype=complex)
+    cdef double complex[::1] R = res
+    cdef gsl_complex L
+    cdef int i
+    with nogil:
+        for i in range(T.shape[0]):
+            if _modularlambda(gsl_complex_rect(T[i].real, T[i].imag), &L) != 0:
+                R[i] = NAN
+            else:
+                R[i] = GSL_REAL(L) + 1j*GSL_IMAG(L)
+    return res.reshape(shape)
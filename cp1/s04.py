@@ -1,8 +1,17 @@
 '''Holonomy of projective structures on a four-punctured sphere'''
-from cp1.pcint import pcint, modularlambda
+from cp1.pcint import pcint, modularlambda, modularlambda_many, SL2C
+from cp1.holcache import HolonomyCache
+from cp1.parallel import run_chunks
 import cp1.contourgen as contourgen
-from numpy import trace
+from numpy import (trace, array, empty, empty_like, ravel, exp, arange, pi, isfinite,
+                   newaxis, inf, matmul, zeros, full, nan, nonzero, floor as vfloor,
+                   broadcast_arrays, unique, eye, stack, searchsorted, minimum, concatenate)
+from numpy.fft import fft
 from math import floor
+from collections import OrderedDict
+from threading import Lock
+import json
+from timeit import default_timer
 
 # izip was renamed to zip in python3
 try:
@@ -10,6 +19,12 @@ try:
 except ImportError:
     pass
 
+# getargspec was replaced by getfullargspec in python3
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:
+    from inspect import getargspec
+
 # Convention: L = lambda = 4-punctured sphere cross ratio parameter
 #             C = quadratic differential parameter
 #
@@ -26,46 +41,716 @@ class HolonomyException(Exception):
 
 class S04(object):
     '''Represents the space of CP1 structures on the Riemann sphere punctured at 0, 1, L, infinity.'''
-    def __init__(self,L=0.5,step=0.02,tol=0.000001,maxstep=5000, contours=3, fund_domain_contours=False):
+    def __init__(self,L=0.5,step=0.02,tol=0.000001,maxstep=5000, contours=3, fund_domain_contours=False,
+                 reuse_steps=False, segment_cache=None, method='rk8pd', collect_stats=False,
+                 contour_mode='rectangular', disk_cache=None, segment_threads=1):
         '''Initialize projective connection and ODE solver parameters,
-        L = lambda = Riemann surface, C = quadratic differential.'''
-        self._pcint = pcint(atol=tol, rtol=0.0, maxstep=maxstep, initstep=step)
+        L = lambda = Riemann surface, C = quadratic differential.
+
+        The ODE solver is selected by method, one of 'rk8pd' (GSL's
+        adaptive Runge-Kutta-Prince-Dormand), 'magnus4' or 'magnus6'
+        (Magnus integrators of order 4 and 6, faster for large C).
+
+        If reuse_steps is true, the step sizes chosen by the rk8pd solver
+        along each segment are recorded and replayed for later values
+        of C, as long as they still meet the tolerance.
+
+        If segment_cache is true (or a SegmentCache instance, which may
+        be shared with other S04 instances), the contours are split into
+        distinct segments which are integrated once each and cached, and
+        holonomy is computed as a product of these.  Segments which are
+        not in the cache are integrated in segment_threads threads,
+        each with its own integrator (whose statistics and recorded
+        steps are not kept).
+
+        If collect_stats is true, statistics of the integration are
+        kept, and if it is 'segments', also for each segment; see
+        stats().
+
+        The integration contours are axis-aligned polygons when
+        contour_mode is 'rectangular', or homotopic polygons keeping
+        as far as possible from the punctures, which usually need fewer
+        ODE steps, when it is 'clearance' (see contourgen.clearance).
+
+        If disk_cache is a HolonomyCache (or the path of its database),
+        traces() and traces_many() look up previously computed points
+        there, and store new ones.'''
+        self._pcint_args = dict(atol=tol, rtol=0.0, maxstep=maxstep, initstep=step,
+                                method=method, collect_stats=collect_stats)
+        self._pcint = pcint(reuse_steps=reuse_steps, **self._pcint_args)
+        self.collect_stats = collect_stats
 
         self.L = L
+        self.tol = tol
         self.fd = fund_domain_contours
 
         # Integration contours generated by functions in the contourgen module
-        if fund_domain_contours:
-            self.contours = contourgen.advanced(self.L,contours)
+        self.contours = contourgen.generate(self.L,contours,fund_domain_contours,contour_mode)
+
+        if segment_cache is True:
+            segment_cache = SegmentCache()
+        elif segment_cache is False:
+            segment_cache = None
+        self.segment_cache = segment_cache
+        self.segment_threads = segment_threads
+        if segment_cache is not None:
+            self._segs, self._paths = contourgen.split_segments(self.contours)
+        self.contour_time = [ 0.0 for gamma in self.contours ]
+
+        if isinstance(disk_cache,str):
+            disk_cache = HolonomyCache(disk_cache)
+        self.disk_cache = disk_cache
+        # Everything but L and C which determines the traces
+        self._settings = _settings_json(dict(step=step, tol=tol, maxstep=maxstep, contours=contours,
+                                             fund_domain_contours=fund_domain_contours,
+                                             reuse_steps=reuse_steps, segment_cache=segment_cache,
+                                             method=method, contour_mode=contour_mode))
+        # Everything but L, C and the endpoints which determines the
+        # transfer matrix of a segment
+        self._segment_settings = json.dumps(dict(step=step, tol=tol, maxstep=maxstep,
+                                                 reuse_steps=bool(reuse_steps), method=method),
+                                            sort_keys=True)
+        if segment_cache is not None:
+            self._segment_keys = [ (L,p0,p1,self._segment_settings) for p0,p1 in self._segs ]
+
+    def _integrate_segments(self,integ,jobs):
+        # Transfer matrices for the jobs (i, C), where i indexes
+        # self._segs and C is an array of values: a list of arrays of
+        # shape (len(C),2,2), nan where the integration failed.
+        # Different jobs run concurrently if segment_threads > 1.
+        res = [ None for job in jobs ]
+        def work(state,k0,k1):
+            for k in range(k0,k1):
+                i, C = jobs[k]
+                res[k] = (integ if state is None else state).pl_int_many(self.L,C,self._segs[i])
+        if self.segment_threads > 1 and len(jobs) > 1:
+            run_chunks(work,len(jobs),self.segment_threads,chunk_size=1,
+                       init=lambda: pcint(**self._pcint_args))
         else:
-            self.contours = contourgen.simple(self.L,contours)
+            work(None,0,len(jobs))
+        return res
+
+    def _segment_mats(self,integ,C):
+        # Transfer matrices of the distinct segments for one C, from the
+        # cache where possible; the others are integrated with the
+        # integrator integ
+        mats = self._segment_mats_many(integ,array([C],dtype=complex))
+        for (p0,p1),m in zip(self._segs,mats):
+            if not isfinite(m).all():
+                raise HolonomyException('Integration failed, p0=%s, p1=%s, L=%s, C=%s, fd=%s' % (p0,p1,self.L,C,self.fd))
+        return [ m[0] for m in mats ]
+
+    def _segment_mats_many(self,integ,C):
+        # Array version of _segment_mats: an (N,2,2) array for each
+        # segment, nan where the integration failed (not cached).  The
+        # cache is searched once per segment for the whole array.
+        mats = []
+        jobs = []
+        for i,key in enumerate(self._segment_keys):
+            m, found = self.segment_cache.get_many(key,C)
+            mats.append(m)
+            missing = nonzero(~found)[0]
+            if len(missing):
+                jobs.append((i,missing))
+        res = self._integrate_segments(integ,[ (i,C[missing]) for i,missing in jobs ])
+        for (i,missing),r in zip(jobs,res):
+            mats[i][missing] = r
+            ok = isfinite(r).all(axis=(1,2))
+            self.segment_cache.put_many(self._segment_keys[i],C[missing[ok]],r[ok])
+        return mats
+
+    def _path_products(self,mats):
+        # Holonomy of each contour as a product of segment matrices
+        # (also works for stacks of matrices, one per value of C)
+        res = []
+        for path in self._paths:
+            m = None
+            for i,rev in path:
+                s = _sl2_inverse(mats[i]) if rev else mats[i]
+                m = s if m is None else matmul(m,s)
+            res.append(m)
+        return res
 
     def pl_hol(self,vertlist,C,close=False):
         '''Compute holonomy of a piecewise linear path specified a list of vertices'''
+        return self._pl_hol(self._pcint,vertlist,C,close).tolist()
+
+    def _pl_hol(self,integ,vertlist,C,close):
         if close:
-            vertlist.append(vertlist[0])
-        m = [[1.0+0j,0.0j],[0.0j,1.0+0j]]
+            vertlist = list(vertlist) + [vertlist[0]]
+        m = SL2C()
         for p0,p1 in zip(vertlist[:-1],vertlist[1:]):
-            m = self._pcint.seg_int(self.L,C,p0,p1,init=m)
-            if m is None:
+            # The matrix is updated in place
+            if integ.seg_int(self.L,C,p0,p1,init=m,out=m) is None:
                 raise HolonomyException('Integration failed, p0=%s, p1=%s, L=%s, C=%s, fd=%s' % (p0,p1,self.L,C,self.fd))
         return m
 
     def gens(self,C):
-        '''Compute matrix generators for the holonomy group'''
+        '''Compute matrix generators for the holonomy group, as nested
+        lists (see gens_sl2c())'''
         # This function is hard to test; generators are not canonical.
-        return [ self.pl_hol(gamma,C,close=True) for gamma in self.contours ]
+        return [ m.tolist() for m in S04._gens_with(self,self._pcint,C) ]
+
+    def gens_sl2c(self,C):
+        '''Compute matrix generators for the holonomy group, as a list
+        of SL2C matrices (use numpy.asarray() for arrays)'''
+        return S04._gens_with(self,self._pcint,C)
+
+    def _gens_with(self,integ,C):
+        # As gens(), using the integrator integ
+        if self.segment_cache is not None:
+            return [ SL2C(m) for m in self._path_products(self._segment_mats(integ,C)) ]
+        res = []
+        for k,gamma in enumerate(self.contours):
+            t0 = default_timer()
+            res.append(self._pl_hol(integ,gamma,C,close=True))
+            self.contour_time[k] += default_timer() - t0
+        return res
 
     def traces(self,C):
         '''Compute traces of holonomy group generators'''
-        return [ trace(m) for m in self.gens(C) ]
+        return self._traces_with(self._pcint,C)
+
+    def _traces_with(self,integ,C):
+        # As traces(), using the integrator integ
+        if self.disk_cache is not None:
+            res = self.disk_cache.get(self._settings,self.L,C,len(self.contours))
+            if res is not None:
+                return res
+        res = [ m.trace() for m in S04._gens_with(self,integ,C) ]
+        if self.disk_cache is not None:
+            self.disk_cache.put(self._settings,self.L,C,res)
+        return res
+
+    def gens_many(self,C):
+        '''Compute matrix generators for an array of values of C.
+
+        Returns an (N,n,2,2) complex array, where N is the number of
+        values of C and n the number of contours.  Matrices for which
+        the integration failed are filled with nan.'''
+        C = ravel(array(C,dtype=complex))
+        res = empty((len(C),len(self.contours),2,2),dtype=complex)
+        if self.segment_cache is not None:
+            for k,m in enumerate(self._path_products(self._segment_mats_many(self._pcint,C))):
+                res[:,k] = m
+            return res
+        for k,gamma in enumerate(self.contours):
+            t0 = default_timer()
+            res[:,k] = self._pcint.pl_int_many(self.L,C,gamma,close=True)
+            self.contour_time[k] += default_timer() - t0
+        return res
+
+    def traces_many(self,C):
+        '''Compute traces of holonomy group generators for an array of
+        values of C; returns an (N,n) complex array (nan where the
+        integration failed)'''
+        if self.disk_cache is None:
+            m = S04.gens_many(self,C)
+            return m[...,0,0] + m[...,1,1]
+        C = ravel(array(C,dtype=complex))
+        res, found = self.disk_cache.get_many(self._settings,self.L,C,len(self.contours))
+        todo = nonzero(~found)[0]
+        if len(todo):
+            m = S04.gens_many(self,C[todo])
+            res[todo] = m[...,0,0] + m[...,1,1]
+            self.disk_cache.put_many(self._settings,self.L,C[todo],res[todo])
+        return res
+
+    def gens_jacobian(self,C):
+        '''Compute matrix generators for the holonomy group together with
+        their derivatives with respect to C.  Returns a pair of lists of
+        2x2 arrays (gens, derivatives).  The variational equations are
+        integrated with the rk8pd solver, whatever the method.'''
+        gens = []
+        dgens = []
+        for k,gamma in enumerate(self.contours):
+            t0 = default_timer()
+            res = self._pcint.pl_int_var(self.L,C,gamma,close=True)
+            self.contour_time[k] += default_timer() - t0
+            if res is None:
+                raise HolonomyException('Variational integration failed, L=%s, C=%s, fd=%s' % (self.L,C,self.fd))
+            gens.append(res[0])
+            dgens.append(res[1])
+        return gens, dgens
+
+    def trace_jacobian(self,C):
+        '''Compute traces of holonomy group generators and their
+        derivatives with respect to C; returns a pair of lists (traces,
+        derivatives)'''
+        gens, dgens = S04.gens_jacobian(self,C)
+        return [ trace(m) for m in gens ], [ trace(dm) for dm in dgens ]
+
+    def solve_C_for_trace(self,target,index,C0=0.0,trace_tol=1e-10,maxiter=50):
+        '''Find C near C0 for which trace number index (as returned by
+        trace_jacobian) equals target, by damped Newton iteration.
+        Raises HolonomyException if the iteration fails to get the trace
+        to within trace_tol of target.'''
+        C = complex(C0)
+        traces, dtraces = self.trace_jacobian(C)
+        f = traces[index] - target
+        for n in range(maxiter):
+            if abs(f) < trace_tol:
+                return C
+            if dtraces[index] == 0:
+                raise HolonomyException('Zero derivative of trace %d at C=%s' % (index,C))
+            step = f/dtraces[index]
+            # Halve the step until the residual decreases
+            for k in range(30):
+                C1 = C - step
+                traces1, dtraces1 = self.trace_jacobian(C1)
+                f1 = traces1[index] - target
+                if abs(f1) < abs(f):
+                    break
+                step = 0.5*step
+            else:
+                raise HolonomyException('Newton iteration for trace %d stalled at C=%s' % (index,C))
+            C, f, dtraces = C1, f1, dtraces1
+        if abs(f) < trace_tol:
+            return C
+        raise HolonomyException('Newton iteration for trace %d did not converge from C0=%s' % (index,C0))
+
+    def traces_along(self,path,max_change=0.05,min_spacing=1e-6):
+        '''Generator of (C, traces) for points C along the polygonal path
+        in the C plane with the given vertices, starting at the first
+        vertex and including all vertices.
+
+        The spacing of the points is adapted so that no trace changes
+        by more than max_change (relative to its size, if larger than 1)
+        between consecutive points, unless the spacing would be less
+        than min_spacing.  Consecutive points are computed by replaying
+        the ODE steps used for the previous one, which is much faster
+        than independent evaluations.'''
+        # A private integrator, so that the recorded steps are not
+        # used by other callers of this instance
+        integ = pcint(reuse_steps=True, **self._pcint_args)
+
+        def evaluate(C):
+            return self._traces_with(integ,C)
+
+        path = [ complex(C) for C in path ]
+        if not path:
+            return
+        C0 = path[0]
+        T0 = evaluate(C0)
+        yield C0, T0
+        spacing = None
+        for P in path[1:]:
+            while C0 != P:
+                if spacing is None:
+                    spacing = abs(P - C0)
+                d = abs(P - C0)
+                if spacing >= d:
+                    C1 = P
+                    step = d
+                else:
+                    C1 = C0 + spacing*(P - C0)/d
+                    step = spacing
+                T1 = evaluate(C1)
+                change = max( abs(t1 - t0)/max(1.0,abs(t0)) for t0,t1 in zip(T0,T1) )
+                # Compare the intended step, not the distance recomputed
+                # from C1, which may round to just above min_spacing
+                if change > max_change and step > min_spacing:
+                    spacing = max(0.5*step,min_spacing)
+                    continue
+                yield C1, T1
+                if change > 0.0:
+                    spacing = step*min(2.0,0.9*max_change/change)
+                else:
+                    spacing = 2.0*step
+                spacing = max(spacing,min_spacing)
+                C0, T0 = C1, T1
+
+    def stats(self):
+        '''Statistics of the integration since the last call to
+        reset_stats(): the counts of pcint.stats() (zero unless
+        collect_stats is enabled), and contour_time, the time in seconds
+        spent integrating along each contour (not recorded when segments
+        are cached, since they are shared between contours).
+
+        If collect_stats is 'segments', segment_stats is a list with a
+        dict for each segment integration, in order, with the keys C,
+        p0, p1, accepted, rejected, hmin and ok of
+        pcint.segment_stats(), and contours, the indices of the
+        contours containing the segment.'''
+        res = self._pcint.stats()
+        res['contour_time'] = list(self.contour_time)
+        if self.collect_stats == 'segments':
+            owners = self._segment_contours()
+            res['segment_stats'] = [ dict(C=C, p0=p0, p1=p1, accepted=accepted, rejected=rejected,
+                                          hmin=hmin, ok=ok, contours=owners.get((p0,p1),()))
+                                     for C,p0,p1,accepted,rejected,hmin,ok in self._pcint.segment_stats() ]
+        return res
+
+    def _segment_contours(self):
+        # Dict taking each segment (p0,p1) integrated by this instance
+        # to the tuple of indices of the contours containing it
+        owners = {}
+        def add(p0,p1,k):
+            for seg in [ (p0,p1), (p1,p0) ]:
+                if k not in owners.setdefault(seg,()):
+                    owners[seg] += (k,)
+        for k,gamma in enumerate(self.contours):
+            for p0,p1 in zip(gamma,list(gamma[1:]) + [gamma[0]]):
+                add(complex(p0),complex(p1),k)
+        if self.segment_cache is not None:
+            for k,path in enumerate(self._paths):
+                for i,rev in path:
+                    p0, p1 = self._segs[i]
+                    add(complex(p0),complex(p1),k)
+        return owners
+
+    def reset_stats(self):
+        '''Set all statistics to zero'''
+        self._pcint.reset_stats()
+        self.contour_time = [ 0.0 for gamma in self.contours ]
+
+    def surrogate(self,center,radius,degree=32,rho=2.0):
+        '''Fit polynomials in C to the traces on the disk with given
+        center and radius; see TraceSurrogate'''
+        return TraceSurrogate(self,center,radius,degree,rho)
+
+class LRUCache(object):
+    '''Bounded mapping which discards the least recently used entries
+    when full, and counts hits and misses.  It may be used from several
+    threads.'''
+    def __init__(self,maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self,key):
+        '''Cached value for key, or None'''
+        with self._lock:
+            m = self._data.pop(key,None)
+            if m is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data[key] = m
+            return m
+
+    def put(self,key,m):
+        '''Store a value, discarding the least recently used ones if
+        the cache is full'''
+        with self._lock:
+            self._data.pop(key,None)
+            self._data[key] = m
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def resize(self,maxsize):
+        '''Change the maximum number of entries'''
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+class _SegmentMats(object):
+    # Transfer matrices of one segment for several values of C: a part
+    # sorted by C, searched by bisection, and a short unsorted tail of
+    # recent additions, merged into it when it grows
+    TAIL = 256
+
+    def __init__(self):
+        self.C = empty(0,dtype=complex)
+        self.mats = empty((0,2,2),dtype=complex)
+        # Order of addition of each entry of the sorted part
+        self.age = empty(0,dtype=int)
+        self.added = 0
+        self.tailC = []
+        self.tailmats = []
+
+    def __len__(self):
+        return len(self.C) + len(self.tailC)
+
+    def lookup(self,C):
+        res = full((len(C),2,2),nan,dtype=complex)
+        found = zeros(len(C),dtype=bool)
+        if len(self.C):
+            i = minimum(searchsorted(self.C,C),len(self.C)-1)
+            found = self.C[i] == C
+            res[found] = self.mats[i[found]]
+        if self.tailC:
+            # The tail is newer than the sorted part, and its latest
+            # entry wins if C was added several times
+            eq = C[:,newaxis] == array(self.tailC[::-1])[newaxis,:]
+            j = len(self.tailC) - 1 - eq.argmax(axis=1)
+            intail = eq.any(axis=1)
+            res[intail] = array(self.tailmats)[j[intail]]
+            found |= intail
+        return res, found
+
+    def add(self,C,mats):
+        self.tailC.extend(C)
+        self.tailmats.extend(mats)
+        if len(self.tailC) > self.TAIL:
+            self.keep(len(self))
+
+    def keep(self,n):
+        # Merge the tail into the sorted part, keeping the latest matrix
+        # for each C, and only the n values of C added most recently
+        ntail = len(self.tailC)
+        C = concatenate([self.C,array(self.tailC,dtype=complex)])
+        mats = concatenate([self.mats,array(self.tailmats,dtype=complex).reshape(-1,2,2)])
+        age = concatenate([self.age,arange(self.added,self.added+ntail)])
+        self.added += ntail
+        # Newest first, so that unique() finds the latest entry for each C
+        order = age.argsort()[::-1]
+        first = unique(C[order],return_index=True)[1]
+        first.sort()
+        sel = order[first[:n]]
+        sel = sel[C[sel].argsort()]
+        self.C = C[sel]
+        self.mats = mats[sel]
+        self.age = age[sel]
+        self.tailC = []
+        self.tailmats = []
+
+class SegmentCache(LRUCache):
+    '''Bounded cache of transfer matrices of segments, keyed by
+    (L, C, p0, p1, settings), where settings describes the ODE solver
+    (tolerance, step, maxstep, method); may be shared by several S04
+    instances, whatever their settings.
+
+    The matrices are stored by segment (L, p0, p1, settings), for all
+    values of C together, so that get_many() finds a whole array of C
+    at once.  maxsize is the number of matrices; when it is exceeded,
+    the least recently used segments are discarded with all their
+    matrices.'''
+    def __init__(self,maxsize=100000):
+        LRUCache.__init__(self,maxsize)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def get_many(self,key,C):
+        '''Matrices for the segment key = (L, p0, p1, settings) and the
+        array of values C: an (N,2,2) array, nan where there is no entry,
+        and a boolean array which is true where there is one.'''
+        with self._lock:
+            block = self._data.pop(key,None)
+            if block is None:
+                self.misses += len(C)
+                return full((len(C),2,2),nan,dtype=complex), zeros(len(C),dtype=bool)
+            self._data[key] = block
+            res, found = block.lookup(C)
+            nfound = int(found.sum())
+            self.hits += nfound
+            self.misses += len(C) - nfound
+            return res, found
+
+    def put_many(self,key,C,mats):
+        '''Store the (N,2,2) array of matrices for the segment key and
+        the array of values C'''
+        with self._lock:
+            block = self._data.pop(key,None)
+            if block is None:
+                block = _SegmentMats()
+            self._size -= len(block)
+            block.add(C,mats)
+            self._size += len(block)
+            self._data[key] = block
+            self._shrink()
+
+    def get(self,key):
+        '''Cached matrix for key = (L, C, p0, p1, settings), or None'''
+        L, C, p0, p1, settings = key
+        res, found = self.get_many((L,p0,p1,settings),array([C],dtype=complex))
+        return res[0] if found[0] else None
+
+    def put(self,key,m):
+        '''Store the matrix for key = (L, C, p0, p1, settings)'''
+        L, C, p0, p1, settings = key
+        self.put_many((L,p0,p1,settings),array([C],dtype=complex),array(m,dtype=complex).reshape(1,2,2))
+
+    def _shrink(self):
+        # Discard the least recently used segments until there are at
+        # most maxsize matrices, and then the oldest matrices of the
+        # last segment if necessary
+        while self._size > self.maxsize and len(self._data) > 1:
+            key, block = self._data.popitem(last=False)
+            self._size -= len(block)
+        if self._size > self.maxsize:
+            block = next(iter(self._data.values()))
+            block.keep(max(self.maxsize,0))
+            self._size = len(block)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def resize(self,maxsize):
+        '''Change the maximum number of matrices'''
+        with self._lock:
+            self.maxsize = maxsize
+            self._shrink()
+
+def _sl2_inverse(m):
+    # Inverse of a matrix of determinant 1 (or a stack of them)
+    res = empty_like(m)
+    res[...,0,0] = m[...,1,1]
+    res[...,0,1] = -m[...,0,1]
+    res[...,1,0] = -m[...,1,0]
+    res[...,1,1] = m[...,0,0]
+    return res
+
+# Traces of holonomy are entire functions of C for fixed L, so on a
+# disk they are well approximated by their Taylor polynomials.  The
+# Taylor coefficients are computed from samples on a larger circle
+# (Cauchy integral formula, evaluated by FFT), and the Cauchy estimate
+# for the remainder gives an error bound at each point.
+class TraceSurrogate(object):
+    '''Polynomial approximation of the S04 holonomy traces for fixed L
+    and C in a disk'''
+    def __init__(self,s04,center,radius,degree=32,rho=2.0):
+        '''Sample the traces of s04 (an S04 instance) at 2*(degree+1)
+        points on the circle of radius rho*radius about center and
+        compute Taylor polynomials of the given degree.'''
+        if rho <= 1.0:
+            raise ValueError('rho must be greater than 1.')
+        self.s04 = s04
+        self.center = complex(center)
+        self.radius = float(radius)
+        self.degree = int(degree)
+        self.R = rho*self.radius
+
+        M = 2*(self.degree+1)
+        nodes = self.center + self.R*exp(2j*pi*arange(M)/M)
+        samples = S04.traces_many(s04,nodes)
+        if not isfinite(samples).all():
+            raise HolonomyException('Integration failed at a sample point for the surrogate, L=%s, center=%s, R=%s' % (s04.L,self.center,self.R))
+
+        # Coefficients of the polynomials in w = (C-center)/R, one row
+        # per contour, lowest degree first.  The coefficients above the
+        # degree are kept only to estimate the error.
+        coefs = fft(samples,axis=0).T / M
+        self.coefs = coefs[:,:self.degree+1]
+        self._tail = abs(coefs[:,self.degree+1:]).max(axis=0)
+
+        # Cauchy estimate: |coefficient of w^n| <= max |trace| on the circle
+        self._bound = abs(samples).max()
+
+        # Observed error at a few points on the boundary of the disk
+        check = self.center + self.radius*exp(2j*pi*(arange(4)+0.5)/4)
+        self.error = abs(self.evaluate(check) - S04.traces_many(s04,check)).max()
+
+    def evaluate(self,C):
+        '''Evaluate the polynomials at an array of values of C; returns
+        an (N,n) complex array'''
+        w = (ravel(array(C,dtype=complex)) - self.center)/self.R
+        res = empty((len(w),self.coefs.shape[0]),dtype=complex)
+        res[:] = self.coefs[:,-1]
+        for n in range(self.degree-1,-1,-1):
+            res *= w[:,newaxis]
+            res += self.coefs[:,n]
+        return res
+
+    def error_estimate(self,C):
+        '''Estimated error of evaluate() at an array of values of C,
+        infinite outside the sampling circle'''
+        q = abs(ravel(array(C,dtype=complex)) - self.center)/self.R
+        M = 2*(self.degree+1)
+        res = empty(len(q))
+        res[:] = inf
+        ok = (q < 1.0)
+        q = q[ok]
+        # Remainder of the Taylor series: sampled coefficients above the
+        # degree, then the Cauchy estimate for the rest
+        est = self._bound * q**M / (1.0 - q)
+        for n in range(M-1,self.degree,-1):
+            est += self._tail[n-self.degree-1] * q**n
+        res[ok] = est
+        return res
+
+    def traces_many(self,C,tol=1e-6):
+        '''Traces at an array of values of C; uses the polynomials where
+        the estimated error is at most tol, and direct integration
+        elsewhere'''
+        C = ravel(array(C,dtype=complex))
+        res = self.evaluate(C)
+        direct = (self.error_estimate(C) > tol)
+        if direct.any():
+            res[direct] = S04.traces_many(self.s04,C[direct])
+        return res
+
+def _settings_json(args):
+    # Everything but L and C which determines the traces computed by
+    # S04(L,**args), as a string (args must contain all the settings)
+    segment_cache = args['segment_cache']
+    return json.dumps(dict(step=float(args['step']), tol=float(args['tol']), maxstep=int(args['maxstep']),
+                           contours=int(args['contours']),
+                           fund_domain_contours=bool(args['fund_domain_contours']),
+                           reuse_steps=bool(args['reuse_steps']),
+                           segment_cache=segment_cache is not None and segment_cache is not False,
+                           method=args['method'], contour_mode=args['contour_mode']),
+                      sort_keys=True)
+
+# Default keyword arguments of S04()
+_spec = getargspec(S04.__init__)
+_S04_DEFAULTS = dict(zip(_spec.args[-len(_spec.defaults):],_spec.defaults))
+del _S04_DEFAULTS['L'], _spec
 
 # Convenience function to compute trace tuple directly from L and C
 # (use this when L and C will change independently between calls)
+# S04 instances used by s04_lambda_hol (and so by the other convenience
+# functions), to avoid setting up the integrator and contours again for
+# each call with the same L.  Use instance_cache.resize() to change the
+# number kept (0 disables the cache).
+instance_cache = LRUCache(maxsize=32)
+
+def _instance_key(L,kwargs):
+    # Key of S04(L,**kwargs) in instance_cache, the same for all
+    # keyword arguments giving the same settings
+    args = dict(_S04_DEFAULTS)
+    args.update(kwargs)
+    segment_cache = args['segment_cache']
+    if segment_cache is None or isinstance(segment_cache,bool):
+        # Otherwise a shared SegmentCache, compared by identity
+        segment_cache = bool(segment_cache)
+    collect_stats = args['collect_stats']
+    if collect_stats != 'segments':
+        collect_stats = bool(collect_stats)
+    return (complex(L), _settings_json(args), segment_cache, collect_stats,
+            args['disk_cache'], int(args['segment_threads']))
+
+def _cached_S04(L,kwargs,cls=S04):
+    # Returns an instance of cls (S04 or a subclass taking the same
+    # arguments) and a lock to hold while using it
+    if not set(kwargs) <= set(_S04_DEFAULTS):
+        # Let S04 report the unknown argument
+        return cls(L,**kwargs), Lock()
+    key = _instance_key(L,kwargs) + (cls,)
+    entry = instance_cache.get(key)
+    if entry is None:
+        entry = (cls(L,**kwargs), Lock())
+        if instance_cache.maxsize > 0:
+            instance_cache.put(key,entry)
+    return entry
+
 def s04_lambda_hol(L=0.5,C=0.5,**kwargs):
     '''Compute traces of holonomy group generators for (L,C) projective connection; passes kwargs to S04.__init__()'''
-    h = S04(L,**kwargs)
-    return h.traces(C)
+    h, lock = _cached_S04(L,kwargs)
+    with lock:
+        return h.traces(C)
+
+def s04_solve_C_for_trace(L,target,index,C0=0.0,trace_tol=1e-10,maxiter=50,**kwargs):
+    '''Find C near C0 for which the holonomy trace number index at (L,C)
+    equals target; see S04.solve_C_for_trace.  Passes kwargs to
+    S04.__init__().'''
+    h, lock = _cached_S04(L,kwargs)
+    with lock:
+        return h.solve_C_for_trace(target,index,C0,trace_tol,maxiter)
 
 # We use this labeling for the elements of the symmetric group
 #
@@ -103,12 +788,13 @@ _TAU_MAX_TRANSFORMATIONS = 100
 def _outside_FD(tau):
     return (abs(tau) < (1.0 - _FD_EPSILON)) or (tau.real < (-0.5 - _FD_EPSILON)) or (tau.real > (0.5 + _FD_EPSILON))
 
-def s04_tau_hol(tau=1.0j,C=0.0,**kwargs):
+def _tau_reduce(tau):
+    '''Move tau into the fundamental domain.  Returns the new tau, the
+    residue in PSL_2(Z/2) and the list of transformations used.'''
     # tau must be in upper half
     if tau.imag <= 0.0:
         raise HolonomyException('Invalid tau=%s, must be in upper half plane.' % tau)
 
-    # First move tau into FD
     # Record the transformations used along the way
     # And the "residue", i.e. associated element of PSL_2(Z/2).
     transformations = []
@@ -128,6 +814,25 @@ def s04_tau_hol(tau=1.0j,C=0.0,**kwargs):
         N += 1
         if N > _TAU_MAX_TRANSFORMATIONS:
             raise HolonomyException('Unable to move tau into fundamental domain; exceeded %d transformations.' % _TAU_MAX_TRANSFORMATIONS)
+    return tau, residue, transformations
+
+def _undo_transformations(x,y,z,transformations):
+    '''Undo the transformations recorded by _tau_reduce by acting on a
+    trace triple by elements of the braid group.'''
+    for a in reversed(transformations):
+        if a == 0:
+            x,y,z = y,x,8-x*y-z
+        elif a > 0:
+            for i in range(a):
+                x,y,z = x,8-x*y-z,y
+        else:
+            for i in range(-a):
+                x,y,z = x,z,8-x*z-y
+    return x,y,z
+
+def s04_tau_hol(tau=1.0j,C=0.0,**kwargs):
+    # First move tau into FD
+    tau, residue, transformations = _tau_reduce(tau)
 
     #print 'residue = ',residue
     #print 'transformations = %s\n' % str(transformations)
@@ -151,15 +856,169 @@ def s04_tau_hol(tau=1.0j,C=0.0,**kwargs):
 
     # Now undo all of the transformations by acting on the resulting
     # trace triple by elements of the braid group.
-    for a in reversed(transformations):
-        if a == 0:
-            x,y,z = y,x,8-x*y-z
-        elif a > 0:
-            for i in range(a):
-                x,y,z = x,8-x*y-z,y
-        else:
-            for i in range(-a):
-                x,y,z = x,z,8-x*z-y
+    x,y,z = _undo_transformations(x,y,z,transformations)
     # Done.
     return x,y,z
 
+# ARRAY VERSIONS
+
+def _outside_FD_many(tau):
+    # Array version of _outside_FD
+    return ((abs(tau) < (1.0 - _FD_EPSILON)) | (tau.real < (-0.5 - _FD_EPSILON)) |
+            (tau.real > (0.5 + _FD_EPSILON)))
+
+def _tau_reduce_many(tau):
+    '''Array version of _tau_reduce for a 1-dimensional array of tau.
+    Returns the new tau, the residues, an array holding the list of
+    transformations of each point in a row, the number of
+    transformations of each point, and a mask of the points for which
+    the reduction succeeded (tau in the upper half plane, at most
+    _TAU_MAX_TRANSFORMATIONS steps).'''
+    tau = array(tau,dtype=complex)
+    N = len(tau)
+    residue = zeros(N,dtype=int)
+    transformations = zeros((N,2*_TAU_MAX_TRANSFORMATIONS),dtype=int)
+    ntrans = zeros(N,dtype=int)
+    ok = tau.imag > 0.0
+    tau[~ok] = 1.0j
+    shift_S = array(_shift_S)
+    shift_T = array(_shift_T)
+
+    active = _outside_FD_many(tau)
+    n = 0
+    while active.any():
+        n += 1
+        if n > _TAU_MAX_TRANSFORMATIONS:
+            ok &= ~active
+            break
+        i = nonzero(active & (abs(tau) < (1.0 - _FD_EPSILON)))[0]
+        tau[i] = -1.0/tau[i]
+        transformations[i,ntrans[i]] = 0
+        ntrans[i] += 1
+        residue[i] = shift_S[residue[i]]
+
+        i = nonzero(active & ((tau.real < (-0.5 - _FD_EPSILON)) | (tau.real > (0.5 + _FD_EPSILON))))[0]
+        k = vfloor(tau[i].real + 0.5).astype(int)
+        tau[i] -= k
+        transformations[i,ntrans[i]] = k
+        ntrans[i] += 1
+        i = i[k % 2 != 0]
+        residue[i] = shift_T[residue[i]]
+
+        active = _outside_FD_many(tau)
+    return tau, residue, transformations, ntrans, ok
+
+def _matrix_power_many(M,n):
+    # M[i]^n[i] for a stack of square matrices, by repeated squaring
+    res = empty_like(M)
+    res[:] = eye(M.shape[-1])
+    M = array(M)
+    n = array(n)
+    while (n > 0).any():
+        odd = (n % 2) == 1
+        res[odd] = matmul(res[odd],M[odd])
+        n = n // 2
+        i = nonzero(n > 0)[0]
+        M[i] = matmul(M[i],M[i])
+    return res
+
+def _markov_power_many(x,y,z,a):
+    # Apply the move (x,y,z) -> (x,8-xy-z,y) a times, or the inverse
+    # move (x,y,z) -> (x,z,8-xz-y) -a times if a < 0.  For fixed x these
+    # are affine maps of (y,z), so the iterate is a matrix power.
+    M = zeros((len(x),3,3),dtype=complex)
+    pos = a > 0
+    M[pos,0,0] = -x[pos]
+    M[pos,0,1] = -1.0
+    M[pos,0,2] = 8.0
+    M[pos,1,0] = 1.0
+    M[~pos,0,1] = 1.0
+    M[~pos,1,0] = -1.0
+    M[~pos,1,1] = -x[~pos]
+    M[~pos,1,2] = 8.0
+    M[:,2,2] = 1.0
+    P = _matrix_power_many(M,abs(a))
+    return x, P[:,0,0]*y + P[:,0,1]*z + P[:,0,2], P[:,1,0]*y + P[:,1,1]*z + P[:,1,2]
+
+def _undo_transformations_many(x,y,z,transformations,ntrans):
+    '''Array version of _undo_transformations'''
+    x = array(x)
+    y = array(y)
+    z = array(z)
+    for j in reversed(range(transformations.shape[1])):
+        act = ntrans > j
+        if not act.any():
+            continue
+        a = transformations[:,j]
+        i = nonzero(act & (a == 0))[0]
+        x[i], y[i], z[i] = y[i], x[i], 8-x[i]*y[i]-z[i]
+        i = nonzero(act & (a != 0))[0]
+        x[i], y[i], z[i] = _markov_power_many(x[i],y[i],z[i],a[i])
+    return x,y,z
+
+def s04_lambda_hol_many(L,C,**kwargs):
+    '''Array version of s04_lambda_hol: traces for each pair of elements
+    of the arrays L and C (broadcast together); passes kwargs to
+    S04.__init__().
+
+    Points with the same L share an integrator.  Returns a complex
+    array of shape L.shape + (n,), for n contours, containing nan where
+    the integration failed.'''
+    L, C = broadcast_arrays(array(L,dtype=complex),array(C,dtype=complex))
+    shape = L.shape
+    L = ravel(L)
+    C = ravel(C)
+    res = None
+    Lvalues, group = unique(L,return_inverse=True)
+    group = ravel(group)
+    for g,Lg in enumerate(Lvalues):
+        i = nonzero(group == g)[0]
+        h, lock = _cached_S04(Lg,kwargs)
+        with lock:
+            t = h.traces_many(C[i])
+        if res is None:
+            res = full((len(L),t.shape[1]),nan,dtype=complex)
+        res[i] = t
+    if res is None:
+        res = empty((0,kwargs.get('contours',3)),dtype=complex)
+    return res.reshape(shape + res.shape[-1:])
+
+def s04_tau_hol_many(tau,C,**kwargs):
+    '''Array version of s04_tau_hol: traces for each pair of elements of
+    the arrays tau and C (broadcast together); passes kwargs to
+    S04.__init__().
+
+    Points whose tau has the same image in the fundamental domain share
+    an integrator.  Returns a complex array of shape tau.shape + (3,),
+    containing nan where tau is not in the upper half plane or the
+    integration failed.'''
+    tau, C = broadcast_arrays(array(tau,dtype=complex),array(C,dtype=complex))
+    shape = tau.shape
+    tau = ravel(tau)
+    C = ravel(C)
+    res = full((len(tau),3),nan,dtype=complex)
+
+    tau, residue, transformations, ntrans, ok = _tau_reduce_many(tau)
+    L = full(len(tau),nan,dtype=complex)
+    L[ok] = modularlambda_many(tau[ok])
+    ok &= isfinite(L)
+
+    # Transform C as for the reduced tau, reflecting if necessary
+    i = nonzero(ok)[0]
+    L = L[i]
+    C = C[i]
+    residue = residue[i]
+    for r in range(len(_affine_repar)):
+        sel = residue == r
+        C[sel] = _affine_repar[r](L[sel],C[sel])
+    conj = L.imag < 0
+    L[conj] = L[conj].conjugate()
+    C[conj] = C[conj].conjugate()
+
+    t = s04_lambda_hol_many(L,C,**dict(kwargs,fund_domain_contours=True))[:,:3]
+    t[conj,2] = 8 - t[conj,0]*t[conj,1] - t[conj,2]
+    t[conj] = t[conj].conjugate()
+    res[i] = t
+
+    x,y,z = _undo_transformations_many(res[:,0],res[:,1],res[:,2],transformations,ntrans)
+    return stack([x,y,z],axis=-1).reshape(shape + (3,))
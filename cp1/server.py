@@ -0,0 +1,247 @@
+'''Local holonomy service speaking JSON lines over a Unix or TCP socket
+
+Run with
+
+    python -m cp1.server --unix /tmp/cp1.sock
+    python -m cp1.server --port 7654
+
+Each request is a line containing a JSON object, for example
+
+    {"id": 1, "L": [0.5, 0.0], "C": [0.1, 0.0], "classify": true}
+
+with the surface given by "L" (lambda) or "tau", and C, as [re, im]
+pairs.  Optional keys are "kind" ("t11", the default, for punctured
+torus traces or "s04" for four-punctured sphere traces), "classify"
+(include the discreteness test result, which is only computed when
+requested) and "deadline" (seconds).  The
+response line echoes the id and contains "traces" (a list of [re, im]
+pairs) and, if requested, "rep" and "nodes" as returned by classify();
+or "error" with a message.  Responses on a connection may arrive in a
+different order than the requests.
+
+Requests for the same surface which arrive within a short time of each
+other are computed together in one batch, in a thread pool, using the
+S04 instances cached by the s04 module; results are kept in a cache.
+Requires Python 3.7 or later.'''
+import sys
+import json
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+import cp1.s04 as s04
+from cp1.t11 import s04_to_t11_many
+from cp1.bowditch import classify_many
+from cp1.slicekernel import HOLONOMY_FAILED
+
+def _pair(z):
+    return [z.real, z.imag]
+
+def _complex(v):
+    # Complex number from [re, im] (or a real number)
+    if isinstance(v,(list,tuple)):
+        re, im = v
+        return complex(float(re),float(im))
+    return complex(float(v))
+
+class HolonomyServer(object):
+    '''Answers holonomy requests, batching those for the same surface.
+
+    Requests for a surface are collected for batch_delay seconds (or
+    until there are max_batch of them) and then computed together in
+    one of threads worker threads.  Up to cache_size results are
+    cached.  node_budget and time_limit bound the cost of classifying
+    each point (see bowditch.classify_bounded).  Other keyword
+    arguments are passed to S04.__init__().'''
+    def __init__(self,threads=None,batch_delay=0.0005,max_batch=4096,cache_size=100000,
+                 node_budget=None,time_limit=None,**kwargs):
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.batch_delay = batch_delay
+        self.max_batch = max_batch
+        self.cache = s04.LRUCache(cache_size)
+        self.node_budget = node_budget
+        self.time_limit = time_limit
+        self.kwargs = dict(kwargs,contours=3)
+        self._batches = {}
+
+    def _classify(self,xyz):
+        return classify_many(xyz,threads=1,node_budget=self.node_budget,
+                             time_limit=self.time_limit)
+
+    def _compute(self,surface,Cs,want):
+        # Runs in a worker thread: traces for a batch, and classification
+        # of the points where want is true.  Returns the traces and arrays
+        # rep and nodes, which are -1 where no classification was done.
+        param, value = surface
+        if param == 'tau':
+            traces = s04.s04_tau_hol_many(value,Cs,**self.kwargs)
+        else:
+            traces = s04.s04_lambda_hol_many(value,Cs,**self.kwargs)
+        t11traces = s04_to_t11_many(traces)
+        failed = ~numpy.isfinite(t11traces).all(axis=1)
+        rep = numpy.full(len(Cs),-1,dtype=int)
+        nodes = numpy.full(len(Cs),-1,dtype=int)
+        rep[failed] = HOLONOMY_FAILED
+        nodes[failed] = 0
+        todo = want & ~failed
+        if todo.any():
+            rep[todo], nodes[todo] = self._classify(t11traces[todo])
+        return traces, t11traces, rep, nodes
+
+    async def _flush(self,surface):
+        batch = self._batches.pop(surface,None)
+        if not batch:
+            return
+        Cs = numpy.array([ C for C,classify,fut in batch ],dtype=complex)
+        want = numpy.array([ classify for C,classify,fut in batch ],dtype=bool)
+        loop = asyncio.get_running_loop()
+        try:
+            traces, t11traces, rep, nodes = await loop.run_in_executor(self.executor,self._compute,
+                                                                       surface,Cs,want)
+        except Exception as e:
+            for C,classify,fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for k,(C,classify,fut) in enumerate(batch):
+            if rep[k] < 0:
+                res = (traces[k], t11traces[k], None, None)
+            else:
+                res = (traces[k], t11traces[k], int(rep[k]), int(nodes[k]))
+            self.cache.put((surface,C),res)
+            if not fut.done():
+                fut.set_result(res)
+
+    async def _classify_cached(self,surface,C,res):
+        # Classify a point whose traces are cached without classification
+        traces, t11traces = res[:2]
+        loop = asyncio.get_running_loop()
+        rep, nodes = await loop.run_in_executor(self.executor,self._classify,
+                                                numpy.array([t11traces]))
+        res = (traces, t11traces, int(rep[0]), int(nodes[0]))
+        self.cache.put((surface,C),res)
+        return res
+
+    def holonomy(self,surface,C,classify=False):
+        '''Future for the tuple (s04 traces, t11 traces, rep, nodes) for
+        a surface ('lambda' or 'tau', value) and C.  The holonomy is
+        classified only if classify is true (otherwise rep and nodes may
+        be None), except that rep is HOLONOMY_FAILED if the integration
+        failed.'''
+        loop = asyncio.get_running_loop()
+        res = self.cache.get((surface,C))
+        if res is not None:
+            if classify and res[2] is None:
+                return asyncio.ensure_future(self._classify_cached(surface,C,res))
+            fut = loop.create_future()
+            fut.set_result(res)
+            return fut
+        fut = loop.create_future()
+        batch = self._batches.get(surface)
+        if batch is None:
+            batch = self._batches[surface] = []
+            loop.call_later(self.batch_delay,lambda: asyncio.ensure_future(self._flush(surface)))
+        batch.append((C,classify,fut))
+        if len(batch) >= self.max_batch:
+            asyncio.ensure_future(self._flush(surface))
+        return fut
+
+    async def answer(self,req):
+        '''Response (a dict) to a request (a dict)'''
+        resp = { 'id': req.get('id') }
+        try:
+            if 'tau' in req:
+                surface = ('tau',_complex(req['tau']))
+            else:
+                surface = ('lambda',_complex(req['L']))
+            C = _complex(req.get('C',0.0))
+            kind = req.get('kind','t11')
+            if kind not in ('s04','t11'):
+                raise ValueError('Unknown kind %s, must be "s04" or "t11".' % kind)
+            fut = self.holonomy(surface,C,bool(req.get('classify')))
+            deadline = req.get('deadline')
+            # The computation continues (and is cached) after a timeout
+            res = await asyncio.wait_for(asyncio.shield(fut),deadline)
+        except asyncio.TimeoutError:
+            resp['error'] = 'Deadline exceeded.'
+            return resp
+        except Exception as e:
+            resp['error'] = str(e)
+            return resp
+        traces, t11traces, rep, nodes = res
+        if rep == HOLONOMY_FAILED:
+            resp['error'] = 'Integration failed.'
+            return resp
+        resp['traces'] = [ _pair(t) for t in (t11traces if kind == 't11' else traces) ]
+        if req.get('classify'):
+            resp['rep'] = rep
+            resp['nodes'] = nodes
+        return resp
+
+    async def handle(self,reader,writer):
+        '''Serve one connection'''
+        async def respond(line):
+            try:
+                req = json.loads(line.decode('utf-8'))
+                if not isinstance(req,dict):
+                    raise ValueError('Request must be a JSON object.')
+            except ValueError as e:
+                resp = { 'id': None, 'error': 'Invalid request: %s' % e }
+            else:
+                resp = await self.answer(req)
+            writer.write(json.dumps(resp).encode('utf-8') + b'\n')
+            await writer.drain()
+
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                tasks.append(asyncio.ensure_future(respond(line)))
+                tasks = [ t for t in tasks if not t.done() ]
+        if tasks:
+            await asyncio.gather(*tasks,return_exceptions=True)
+        writer.close()
+
+    async def start(self,path=None,host='127.0.0.1',port=0):
+        '''Start listening on a Unix socket (if path is given) or TCP;
+        returns the asyncio server'''
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle,path=path)
+        return await asyncio.start_server(self.handle,host=host,port=port)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cp1.server',
+                                     description='Local holonomy service speaking JSON lines')
+    parser.add_argument('--unix',help='Path of a Unix socket to listen on')
+    parser.add_argument('--host',default='127.0.0.1',help='Address to listen on (TCP)')
+    parser.add_argument('--port',type=int,default=7654,help='Port to listen on (TCP)')
+    parser.add_argument('-j','--threads',type=int,help='Number of worker threads')
+    parser.add_argument('--tol',type=float,default=0.000001,help='ODE solver tolerance')
+    parser.add_argument('--method',choices=['rk8pd','magnus4','magnus6'],default='rk8pd',
+                        help='ODE solver')
+    parser.add_argument('--node-budget',type=int,
+                        help='Maximum number of Farey tree nodes examined per point')
+    parser.add_argument('--time-limit',type=float,
+                        help='Maximum time (seconds) spent classifying each point')
+    args = parser.parse_args(argv)
+
+    server = HolonomyServer(threads=args.threads,node_budget=args.node_budget,
+                            time_limit=args.time_limit,tol=args.tol,method=args.method)
+
+    async def run():
+        srv = await server.start(args.unix,args.host,args.port)
+        async with srv:
+            await srv.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,598 @@
+'''Holonomy and discreteness of punctured torus groups over slices'''
+import os
+import json
+import numpy
+from numpy.lib.format import open_memmap
+
+from cp1.pcint import pcint, modularlambda
+import cp1.slicekernel as slicekernel
+from cp1.slicekernel import HOLONOMY_FAILED
+import cp1.contourgen as contourgen
+from cp1.parallel import run_chunks
+from cp1.bowditch import REP_DISCRETE, REP_INDISCRETE, REP_UNCERTAIN, classify_many, near_threshold
+from cp1.s04 import _tau_reduce, _affine_repar
+
+# Convention: a slice is the set of projective structures on a fixed
+# punctured torus Riemann surface, i.e. fixed L (or tau) and varying C.
+# The surface is specified either by L = lambda, as for t11_lambda_hol,
+# or by tau in the upper half plane, as for t11_tau_hol.
+
+class _SliceSetup(object):
+    '''Everything needed to map C to a trace triple for a fixed surface'''
+    def __init__(self,tau_or_L,param='lambda',contour_mode='rectangular'):
+        if param == 'lambda':
+            self.L = complex(tau_or_L)
+            self.alpha = 1.0
+            self.beta = 0.0
+            self.conj = False
+            self.moves = []
+            self.contours = contourgen.generate(self.L,3,False,contour_mode)
+            self.symmetric = True
+        elif param == 'tau':
+            # Same steps as s04.s04_tau_hol
+            tau, residue, transformations = _tau_reduce(complex(tau_or_L))
+            L = modularlambda(tau)
+            self.beta = _affine_repar[residue](L,0.0)
+            self.alpha = _affine_repar[residue](L,1.0) - self.beta
+            self.conj = (L.imag < 0)
+            if self.conj:
+                L = L.conjugate()
+            self.L = L
+            self.moves = list(reversed(transformations))
+            self.contours = contourgen.generate(self.L,3,True,contour_mode)
+            # Symmetries are only found when C is not reparameterized
+            self.symmetric = (residue == 0) and not transformations and not self.conj
+        else:
+            raise ValueError('Unknown surface parameter %s, must be "lambda" or "tau".' % param)
+
+def _pixel_points(center,radius,shape,rows,cols):
+    # Values of C at the given pixels of the grid described by grid_points
+    H, W = shape
+    dx = 2.0/(W-1) if W > 1 else 0.0
+    dy = 2.0/(H-1) if H > 1 else 0.0
+    return center + radius*((-1.0 + dx*numpy.asarray(cols)) + 1j*(1.0 - dy*numpy.asarray(rows)))
+
+def grid_points(center,radius,shape):
+    '''Values of C at the pixels of an image of the given shape (rows,
+    columns) covering the square with the given center and radius; the
+    real part increases from left to right and the imaginary part
+    decreases from top to bottom.'''
+    H, W = shape
+    return _pixel_points(center,radius,shape,
+                         numpy.arange(H)[:,numpy.newaxis],numpy.arange(W)[numpy.newaxis,:])
+
+def classify_points(tau_or_L,C,param='lambda',threads=None,step=0.02,tol=0.000001,maxstep=5000,
+                    reuse_steps=True,method='rk8pd',stats=False,contour_mode='rectangular',
+                    node_budget=None,time_limit=None):
+    '''Compute punctured torus holonomy traces and classify the holonomy
+    for each value in the array C, using threads worker threads
+    (default: one per CPU).  Each thread replays the step sizes of the
+    previous point when reuse_steps is true; method selects the ODE
+    solver and contour_mode the integration contours (see S04).
+
+    Returns arrays traces (shape C.shape + (3,)), rep and nodes (shape
+    C.shape).  The entries of rep are REP_DISCRETE, REP_INDISCRETE,
+    REP_UNCERTAIN, or HOLONOMY_FAILED if the integration failed; nodes
+    is the number of Farey triangles examined by classify().  If
+    node_budget or time_limit (seconds) is given, the classification of
+    each point gives up after that much work, as in
+    bowditch.classify_bounded().
+
+    If stats is true, a fourth value is returned: a dict of per-point
+    cost maps of shape C.shape, with keys 'accepted' and 'rejected'
+    (ODE steps), 'hmin' (smallest ODE step), 'sinksteps' and
+    'treenodes' (see bowditch.classify_stats) and 'time' (seconds).'''
+    setup = _SliceSetup(tau_or_L,param,contour_mode)
+    C = numpy.asarray(C,dtype=complex)
+    shape = C.shape
+    Cflat = numpy.ascontiguousarray(C.ravel())
+    N = len(Cflat)
+
+    traces = numpy.empty((N,3),dtype=complex)
+    rep = numpy.empty(N,dtype=numpy.uint8)
+    nodes = numpy.empty(N,dtype=numpy.intc)
+    cost = numpy.empty((N,len(slicekernel.COST_FIELDS))) if stats else None
+
+    def init():
+        return pcint(atol=tol, rtol=0.0, maxstep=maxstep, initstep=step,
+                     reuse_steps=reuse_steps, method=method, collect_stats=stats)
+
+    def work(integ,i0,i1):
+        slicekernel.classify_points(integ,setup.L,setup.alpha,setup.beta,
+                                    setup.conj,setup.moves,setup.contours,
+                                    Cflat[i0:i1],traces[i0:i1],rep[i0:i1],nodes[i0:i1],
+                                    None if cost is None else cost[i0:i1],
+                                    node_budget,time_limit)
+
+    run_chunks(work,N,threads,init=init)
+
+    res = (traces.reshape(shape + (3,)), rep.reshape(shape), nodes.reshape(shape))
+    if stats:
+        res += (dict( (name,cost[:,k].reshape(shape))
+                      for k,name in enumerate(slicekernel.COST_FIELDS) ),)
+    return res
+
+# SYMMETRY
+#
+# An affine map m(z) = a*z+b (or a*conj(z)+b) permuting the punctures
+# 0, 1, L maps the projective structure with parameter C to the one
+# with parameter C' = A(C), where A is affine (or anti-affine), and
+# the holonomy of a loop gamma at C' is that of m(gamma) at C (complex
+# conjugated if m is).  The loops m(gamma) are identified with our
+# contours (or, for the contour around 0 and 1, the one on the other
+# side of L, whose trace is xy-z) by comparing the paths joining the
+# punctures they enclose (see contourgen.contour_core).
+
+_SYMMETRY_EPSILON = 1e-9
+_PHI_POINT = 0.3141592653589793 + 0.2718281828459045j
+
+def _phi(z,L,C):
+    # The quadratic differential of pcint
+    return -0.25/(z*(z-1))**2 - 0.25/(z-L)**2 - 0.5*C/(z*(z-1)*(z-L))
+
+def _pullback_C(L,a,b,anti,C):
+    # Parameter of the pullback of the structure C by m
+    z = _PHI_POINT
+    if anti:
+        psi = (_phi(a*z.conjugate()+b,L,C)*a*a).conjugate()
+    else:
+        psi = _phi(a*z+b,L,C)*a*a
+    return (psi - _phi(z,L,0.0))*z*(z-1)*(z-L)/(-0.5)
+
+def _same_point(z,w):
+    return abs(z-w) < _SYMMETRY_EPSILON*max(1.0,abs(w))
+
+def slice_symmetries(L,contours):
+    '''Symmetries of the slice for L with the given contours, as a list
+    of tuples (anti, alpha, beta, images).  C is mapped to alpha*C+beta
+    (alpha*conj(C)+beta if anti is true), and the traces there are
+    obtained from the traces t at C as t[j] (or t[0]*t[1]-t[2] if flip
+    is true) for the pairs (j, flip) in images, complex conjugated if
+    anti is true.  The identity is included.'''
+    L = complex(L)
+    punctures = [0.0j, 1.0+0.0j, L]
+    cores = [ contourgen.contour_core(gamma,L) for gamma in contours ]
+    if len(contours) != 3 or None in cores:
+        return [ (False, 1.0, 0.0, ((0,False),(1,False),(2,False))) ]
+    res = []
+    for p0 in punctures:
+        for p1 in punctures:
+            if p1 == p0:
+                continue
+            a = p1 - p0
+            for anti in (False,True):
+                def m(z):
+                    return a*(z.conjugate() if anti else z) + p0
+                p2 = [ p for p in punctures if p != p0 and p != p1 ][0]
+                if not _same_point(m(L),p2):
+                    continue
+                images = []
+                for core, c, dist in cores:
+                    image = [ m(z) for z in core ]
+                    for j,(core_j,c_j,dist_j) in enumerate(cores):
+                        if _same_point(image[-1],core_j[0]) and _same_point(image[0],core_j[-1]):
+                            image = image[::-1]
+                        if _same_point(image[0],core_j[0]) and _same_point(image[-1],core_j[-1]):
+                            break
+                    else:
+                        break
+                    # Winding number of the core followed by the image backwards
+                    w = contourgen._winding(core_j + image[-2:0:-1],c_j)
+                    if w == 0:
+                        images.append((j,False))
+                    elif w == 1 and j == 2:
+                        images.append((j,True))
+                    else:
+                        break
+                if len(images) != 3:
+                    continue
+                beta = _pullback_C(L,a,p0,anti,0.0)
+                alpha = _pullback_C(L,a,p0,anti,1.0) - beta
+                res.append((anti, alpha, beta, tuple(images)))
+    return res
+
+def _transform_traces(traces,anti,images):
+    # Traces at the image point under a symmetry, with the signs chosen
+    # as by slicekernel: x, y with nonnegative real part
+    res = numpy.empty_like(traces)
+    for k,(j,flip) in enumerate(images):
+        if flip:
+            res[:,k] = traces[:,0]*traces[:,1] - traces[:,2]
+        else:
+            res[:,k] = traces[:,j]
+    if anti:
+        res = res.conj()
+    for k in (0,1):
+        neg = (res[:,k].real < 0) | ((res[:,k].real == 0) & (res[:,k].imag < 0))
+        res[neg,k] *= -1
+        res[neg,2] *= -1
+    return res
+
+def _grid_symmetries(setup,center,radius,shape):
+    # Symmetries of the slice mapping the pixels of the grid to pixels,
+    # as pairs (pixel map, (anti, images)) where the pixel map is an
+    # array of flat pixel indices
+    H, W = shape
+    if not setup.symmetric or H < 2 or W < 2:
+        return []
+    C = grid_points(center,radius,shape).ravel()
+    res = []
+    for anti, alpha, beta, images in slice_symmetries(setup.L,setup.contours):
+        D = alpha*(C.conj() if anti else C) + beta
+        w = (D - center)/radius
+        cols = (w.real + 1.0)*(W-1)/2.0
+        rows = (1.0 - w.imag)*(H-1)/2.0
+        icols = numpy.rint(cols).astype(int)
+        irows = numpy.rint(rows).astype(int)
+        if (abs(cols - icols).max() > 1e-6 or abs(rows - irows).max() > 1e-6 or
+            icols.min() < 0 or icols.max() >= W or irows.min() < 0 or irows.max() >= H):
+            continue
+        res.append((irows*W + icols, (anti, images)))
+    return res
+
+def classify_adaptive(tau_or_L,C,tols=(1e-5,1e-7,1e-9),margin=1e-3,param='lambda',threads=None,**kwargs):
+    '''Compute traces and classify the holonomy for each value in the
+    array C as classify_points() does, first with the ODE tolerance
+    tols[0], then recomputing the points whose result is uncertain
+    (REP_UNCERTAIN or HOLONOMY_FAILED, or a trace within a relative
+    distance margin of the thresholds of the discreteness test, see
+    bowditch.near_threshold) with each of the following tolerances in
+    turn.  Other arguments are passed to classify_points().
+
+    Returns arrays traces, rep and nodes as for classify_points(), and
+    an array of the tolerances with which the results were obtained.
+    If stats is true, a fifth value is returned: cost maps as for
+    classify_points(), totalled over all the tolerances tried at each
+    point (hmin is the smallest step in any of them).'''
+    C = numpy.asarray(C,dtype=complex)
+    shape = C.shape
+    Cflat = C.ravel()
+    N = len(Cflat)
+    traces = numpy.empty((N,3),dtype=complex)
+    rep = numpy.empty(N,dtype=numpy.uint8)
+    nodes = numpy.empty(N,dtype=numpy.intc)
+    used = numpy.empty(N)
+    stats = kwargs.get('stats')
+    if stats:
+        cost = dict( (name,numpy.zeros(N)) for name in slicekernel.COST_FIELDS )
+        cost['hmin'][:] = numpy.inf
+
+    todo = numpy.arange(N)
+    for tol in tols:
+        res = classify_points(tau_or_L,Cflat[todo],param=param,threads=threads,tol=tol,**kwargs)
+        t, r, n = res[:3]
+        traces[todo] = t
+        rep[todo] = r
+        nodes[todo] = n
+        used[todo] = tol
+        if stats:
+            for name,c in res[3].items():
+                if name == 'hmin':
+                    cost[name][todo] = numpy.minimum(cost[name][todo],c)
+                else:
+                    cost[name][todo] += c
+        again = (r == REP_UNCERTAIN) | (r == HOLONOMY_FAILED) | near_threshold(t,margin)
+        todo = todo[again]
+        if len(todo) == 0:
+            break
+
+    res = (traces.reshape(shape + (3,)), rep.reshape(shape), nodes.reshape(shape), used.reshape(shape))
+    if stats:
+        res += (dict( (name,c.reshape(shape)) for name,c in cost.items() ),)
+    return res
+
+def classify_grid(tau_or_L,center,radius,shape,param='lambda',threads=None,symmetry=True,**kwargs):
+    '''Compute traces and classify the holonomy over a grid of values of
+    C (see grid_points); param is "lambda" or "tau" and determines how
+    tau_or_L is interpreted.  Other arguments are passed to
+    classify_points().
+
+    If symmetry is true, symmetries of the slice mapping the grid to
+    itself (see slice_symmetries) are used to compute traces at only
+    one point of each orbit, and the other traces are obtained from
+    these.  They agree with a full computation up to rounding; the
+    holonomy is classified at every point.  Symmetries are not used for
+    tau unless it is in the standard fundamental domain with lambda(tau)
+    in the upper half plane, nor when stats is true.
+
+    Returns arrays traces, rep and nodes (and cost maps if stats is
+    true) as for classify_points().'''
+    C = grid_points(center,radius,shape)
+    syms = []
+    if symmetry and not kwargs.get('stats'):
+        setup = _SliceSetup(tau_or_L,param,kwargs.get('contour_mode','rectangular'))
+        syms = _grid_symmetries(setup,center,radius,shape)
+    if len(syms) < 2:
+        return classify_points(tau_or_L,C,param=param,threads=threads,**kwargs)
+
+    # Compute at the pixels which are first in their orbits
+    N = C.size
+    first = numpy.arange(N)
+    for pixels, sym in syms:
+        first = numpy.minimum(first,pixels)
+    todo = numpy.nonzero(first == numpy.arange(N))[0]
+    traces = numpy.empty((N,3),dtype=complex)
+    rep = numpy.empty(N,dtype=numpy.uint8)
+    nodes = numpy.empty(N,dtype=numpy.intc)
+    done = numpy.zeros(N,dtype=bool)
+    traces[todo], rep[todo], nodes[todo] = classify_points(tau_or_L,C.ravel()[todo],param=param,
+                                                           threads=threads,**kwargs)
+    done[todo] = True
+
+    for pixels, (anti, images) in syms:
+        target = pixels[todo]
+        new = ~done[target]
+        traces[target[new]] = _transform_traces(traces[todo[new]],anti,images)
+        done[target[new]] = True
+    filled = numpy.nonzero(done)[0]
+    filled = filled[first[filled] != filled]
+
+    # Classify the filled points (failed points stay failed)
+    failed = ~numpy.isfinite(traces[filled]).all(axis=1)
+    xyz = traces[filled]
+    xyz[failed] = 0.0
+    rep[filled], nodes[filled] = classify_many(xyz,threads=threads,
+                                               node_budget=kwargs.get('node_budget'),
+                                               time_limit=kwargs.get('time_limit'))
+    rep[filled[failed]] = HOLONOMY_FAILED
+    nodes[filled[failed]] = 0
+
+    # Any points not reached (if the symmetries found are not a group)
+    rest = numpy.nonzero(~done)[0]
+    if len(rest):
+        traces[rest], rep[rest], nodes[rest] = classify_points(tau_or_L,C.ravel()[rest],param=param,
+                                                               threads=threads,**kwargs)
+
+    H, W = shape
+    return traces.reshape((H,W,3)), rep.reshape(shape), nodes.reshape(shape)
+
+def classify_quadtree(tau_or_L,center,radius,shape,param='lambda',cell=16,max_nodes=1000,
+                      threads=None,**kwargs):
+    '''Classify the holonomy over the grid of values of C described by
+    grid_points(), evaluating only where necessary.
+
+    The image is divided into square cells of cell x cell pixels (cell
+    must be a power of 2), and the holonomy is computed at the corners
+    of each cell.  If all corners have the same classification, none is
+    uncertain, and none needed more than max_nodes Farey triangles
+    (which suggests the boundary of the discreteness locus is near),
+    the cell is filled with that classification.  Otherwise the cell is
+    split into four and the process is repeated, down to single pixels.
+    Features smaller than a cell can be missed entirely, so cell should
+    be small compared to the image.  Other arguments are as for classify_grid().
+
+    Returns arrays rep and nodes of the given shape, as for
+    classify_grid().  Pixels that were filled rather than evaluated
+    have nodes equal to -1.'''
+    if cell < 1 or (cell & (cell-1)) != 0:
+        raise ValueError('Cell size must be a power of 2, got %d.' % cell)
+    H, W = shape
+    rep = numpy.zeros((H,W),dtype=numpy.uint8)
+    nodes = numpy.full((H,W),-1,dtype=numpy.intc)
+    evaluated = numpy.zeros((H,W),dtype=bool)
+
+    def evaluate(rows,cols):
+        # Classify the pixels (rows[i],cols[i]) not evaluated already
+        # (repeated pixels are evaluated once)
+        idx = numpy.unique(rows*W + cols)
+        rows, cols = idx // W, idx % W
+        todo = ~evaluated[rows,cols]
+        rows, cols = rows[todo], cols[todo]
+        if len(rows) == 0:
+            return
+        C = _pixel_points(center,radius,shape,rows,cols)
+        _, r, n = classify_points(tau_or_L,C,param=param,threads=threads,**kwargs)
+        rep[rows,cols] = r
+        nodes[rows,cols] = n
+        evaluated[rows,cols] = True
+
+    if H < 2 or W < 2:
+        evaluate(*numpy.indices((H,W)).reshape(2,-1))
+        return rep, nodes
+
+    # Top left corners of the cells at the current level; a cell ends
+    # at the last row/column of the image if it does not fit.
+    r0, c0 = numpy.meshgrid(numpy.arange(0,H-1,cell),numpy.arange(0,W-1,cell),indexing='ij')
+    r0 = r0.ravel()
+    c0 = c0.ravel()
+    size = cell
+    uniform_codes = numpy.array([REP_DISCRETE,REP_INDISCRETE],dtype=numpy.uint8)
+    while len(r0) > 0:
+        r1 = numpy.minimum(r0+size,H-1)
+        c1 = numpy.minimum(c0+size,W-1)
+        corners = [ (r0,c0), (r0,c1), (r1,c0), (r1,c1) ]
+
+        evaluate(numpy.concatenate([ r for r,c in corners ]),
+                 numpy.concatenate([ c for r,c in corners ]))
+
+        crep = [ rep[r,c] for r,c in corners ]
+        cnodes = [ nodes[r,c] for r,c in corners ]
+        same = (crep[0] == crep[1]) & (crep[0] == crep[2]) & (crep[0] == crep[3])
+        same &= numpy.isin(crep[0],uniform_codes)
+        same &= numpy.maximum.reduce(cnodes) <= max_nodes
+
+        for i in numpy.nonzero(same)[0]:
+            block = (slice(r0[i],r1[i]+1),slice(c0[i],c1[i]+1))
+            rep[block][~evaluated[block]] = crep[0][i]
+
+        if size == 1:
+            break
+
+        # Split the remaining cells, dropping children lying entirely
+        # beyond the last row or column
+        half = size // 2
+        r0, c0, r1, c1 = r0[~same], c0[~same], r1[~same], c1[~same]
+        r0 = numpy.concatenate([r0, r0, r0+half, r0+half])
+        c0 = numpy.concatenate([c0, c0+half, c0, c0+half])
+        keep = (r0 < numpy.tile(r1,4)) & (c0 < numpy.tile(c1,4))
+        r0 = r0[keep]
+        c0 = c0[keep]
+        size = half
+
+    return rep, nodes
+
+def boundary(tau_or_L,center,n_rays,tol,param='lambda',radius=4.0,max_doublings=8,
+             threads=None,**kwargs):
+    '''Find the boundary of the discreteness locus (quasi-Fuchsian
+    component) of a slice, assuming it is star-shaped around center,
+    by bisection along n_rays equally spaced rays from center.
+
+    Each ray starts with the interval [0,radius], which is doubled up to
+    max_doublings times until its end point is not discrete, and is then
+    bisected until its length is less than tol.  The points of all rays
+    are classified together at each step, in parallel (see
+    classify_points, to which other arguments are passed).
+
+    Returns the boundary as a complex array of n_rays points (a closed
+    polyline, the last point joined to the first) and a boolean array
+    which is true for rays where a point was uncertain, the integration
+    failed, or no indiscrete end point was found; such points were
+    treated as not discrete, so the boundary point may be too close
+    to center.'''
+    rep = classify_points(tau_or_L,numpy.array([center],dtype=complex),
+                          param=param,threads=threads,**kwargs)[1]
+    if rep[0] != REP_DISCRETE:
+        raise ValueError('The center %s of the rays must be in the discreteness locus.' % center)
+
+    directions = numpy.exp(2j*numpy.pi*numpy.arange(n_rays)/n_rays)
+    lo = numpy.zeros(n_rays)
+    hi = numpy.full(n_rays,float(radius))
+    uncertain = numpy.zeros(n_rays,dtype=bool)
+
+    def discrete(r,which):
+        # Classify the points at radii r on the rays selected by which
+        rep = classify_points(tau_or_L,center + r*directions[which],
+                              param=param,threads=threads,**kwargs)[1]
+        uncertain[which] |= (rep != REP_DISCRETE) & (rep != REP_INDISCRETE)
+        return rep == REP_DISCRETE
+
+    active = numpy.ones(n_rays,dtype=bool)
+    for k in range(max_doublings+1):
+        which = numpy.nonzero(active)[0]
+        d = discrete(hi[which],which)
+        lo[which[d]] = hi[which[d]]
+        active[which[~d]] = False
+        if not active.any():
+            break
+        if k < max_doublings:
+            hi[active] *= 2.0
+    uncertain |= active
+
+    while True:
+        which = numpy.nonzero(~active & (hi - lo >= tol))[0]
+        if len(which) == 0:
+            break
+        mid = 0.5*(lo[which] + hi[which])
+        d = discrete(mid,which)
+        lo[which[d]] = mid[d]
+        hi[which[~d]] = mid[~d]
+
+    return center + 0.5*(lo + hi)*directions, uncertain
+
+# TILED COMPUTATION
+#
+# A large grid is computed a tile at a time into memory-mapped .npy
+# files in a directory, together with a manifest (JSON) recording the
+# parameters of the computation and the tiles that are finished.  An
+# interrupted computation is resumed by calling classify_tiled() again
+# with the same arguments.
+
+_MANIFEST = 'manifest.json'
+_ARRAYS = [ ('traces', complex, (3,)), ('rep', numpy.uint8, ()), ('nodes', numpy.intc, ()) ]
+
+def _write_manifest(directory,manifest):
+    fn = os.path.join(directory,_MANIFEST)
+    with open(fn + '.tmp','w') as f:
+        json.dump(manifest,f)
+    # Atomic, so a crash cannot leave a damaged manifest
+    os.rename(fn + '.tmp',fn)
+
+def _read_manifest(directory):
+    with open(os.path.join(directory,_MANIFEST)) as f:
+        return json.load(f)
+
+def classify_tiled(tau_or_L,center,radius,shape,directory,param='lambda',tile=256,
+                   threads=None,progress=None,**kwargs):
+    '''Compute traces and classify the holonomy over the grid of values
+    of C described by grid_points(), one tile (of tile x tile pixels)
+    at a time, storing the results in the given directory.
+
+    The arrays traces, rep and nodes (see classify_points) are stored
+    as traces.npy, rep.npy and nodes.npy and are written through memory
+    maps, so the grid need not fit in memory.  If the directory already
+    contains a partial computation with the same parameters, only the
+    missing tiles are computed.  If progress is given, it is called as
+    progress(done,total) after each tile.  Other arguments are passed
+    to classify_points(), except stats, which is not supported (nor is
+    the symmetry option of classify_grid(); each tile is computed
+    directly).
+
+    Returns the arrays as for load_tiled().'''
+    for name in ('stats','symmetry'):
+        if name in kwargs:
+            raise TypeError('classify_tiled() does not support the %s argument.' % name)
+    H, W = shape
+    tau_or_L = complex(tau_or_L)
+    center = complex(center)
+    params = { 'tau_or_L': [tau_or_L.real, tau_or_L.imag],
+               'param': param,
+               'center': [center.real, center.imag],
+               'radius': float(radius),
+               'shape': [H, W],
+               'tile': tile,
+               'options': kwargs }
+    # Compare in the form read back from the manifest
+    params = json.loads(json.dumps(params))
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if os.path.exists(os.path.join(directory,_MANIFEST)):
+        manifest = _read_manifest(directory)
+        if manifest['params'] != params:
+            raise ValueError('Directory %s contains a computation with different parameters.' % directory)
+        arrays = [ open_memmap(os.path.join(directory,name + '.npy'),mode='r+')
+                   for name,dtype,extra in _ARRAYS ]
+    else:
+        arrays = [ open_memmap(os.path.join(directory,name + '.npy'),mode='w+',
+                               dtype=dtype,shape=(H,W)+extra)
+                   for name,dtype,extra in _ARRAYS ]
+        manifest = { 'params': params, 'done': [] }
+        _write_manifest(directory,manifest)
+    traces, rep, nodes = arrays
+
+    done = set( tuple(t) for t in manifest['done'] )
+    tiles = [ (i,j) for i in range(0,H,tile) for j in range(0,W,tile) ]
+    for i,j in tiles:
+        if (i,j) in done:
+            continue
+        rows = numpy.arange(i,min(i+tile,H))[:,numpy.newaxis]
+        cols = numpy.arange(j,min(j+tile,W))[numpy.newaxis,:]
+        C = _pixel_points(center,radius,shape,rows,cols)
+        block = (slice(i,i+tile),slice(j,j+tile))
+        traces[block], rep[block], nodes[block] = classify_points(tau_or_L,C,param=param,
+                                                                  threads=threads,**kwargs)
+        for a in arrays:
+            a.flush()
+        done.add((i,j))
+        manifest['done'].append([i,j])
+        _write_manifest(directory,manifest)
+        if progress is not None:
+            progress(len(done),len(tiles))
+
+    del arrays, traces, rep, nodes
+    return load_tiled(directory)
+
+def load_tiled(directory,mmap_mode='r'):
+    '''Load the results of classify_tiled() from a directory.
+
+    Returns arrays traces, rep, nodes (memory-mapped, see numpy.load)
+    and a boolean flag indicating whether the computation is complete.
+    Parts of the arrays not yet computed contain arbitrary values.'''
+    manifest = _read_manifest(directory)
+    params = manifest['params']
+    H, W = params['shape']
+    tile = params['tile']
+    ntiles = ((H + tile - 1) // tile) * ((W + tile - 1) // tile)
+    arrays = [ numpy.load(os.path.join(directory,name + '.npy'),mmap_mode=mmap_mode)
+               for name,dtype,extra in _ARRAYS ]
+    return tuple(arrays) + (len(manifest['done']) == ntiles,)
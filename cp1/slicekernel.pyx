@@ -0,0 +1,215 @@
+'''Compiled kernel for holonomy and discreteness over many points of a slice'''
+
+from gsl_complex cimport *
+from cp1.pcint cimport pcint, step_schedule, _ScheduleList, int_stats
+from cp1.bowditch cimport mtdiscretesplit, mtdiscretebounded, rep_type
+from libc.math cimport NAN, INFINITY
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+cimport cython
+
+import numpy
+
+# Status code stored in the rep array when the integration failed
+# (the values for discrete/indiscrete/uncertain are those of bowditch)
+cdef enum:
+    cHOLONOMY_FAILED = 255
+
+HOLONOMY_FAILED = 255
+
+# Columns of the cost array filled by classify_points
+COST_FIELDS = ('accepted', 'rejected', 'hmin', 'sinksteps', 'treenodes', 'time')
+cdef enum:
+    NCOST = 6
+
+cdef inline double _now() nogil:
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + 1e-9*ts.tv_nsec
+
+cdef inline gsl_complex _g(double complex z) nogil:
+    return gsl_complex_rect(z.real, z.imag)
+
+cdef inline double complex _c(gsl_complex z) nogil:
+    return GSL_REAL(z) + 1j*GSL_IMAG(z)
+
+cdef inline double complex _csqrt(double complex z) nogil:
+    return _c(gsl_complex_sqrt(_g(z)))
+
+cdef int _point(pcint integ, double complex C, double complex alpha, double complex beta,
+                int conj, int *moves, int nmoves,
+                double complex *verts, int *offsets, int ncontours, int maxstep,
+                step_schedule ***scheds, double complex *out) nogil:
+    # Compute the punctured torus trace triple at one point C.  See
+    # s04.s04_tau_hol for the meaning of alpha, beta, conj and moves.
+    cdef double complex t[3]
+    cdef double complex x, y, z, w, s
+    cdef double m[8]
+    cdef int k, a, i
+
+    C = alpha*C + beta
+    if conj:
+        C = C.conjugate()
+    integ.P.C = _g(C)
+
+    for k in range(ncontours):
+        m[0] = 1.0
+        m[1] = 0.0
+        m[2] = 0.0
+        m[3] = 0.0
+        m[4] = 0.0
+        m[5] = 0.0
+        m[6] = 1.0
+        m[7] = 0.0
+        if integ._path(m, verts + offsets[k], offsets[k+1] - offsets[k], 1, maxstep, scheds[k]) != 0:
+            return -1
+        t[k] = (m[0] + m[6]) + 1j*(m[1] + m[7])
+
+    x = t[0]
+    y = t[1]
+    z = t[2]
+
+    if conj:
+        z = 8 - x*y - z
+        x = x.conjugate()
+        y = y.conjugate()
+        z = z.conjugate()
+
+    for i in range(nmoves):
+        a = moves[i]
+        if a == 0:
+            w = 8 - x*y - z
+            z = w
+            w = x
+            x = y
+            y = w
+        elif a > 0:
+            for k in range(a):
+                w = 8 - x*y - z
+                z = y
+                y = w
+        else:
+            for k in range(-a):
+                w = 8 - x*z - y
+                y = z
+                z = w
+
+    # Convert to punctured torus traces, as in t11.s04_to_t11
+    x = _csqrt(2 - x)
+    y = _csqrt(2 - y)
+    z = _csqrt(2 - z)
+    s = x*x + y*y + z*z
+    if abs(s + x*y*z) < abs(s - x*y*z):
+        z = -z
+
+    out[0] = x
+    out[1] = y
+    out[2] = z
+    return 0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def classify_points(pcint integ, L, alpha, beta, conj, moves, contours, C,
+                    double complex[:,::1] traces, unsigned char[::1] rep, int[::1] nodes,
+                    cost=None, node_budget=None, time_limit=None):
+    '''Compute punctured torus traces and classify the holonomy for each
+    value in the array C, writing into traces, rep and nodes.
+
+    The quadratic differential C is first mapped to alpha*C+beta (and
+    conjugated if conj is true), holonomy is computed for the cross
+    ratio L along the given closed contours, and the resulting trace
+    triple is transformed by the braid moves listed in moves.
+
+    If cost is given, it is an array of shape (len(C),len(COST_FIELDS))
+    which is filled with the cost of each point: accepted and rejected
+    ODE steps and smallest step (counted only if integ collects
+    statistics), steps to find the sink and Farey tree nodes examined,
+    and time in seconds.
+
+    If node_budget or time_limit is given, the cost of classifying each
+    point is bounded as by bowditch.classify_bounded().'''
+    cdef double complex[::1] Cv = C
+    cdef int N = Cv.shape[0]
+    cdef double complex a = alpha
+    cdef double complex b = beta
+    cdef int cj = 1 if conj else 0
+
+    cdef int ncontours = len(contours)
+    if ncontours != 3:
+        raise ValueError('Three contours are required to compute punctured torus traces.')
+
+    cdef double[:,::1] cv
+    cdef int want_cost = 0
+    if cost is not None:
+        cv = cost
+        if cv.shape[0] != N or cv.shape[1] != NCOST:
+            raise ValueError('Cost array must have shape (%d,%d).' % (N, NCOST))
+        want_cost = 1
+
+    cdef int[::1] mv
+    cdef int nmoves = len(moves)
+    mv_arr = numpy.zeros(nmoves+1, dtype=numpy.intc)
+    mv_arr[:nmoves] = moves
+    mv = mv_arr
+
+    offsets_arr = numpy.zeros(ncontours+1, dtype=numpy.intc)
+    for k,gamma in enumerate(contours):
+        offsets_arr[k+1] = offsets_arr[k] + len(gamma)
+    cdef int[::1] offsets = offsets_arr
+    cdef double complex[::1] V = numpy.ascontiguousarray(numpy.concatenate(contours), dtype=complex)
+
+    if node_budget is not None and node_budget < 0:
+        raise ValueError('Node budget must be nonnegative, got %d.' % node_budget)
+    cdef int bounded = not (node_budget is None and time_limit is None)
+    cdef int budget = -1 if node_budget is None else node_budget
+    cdef double limit = 0.0 if time_limit is None else time_limit
+
+    cdef int i, sinksteps, treenodes, depth, status
+    cdef int maxstep = integ.maxstep
+    integ.P.L = _g(L)
+
+    # Step schedules, if the integrator reuses them
+    cdef step_schedule **scheds[3]
+    cdef _ScheduleList sl
+    sls = []
+    for k,gamma in enumerate(contours):
+        sl = integ._path_schedules(L, gamma, True)
+        sls.append(sl)
+        scheds[k] = NULL if sl is None else sl.ptrs
+
+    cdef int_stats st0
+    cdef double t0, hmin0
+
+    with nogil:
+        for i in range(N):
+            if want_cost:
+                st0 = integ.st
+                hmin0 = integ.st.hmin
+                integ.st.hmin = INFINITY
+                t0 = _now()
+            status = _point(integ, Cv[i], a, b, cj, &mv[0], nmoves,
+                            &V[0], &offsets[0], ncontours, maxstep, scheds, &traces[i,0])
+            sinksteps = 0
+            treenodes = 0
+            if status != 0:
+                traces[i,0] = NAN
+                traces[i,1] = NAN
+                traces[i,2] = NAN
+                rep[i] = cHOLONOMY_FAILED
+                nodes[i] = 0
+            elif bounded:
+                rep[i] = <unsigned char>mtdiscretebounded(_g(traces[i,0]), _g(traces[i,1]), _g(traces[i,2]),
+                                                          budget, limit, &sinksteps, &treenodes, &depth)
+                nodes[i] = sinksteps + treenodes
+            else:
+                rep[i] = <unsigned char>mtdiscretesplit(_g(traces[i,0]), _g(traces[i,1]), _g(traces[i,2]),
+                                                        &sinksteps, &treenodes)
+                nodes[i] = sinksteps + treenodes
+            if want_cost:
+                cv[i,0] = integ.st.accepted - st0.accepted
+                cv[i,1] = integ.st.rejected - st0.rejected
+                cv[i,2] = integ.st.hmin
+                cv[i,3] = sinksteps
+                cv[i,4] = treenodes
+                cv[i,5] = _now() - t0
+                if hmin0 < integ.st.hmin:
+                    integ.st.hmin = hmin0
@@ -1,6 +1,6 @@
 '''Holonomy of projective structures on a punctured torus'''
 import cp1.s04 as s04
-from numpy import trace
+from numpy import sqrt as vsqrt, where, stack
 from cmath import sqrt
 
 def markov_z(x,y):
@@ -18,6 +18,19 @@ def s04_to_t11(traces):
             z = -z
         return x,y,z   
 
+def s04_to_t11_many(traces):
+    '''Array version of s04_to_t11; traces is an (N,2) or (N,3) array'''
+    x = vsqrt(2-traces[:,0])
+    y = vsqrt(2-traces[:,1])
+    if traces.shape[1] == 2:
+        xy = x*y
+        z = 0.5*(xy - vsqrt(xy**2 - 4.0*(x**2 + y**2)))
+    else:
+        z = vsqrt(2-traces[:,2])
+        s = x**2 + y**2 + z**2
+        z = where(abs(s + x*y*z) < abs(s - x*y*z), -z, z)
+    return stack([x,y,z],axis=1)
+
 # Convention: L = lambda = cross ratio parameter of 4-punctured sphere commensurable
 #                          with the desired punctured torus
 #             C = quadratic differential parameter
@@ -34,10 +47,34 @@ class T11(s04.S04):
     def gens(self,C):
         raise NotImplementedError('Matrix generators are not available for T11 holonomy.')
 
-    def traces(self,C):
-        '''Compute traces of holonomy group generators'''
-        s04traces = [ trace(m) for m in s04.S04.gens(self,C) ]
-        return s04_to_t11(s04traces)
+    def gens_sl2c(self,C):
+        raise NotImplementedError('Matrix generators are not available for T11 holonomy.')
+
+    def _traces_with(self,integ,C):
+        return s04_to_t11(s04.S04._traces_with(self,integ,C))
+
+    def trace_jacobian(self,C):
+        '''Compute traces of holonomy group generators and their
+        derivatives with respect to C; returns a pair of lists (traces,
+        derivatives)'''
+        s04traces, ds04traces = s04.S04.trace_jacobian(self,C)
+        traces = s04_to_t11(s04traces)
+        # x = +/-sqrt(2-t), so dx = -dt/(2x) whichever sign was chosen
+        dtraces = [ -0.5*dt/x for x,dt in zip(traces,ds04traces) ]
+        if len(s04traces) == 2:
+            # Differentiate x^2 + y^2 + z^2 = xyz
+            x,y,z = traces
+            dx,dy = dtraces
+            dtraces.append( ((y*z - 2*x)*dx + (x*z - 2*y)*dy)/(2*z - x*y) )
+        return list(traces), dtraces
+
+    def gens_many(self,C):
+        raise NotImplementedError('Matrix generators are not available for T11 holonomy.')
+
+    def traces_many(self,C):
+        '''Compute traces of holonomy group generators for an array of
+        values of C; returns an (N,3) complex array'''
+        return s04_to_t11_many(s04.S04.traces_many(self,C))
 
 # Convenience function to compute trace tuple directly from L and C
 # (use this when L and C will change independently between calls)
@@ -45,6 +82,26 @@ def t11_lambda_hol(L=0.5,C=0.5,**kwargs):
     '''Compute traces of holonomy group generators for (L,C) projective connection'''
     return s04_to_t11(s04.s04_lambda_hol(L=L,C=C,**kwargs))
 
+def t11_lambda_hol_many(L,C,**kwargs):
+    '''Array version of t11_lambda_hol (see s04.s04_lambda_hol_many)'''
+    traces = s04.s04_lambda_hol_many(L,C,**kwargs)
+    shape = traces.shape
+    return s04_to_t11_many(traces.reshape(-1,shape[-1])).reshape(shape[:-1] + (3,))
+
+def t11_solve_C_for_trace(L,target,index,C0=0.0,trace_tol=1e-10,maxiter=50,**kwargs):
+    '''Find C near C0 for which the punctured torus trace number index
+    at (L,C) equals target; see S04.solve_C_for_trace.  Passes kwargs
+    to T11.__init__().'''
+    h, lock = s04._cached_S04(L,kwargs,T11)
+    with lock:
+        return h.solve_C_for_trace(target,index,C0,trace_tol,maxiter)
+
 def t11_tau_hol(tau=1j,C=0.0,**kwargs):
     '''Compute traces of holonomy group generators for (tau,C) projective connection'''
     return s04_to_t11(s04.s04_tau_hol(tau=tau,C=C,**kwargs))
+
+def t11_tau_hol_many(tau,C,**kwargs):
+    '''Array version of t11_tau_hol (see s04.s04_tau_hol_many)'''
+    traces = s04.s04_tau_hol_many(tau,C,**kwargs)
+    shape = traces.shape
+    return s04_to_t11_many(traces.reshape(-1,3)).reshape(shape)
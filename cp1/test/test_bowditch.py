@@ -0,0 +1,59 @@
+import cp1
+
+def test_classify_hex():
+    rep, nodes = cp1.classify(3.0, 3.0, 3.0)
+    assert( rep == cp1.REP_DISCRETE )
+
+def test_classify_indiscrete():
+    rep, nodes = cp1.classify(0.5, 2.0, 2.0)
+    assert( rep == cp1.REP_INDISCRETE )
+
+def test_classify_many():
+    r2 = 2.82842712474619009760
+    triples = [ (3.0, 3.0, 3.0),
+                (r2, r2, 4.0),
+                (0.5, 2.0, 2.0),
+                (3.0+0.1j, 3.0-0.2j, 2.9+0.05j) ]
+    rep, nodes = cp1.classify_many(triples, threads=2)
+    assert( rep.shape == (4,) )
+    for (x,y,z),r,n in zip(triples,rep,nodes):
+        assert( (r,n) == cp1.classify(x,y,z) )
+
+def test_classify_stats():
+    for xyz in [ (3.0, 3.0, 3.0), (0.5, 2.0, 2.0), (3.0+0.1j, 3.0-0.2j, 2.9+0.05j) ]:
+        rep, nodes = cp1.classify(xyz)
+        srep, sinksteps, treenodes = cp1.classify_stats(xyz)
+        assert( srep == rep )
+        assert( sinksteps + treenodes == nodes )
+
+def test_classify_bounded():
+    r2 = 2.82842712474619009760
+    triples = [ (3.0, 3.0, 3.0),
+                (r2, r2, 4.0),
+                (0.5, 2.0, 2.0),
+                (3.0+0.1j, 3.0-0.2j, 2.9+0.05j) ]
+    for xyz in triples:
+        rep, nodes = cp1.classify(xyz)
+        brep, bnodes, depth = cp1.classify_bounded(xyz)
+        assert( brep == rep )
+        assert( cp1.classify_bounded(xyz, node_budget=bnodes, time_limit=10.0) == (brep, bnodes, depth) )
+        if brep == cp1.REP_DISCRETE and depth > 0:
+            # Running out of budget leaves some levels unexamined
+            srep, snodes, sdepth = cp1.classify_bounded(xyz, node_budget=bnodes-1)
+            assert( srep == cp1.REP_UNCERTAIN )
+            assert( snodes <= bnodes-1 )
+            assert( sdepth < depth )
+            assert( cp1.classify(xyz, node_budget=bnodes-1) == (srep, snodes) )
+
+    rep, nodes = cp1.classify_many(triples, threads=2, node_budget=5)
+    for xyz,r,n in zip(triples,rep,nodes):
+        assert( (r,n) == cp1.classify(xyz, node_budget=5) )
+        assert( n <= 5 )
+
+def test_classify_threshold_sink():
+    # The sink search stops at once with |w| equal to the Jorgensen
+    # threshold; budget and time limits do not change the result
+    xyz = (0.0001, 1.0, 1.0)
+    assert( cp1.classify(xyz) == (cp1.REP_INDISCRETE, 1) )
+    assert( cp1.classify(xyz, node_budget=100, time_limit=10.0) == (cp1.REP_INDISCRETE, 1) )
+    assert( cp1.classify_bounded(xyz)[0] == cp1.REP_INDISCRETE )
@@ -0,0 +1,47 @@
+import cp1
+import cp1.cli
+import io
+import numpy
+import pytest
+
+TESTDELTA = 0.00001
+
+RECORDS = [ (0.5, 0.0), (0.5 + 0.86602540378443864676j, -0.57735026918962576451j), (0.5, 0.05+0.05j) ]
+
+def text_input():
+    lines = [ '%r %r %r %r' % (L.real, L.imag, C.real, C.imag)
+              for L,C in [ (complex(L),complex(C)) for L,C in RECORDS ] ]
+    return io.BytesIO(('\n'.join(lines) + '\n').encode('ascii'))
+
+@pytest.mark.parametrize( ("processes"), [1, 2])
+def test_cli_text(processes):
+    out = io.BytesIO()
+    cp1.cli.main(['hol','-j',str(processes),'--chunk','2','--t11','--classify'],
+                 stdin=text_input(),stdout=out)
+    lines = out.getvalue().decode('ascii').splitlines()
+    assert( len(lines) == len(RECORDS) )
+    for line,(L,C) in zip(lines,RECORDS):
+        f = line.split()
+        traces = [ float(f[2*k]) + 1j*float(f[2*k+1]) for k in range(3) ]
+        for t,tref in zip(traces,cp1.t11_lambda_hol(L,C,contours=3)):
+            assert( abs(t-tref) < TESTDELTA )
+        assert( (int(f[6]),int(f[7])) == cp1.classify(traces) )
+
+def test_cli_npy(tmpdir):
+    infile = str(tmpdir.join('in.npy'))
+    outfile = str(tmpdir.join('out.npy'))
+    numpy.save(infile,numpy.array(RECORDS,dtype=complex))
+    cp1.cli.main(['hol','-j','1','-i','npy','-f','npy','-o',outfile,infile])
+    res = numpy.load(outfile)
+    assert( res.shape == (len(RECORDS),3) )
+    for row,(L,C) in zip(res,RECORDS):
+        for t,tref in zip(row,cp1.s04_lambda_hol(L,C,contours=3)):
+            assert( abs(t-tref) < TESTDELTA )
+
+def test_cli_raw():
+    data = numpy.array(RECORDS,dtype='<c16')
+    out = io.BytesIO()
+    cp1.cli.main(['hol','-j','1','-i','raw','-f','raw'],stdin=io.BytesIO(data.tobytes()),stdout=out)
+    res = numpy.frombuffer(out.getvalue(),dtype='<c16').reshape(-1,3)
+    ref = cp1.s04_lambda_hol_many(data[:,0],data[:,1],contours=3)
+    assert( abs(res - ref).max() < TESTDELTA )
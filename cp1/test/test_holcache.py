@@ -0,0 +1,103 @@
+import cp1
+from cp1.holcache import HolonomyCache
+import numpy
+import threading
+
+TESTDELTA = 0.00001
+
+def test_holcache_get_put(tmpdir):
+    cache = HolonomyCache(str(tmpdir.join('hol.db')))
+    L = 0.5 + 0.1j
+    C = numpy.array([0.0, 0.1+0.2j, 1e-17j])
+    traces = numpy.array([[1,2,3],[4j,5,6],[7,8,numpy.nan]],dtype=complex)
+    cache.put_many('s',L,C,traces)
+    assert( len(cache) == 2 )
+    res, found = cache.get_many('s',L,numpy.append(C,2.0),3)
+    assert( list(found) == [True, True, False, False] )
+    assert( (res[:2] == traces[:2]).all() )
+    assert( numpy.isnan(res[2:]).all() )
+    assert( cache.get('other settings',L,C[0],3) is None )
+    assert( cache.get('s',L,C[1],3) == list(traces[1]) )
+    assert( cache.hits == 3 and cache.misses == 3 )
+
+def test_holcache_eviction(tmpdir):
+    cache = HolonomyCache(str(tmpdir.join('hol.db')),max_entries=3)
+    for k in range(5):
+        cache.put('s',0.5,k,[k,k,k])
+    assert( len(cache) == 3 )
+    assert( cache.get('s',0.5,4,3) == [4,4,4] )
+    assert( cache.get('s',0.5,0,3) is None )
+    cache.resize(1)
+    assert( len(cache) == 1 )
+
+def test_holcache_lookup_recency(tmpdir):
+    cache = HolonomyCache(str(tmpdir.join('hol.db')),max_entries=3)
+    for k in range(3):
+        cache.put('s',0.5,k,[k,k,k])
+    # Looking up 0 makes 1 the least recently used
+    assert( cache.get('s',0.5,0,3) == [0,0,0] )
+    cache.put('s',0.5,3,[3,3,3])
+    assert( cache.get('s',0.5,0,3) == [0,0,0] )
+    assert( cache.get('s',0.5,1,3) is None )
+
+def test_holcache_eviction_slack(tmpdir):
+    cache = HolonomyCache(str(tmpdir.join('hol.db')),max_entries=16)
+    for k in range(40):
+        cache.put('s',0.5,k,[k,k,k])
+        assert( 16 <= len(cache) <= 18 or k < 16 )
+    cache.resize(16)
+    assert( len(cache) == 16 )
+
+def test_holcache_read_only_lookup(tmpdir):
+    import sqlite3
+    path = str(tmpdir.join('hol.db'))
+    cache = HolonomyCache(path,timeout=0.1)
+    cache.put('s',0.5,1.0,[1,2,3])
+    # Lookups succeed while another connection holds the write lock
+    other = sqlite3.connect(path,isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+    try:
+        assert( cache.get('s',0.5,1.0,3) == [1,2,3] )
+        res, found = cache.get_many('s',0.5,[1.0,2.0],3)
+        assert( list(found) == [True, False] )
+    finally:
+        other.execute('ROLLBACK')
+    cache.flush()
+
+def test_holcache_concurrent(tmpdir):
+    path = str(tmpdir.join('hol.db'))
+    caches = [ HolonomyCache(path) for k in range(2) ]
+    def work(k):
+        for i in range(20):
+            C = numpy.arange(10) + 100*i + 10000*k
+            caches[k % 2].put_many('s',0.5,C,numpy.ones((10,3)))
+            caches[(k+1) % 2].get_many('s',0.5,C,3)
+    threads = [ threading.Thread(target=work,args=(k,)) for k in range(4) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert( len(HolonomyCache(path)) == 4*20*10 )
+
+def test_s04_disk_cache(tmpdir):
+    L = 0.5 + 0.86602540378443864676j
+    C = -0.57735026918962576451j
+    cache = HolonomyCache(str(tmpdir.join('hol.db')))
+    h = cp1.S04(L,contours=3,disk_cache=cache)
+    ref = h.traces(C)
+    assert( cache.misses == 1 )
+    # A new instance with the same settings finds the point
+    h = cp1.S04(L,contours=3,disk_cache=cache)
+    steps = h._pcint.nsteps
+    for t,tref in zip(h.traces(C),ref):
+        assert( t == tref )
+    assert( h._pcint.nsteps == steps )
+    tr = h.traces_many([C, 0.1])
+    assert( abs(tr[0]-ref).max() == 0 )
+    assert( cache.hits == 2 and cache.misses == 2 )
+    # Different settings do not
+    h = cp1.S04(L,contours=3,tol=1e-8,disk_cache=cache)
+    h.traces(C)
+    assert( cache.misses == 3 )
+    x,y,z = cp1.t11_lambda_hol(L,C,contours=3,disk_cache=cache)
+    assert( abs(x-3.0) < TESTDELTA )
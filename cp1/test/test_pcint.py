@@ -0,0 +1,73 @@
+import cp1
+import cmath
+import numpy
+import pytest
+
+from cp1.pcint import pcint
+
+TESTDELTA = 0.00001
+
+def test_modularlambda_hex():
+    # lambda(exp(pi i/3)) = exp(pi i/3)
+    tau = 0.5 + 0.86602540378443864676j
+    assert( abs(cp1.modularlambda(tau) - tau) < TESTDELTA )
+
+def test_modularlambda_square():
+    assert( abs(cp1.modularlambda(1.0j) - 0.5) < TESTDELTA )
+
+def test_modularlambda_invariance():
+    # Invariant under Gamma(2), transformed simply by T and S
+    for tau in [0.3+0.9j, -0.2+1.4j]:
+        L = cp1.modularlambda(tau)
+        assert( abs(cp1.modularlambda(tau+2) - L) < TESTDELTA )
+        assert( abs(cp1.modularlambda(tau+1) - L/(L-1)) < TESTDELTA )
+        assert( abs(cp1.modularlambda(-1.0/tau) - (1-L)) < TESTDELTA )
+        assert( abs(cp1.modularlambda(tau/(2*tau+1)) - L) < TESTDELTA )
+
+def test_modularlambda_invalid():
+    with pytest.raises(ValueError):
+        cp1.modularlambda(0.5-0.1j)
+
+def test_modularlambda_many():
+    taus = numpy.array([[0.3+0.9j, 2.1+0.01j], [-0.4+0.2j, 0.5-1.0j]])
+    L = cp1.modularlambda_many(taus)
+    assert( L.shape == (2,2) )
+    for idx in [(0,0),(0,1),(1,0)]:
+        assert( abs(L[idx] - cp1.modularlambda(taus[idx])) < TESTDELTA )
+    assert( cmath.isnan(L[1,1]) )
+
+def test_modularlambda_constants():
+    import cp1.pcint
+    assert( cp1.pcint.LAMBDA_ITER_MAX == 200 )
+    assert( abs(cp1.pcint.M_PI - cmath.pi) < TESTDELTA )
+    assert( abs(cp1.pcint.M_PI_4 - cmath.pi/4) < TESTDELTA )
+    assert( cp1.pcint.DBL_EPSILON > 0 )
+
+def test_sl2c():
+    A = numpy.array([[2.0+1.0j, 1.0], [3.0-1.0j, 1.0]])
+    A /= cmath.sqrt(numpy.linalg.det(A))
+    B = numpy.array([[1.0, 0.5j], [0.0, 1.0]])
+    a = cp1.SL2C(A)
+    b = cp1.SL2C(B.tolist())
+    assert( abs(a.trace() - numpy.trace(A)) < TESTDELTA )
+    assert( abs(a.det() - 1.0) < TESTDELTA )
+    assert( a[1,0] == A[1,0] and a[0][1] == A[0,1] )
+    assert( numpy.allclose(numpy.asarray(a*b), A.dot(B)) )
+    assert( numpy.allclose(numpy.asarray(a.inverse()), numpy.linalg.inv(A)) )
+    c = cp1.SL2C(a)
+    assert( c.imul(b) is c )
+    assert( numpy.allclose(numpy.asarray(c), A.dot(B)) )
+    assert( numpy.allclose(numpy.asarray(a), A) )
+    c.set_identity()
+    assert( c.tolist() == [[1.0, 0.0], [0.0, 1.0]] )
+
+def test_seg_int_sl2c():
+    p = pcint()
+    m = p.seg_int(0.5, 0.2, 0.5+0.5j, 1.5+0.5j)
+    s = cp1.SL2C()
+    assert( p.seg_int(0.5, 0.2, 0.5+0.5j, 1.5+0.5j, init=s, out=s) is s )
+    assert( numpy.allclose(numpy.asarray(s), m) )
+    # In place, continuing along a second segment
+    m2 = p.seg_int(0.5, 0.2, 1.5+0.5j, 1.5-0.5j, init=m)
+    p.seg_int(0.5, 0.2, 1.5+0.5j, 1.5-0.5j, init=s, out=s)
+    assert( numpy.allclose(numpy.asarray(s), m2) )
@@ -1,4 +1,5 @@
 import cp1
+import numpy
 import pytest
 
 TESTDELTA = 0.00001
@@ -70,5 +71,270 @@ def test_s04_compare_simp_adv():
         assert( abs(y1-y2) < TESTDELTA)
         assert( abs(z1-z2) < TESTDELTA)
 
+@pytest.mark.parametrize( ("fund_domain_contours"), [True, False])
+@pytest.mark.parametrize( ("L","C"), [(0.5, 0.0),
+                                      (0.5 + 0.86602540378443864676j, -0.57735026918962576451j),
+                                      (0.2 + 0.05j, 0.3 + 0.1j),
+                                      (0.05 + 2.0j, 1.0 + 1.0j)])
+def test_s04_clearance_contours(fund_domain_contours,L,C):
+    kwargs = dict(contours=3,tol=1e-10,fund_domain_contours=fund_domain_contours)
+    h = cp1.S04(L,**kwargs)
+    hc = cp1.S04(L,contour_mode='clearance',**kwargs)
+    for t,tref in zip(hc.traces(C),h.traces(C)):
+        assert( abs(t-tref) < TESTDELTA*max(1,abs(tref)) )
+    with pytest.raises(ValueError):
+        cp1.S04(L,contour_mode='round')
+
+@pytest.mark.parametrize( ("fund_domain_contours"), [True, False])
+def test_s04_traces_many(fund_domain_contours):
+    L = 0.5 + 0.86602540378443864676j
+    Cs = [ -0.57735026918962576451j, 2.0 + 3.0j - L ]
+    h = cp1.S04(L,contours=3,tol=1e-8,fund_domain_contours=fund_domain_contours)
+    tr = h.traces_many(Cs)
+    assert( tr.shape == (2,3) )
+    for C,row in zip(Cs,tr):
+        for t,tref in zip(row,h.traces(C)):
+            assert( abs(t-tref) < TESTDELTA)
+
+def test_s04_surrogate():
+    L = 0.5 + 0.86602540378443864676j
+    center = -0.57735026918962576451j
+    h = cp1.S04(L,contours=3,tol=1e-8)
+    s = h.surrogate(center,0.3,degree=16)
+    assert( s.error < TESTDELTA )
+    Cs = [ center, center + 0.25, center - 0.1 + 0.2j, center + 1.0 ]
+    tr = s.traces_many(Cs,tol=1e-7)
+    # The last point is outside the sampling circle
+    assert( s.error_estimate(Cs)[-1] > 1e-7 )
+    for C,row in zip(Cs,tr):
+        for t,tref in zip(row,h.traces(C)):
+            assert( abs(t-tref) < TESTDELTA)
+
+@pytest.mark.parametrize( ("fund_domain_contours"), [True, False])
+def test_s04_reuse_steps(fund_domain_contours):
+    L = 0.5 + 0.86602540378443864676j
+    C0 = -0.57735026918962576451j
+    h = cp1.S04(L,contours=3,tol=1e-8,fund_domain_contours=fund_domain_contours)
+    hr = cp1.S04(L,contours=3,tol=1e-8,fund_domain_contours=fund_domain_contours,
+                 reuse_steps=True)
+    # Nearby points replay recorded steps; the last one forces a new schedule
+    Cs = [ C0, C0 + 0.001, C0 + 0.002j, 2.0 + 3.0j - L ]
+    for C in Cs:
+        for t,tref in zip(hr.traces(C),h.traces(C)):
+            assert( abs(t-tref) < TESTDELTA)
+    for row,C in zip(hr.traces_many(Cs),Cs):
+        for t,tref in zip(row,h.traces(C)):
+            assert( abs(t-tref) < TESTDELTA)
 
-    
+@pytest.mark.parametrize( ("fund_domain_contours"), [True, False])
+def test_s04_segment_cache(fund_domain_contours):
+    L = 0.5 + 0.86602540378443864676j
+    h = cp1.S04(L,contours=3,tol=1e-8,fund_domain_contours=fund_domain_contours)
+    cache = cp1.SegmentCache()
+    hs = cp1.S04(L,contours=3,tol=1e-8,fund_domain_contours=fund_domain_contours,
+                 segment_cache=cache)
+    for C in [ -0.57735026918962576451j, 2.0 + 3.0j - L ]:
+        for t,tref in zip(hs.traces(C),h.traces(C)):
+            assert( abs(t-tref) < TESTDELTA)
+        for m,mref in zip(hs.gens_sl2c(C),h.gens_sl2c(C)):
+            assert( isinstance(m,cp1.SL2C) and isinstance(mref,cp1.SL2C) )
+            assert( numpy.allclose(numpy.asarray(m),numpy.asarray(mref),atol=TESTDELTA) )
+        for m,mref in zip(hs.gens(C),h.gens(C)):
+            assert( isinstance(m,list) and isinstance(mref,list) )
+            assert( numpy.allclose(m,mref,atol=TESTDELTA) )
+        for t,tref in zip(hs.traces_many([C])[0],h.traces(C)):
+            assert( abs(t-tref) < TESTDELTA)
+    # Repeated evaluation only uses the cache
+    n = len(cache)
+    hs.traces(-0.57735026918962576451j)
+    assert( len(cache) == n )
+    assert( cache.hits >= n // 2 )
+    # Instances with other solver settings do not share entries
+    hm = cp1.S04(L,contours=3,tol=1e-8,fund_domain_contours=fund_domain_contours,
+                 segment_cache=cache,method='magnus4')
+    hm.traces(-0.57735026918962576451j)
+    assert( len(cache) == 2*n )
+
+def test_s04_segment_cache_many():
+    L = 0.5 + 0.86602540378443864676j
+    Cs = [ -0.57735026918962576451j, 0.1+0.2j, 0.3 ]
+    h = cp1.S04(L,contours=3,tol=1e-8)
+    cache = cp1.SegmentCache()
+    hs = cp1.S04(L,contours=3,tol=1e-8,segment_cache=cache,segment_threads=2)
+    ref = h.traces_many(Cs)
+    assert( numpy.allclose(hs.traces_many(Cs),ref,atol=TESTDELTA) )
+    # The batch fills the cache, which later calls use
+    n = len(cache)
+    assert( n > 0 )
+    hits = cache.hits
+    assert( numpy.allclose(hs.traces_many(Cs[:2]),ref[:2],atol=TESTDELTA) )
+    for t,tref in zip(hs.traces(Cs[2]),ref[2]):
+        assert( abs(t-tref) < TESTDELTA )
+    assert( len(cache) == n )
+    assert( cache.hits - hits == n )
+
+def test_segment_cache_arrays():
+    C = numpy.arange(400)*(0.01+0.02j)
+    mats = numpy.arange(1600,dtype=complex).reshape(400,2,2)
+    cache = cp1.SegmentCache(maxsize=500)
+    for k in range(0,400,30):
+        cache.put_many('a',C[k:k+30],mats[k:k+30])
+    res, found = cache.get_many('a',numpy.append(C[::-1],5.0))
+    assert( found[:-1].all() and not found[-1] )
+    assert( (res[:-1] == mats[::-1]).all() and numpy.isnan(res[-1]).all() )
+    # Single matrices are keyed by (L, C, p0, p1, settings)
+    cache.put(('b',1.0,0,1,'s'),numpy.eye(2))
+    assert( (cache.get(('b',1.0,0,1,'s')) == numpy.eye(2)).all() )
+    assert( cache.get(('b',2.0,0,1,'s')) is None )
+    # Whole segments are discarded, least recently used first
+    cache.put_many('c',C[:200],mats[:200])
+    assert( len(cache) == 201 )
+    assert( not cache.get_many('a',C[:1])[1][0] )
+    # The most recently added matrices of a segment are kept
+    cache.put_many('c',C[200:250],mats[200:250])
+    cache.resize(100)
+    assert( len(cache) == 100 )
+    res, found = cache.get_many('c',C[:250])
+    assert( found.sum() == 100 and found[150:].all() )
+
+def test_lru_cache_threads():
+    import threading
+    cache = cp1.s04.LRUCache(50)
+    def work(seed):
+        for k in range(2000):
+            key = (seed*7 + k) % 80
+            if cache.get(key) is None:
+                cache.put(key,[key])
+    threads = [ threading.Thread(target=work,args=(i,)) for i in range(4) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert( cache.hits + cache.misses == 4*2000 )
+    assert( len(cache) == 50 )
+    for key in list(cache._data):
+        assert( cache.get(key) == [key] )
+
+def test_s04_instance_cache():
+    L = 0.5 + 0.86602540378443864676j
+    C = -0.57735026918962576451j
+    cache = cp1.s04.instance_cache
+    cache.clear()
+    hits, misses = cache.hits, cache.misses
+    for i in range(3):
+        x,y,z = cp1.s04_lambda_hol(L,C,contours=3,tol=1e-8)
+        assert( abs(x+7.0) < TESTDELTA)
+    assert( cache.misses == misses + 1 )
+    assert( cache.hits == hits + 2 )
+    cp1.s04_lambda_hol(L,C,contours=3,tol=1e-6)
+    assert( len(cache) == 2 )
+    # Equivalent arguments, including defaults, share an instance
+    cp1.s04_lambda_hol(L,C,tol=1e-6,contours=3.0,step=0.02,method='rk8pd')
+    assert( len(cache) == 2 )
+    assert( cache.hits == hits + 3 )
+    cache.resize(1)
+    assert( len(cache) == 1 )
+    cache.resize(32)
+
+@pytest.mark.parametrize( ("method"), ['magnus4', 'magnus6'])
+@pytest.mark.parametrize( ("L","C","ref"), [
+    (0.5 + 0.86602540378443864676j, -0.57735026918962576451j, [-7.0, -7.0, -7.0]),
+    (0.5, 0.0, [-6.0, -6.0, -14.0]),
+    (0.5 + 0.86602540378443864676j, 2.0 + 3.0j - (0.5 + 0.86602540378443864676j),
+     [-222.533070-262.929905j, 1272.251270-2334.830978j, -2.848143-7.056932j]),
+    ])
+def test_s04_magnus(method,L,C,ref):
+    x,y,z = cp1.s04_lambda_hol(L,C,contours=3,tol=1e-8,method=method)
+    for t,tref in zip((x,y,z),ref):
+        assert( abs(t-tref) < TESTDELTA)
+
+def test_s04_tau_hol_many():
+    taus = [ 0.5+0.86602540378443864676j, 1.5+0.86602540378443864676j,
+             2.3+0.4j, -0.2+0.3j, 0.1-0.1j ]
+    Cs = [ -0.57735026918962576451j, 0.1j, 0.05, 0.0, 0.0 ]
+    res = cp1.s04_tau_hol_many(taus,Cs,tol=1e-8)
+    assert( res.shape == (5,3) )
+    for tau,C,row in zip(taus[:-1],Cs[:-1],res[:-1]):
+        for t,tref in zip(row,cp1.s04_tau_hol(tau,C,tol=1e-8)):
+            assert( abs(t-tref) < TESTDELTA*max(1,abs(tref)) )
+    assert( not numpy.isfinite(res[-1]).any() )
+
+def test_s04_stats():
+    L = 0.5 + 0.86602540378443864676j
+    C = -0.57735026918962576451j
+    h = cp1.S04(L,contours=3,tol=1e-8,collect_stats=True)
+    h.traces(C)
+    st = h.stats()
+    assert( st['segments'] == sum(len(gamma) for gamma in h.contours) )
+    assert( st['accepted'] == h._pcint.nsteps )
+    assert( st['failed'] == 0 )
+    assert( 0 < st['hmin'] < 1 )
+    assert( all(t > 0 for t in st['contour_time']) )
+    h.reset_stats()
+    assert( h.stats()['accepted'] == 0 )
+
+def test_s04_segment_stats():
+    L = 0.5 + 0.86602540378443864676j
+    C = -0.57735026918962576451j
+    for segment_cache in [False, True]:
+        h = cp1.S04(L,contours=3,tol=1e-8,collect_stats='segments',segment_cache=segment_cache)
+        h.traces(C)
+        st = h.stats()
+        segs = st['segment_stats']
+        assert( len(segs) == st['segments'] )
+        assert( sum(s['accepted'] for s in segs) == st['accepted'] )
+        assert( min(s['hmin'] for s in segs) == st['hmin'] )
+        assert( all(s['ok'] and s['C'] == C and s['contours'] for s in segs) )
+        assert( sorted(set(k for s in segs for k in s['contours'])) == [0,1,2] )
+        h.reset_stats()
+        assert( h.stats()['segment_stats'] == [] )
+
+def test_s04_traces_along():
+    L = 0.5 + 0.86602540378443864676j
+    h = cp1.S04(L,contours=3,tol=1e-8)
+    path = [ -0.57735026918962576451j, 0.2-0.5j, 0.2 ]
+    points = list(h.traces_along(path,max_change=0.1))
+    Cs = [ C for C,traces in points ]
+    for C in path:
+        assert( C in Cs )
+    for C,traces in points[::5]:
+        for t,tref in zip(traces,h.traces(C)):
+            assert( abs(t-tref) < TESTDELTA*max(1,abs(tref)) )
+    for (C0,T0),(C1,T1) in zip(points,points[1:]):
+        for t0,t1 in zip(T0,T1):
+            assert( abs(t1-t0) <= 0.1*max(1,abs(t0)) )
+
+def test_s04_traces_along_min_spacing():
+    # With a tiny max_change every step is limited by min_spacing, and
+    # the walk must still reach the end of the path
+    h = cp1.S04(0.5,contours=3)
+    path = [ 0.1, 0.1 + 1.5e-5 ]
+    points = list(h.traces_along(path,max_change=1e-12,min_spacing=1e-6))
+    assert( points[-1][0] == path[-1] )
+    assert( 10 <= len(points) <= 20 )
+    # Other callers of the instance are unaffected by the walk
+    integ = h._pcint
+    gen = h.traces_along([0.0, 0.1],max_change=0.01)
+    next(gen)
+    next(gen)
+    assert( h._pcint is integ )
+    for t,tref in zip(h.traces(0.05),cp1.S04(0.5,contours=3).traces(0.05)):
+        assert( abs(t-tref) < TESTDELTA*max(1,abs(tref)) )
+
+def test_s04_trace_jacobian():
+    L = 0.5 + 0.86602540378443864676j
+    C = 0.1-0.5j
+    h = cp1.S04(L,contours=3,tol=1e-10)
+    traces, dtraces = h.trace_jacobian(C)
+    eps = 1e-5
+    tp = h.traces(C+eps)
+    tm = h.traces(C-eps)
+    for k in range(3):
+        assert( abs(traces[k] - h.traces(C)[k]) < TESTDELTA )
+        assert( abs(dtraces[k] - (tp[k]-tm[k])/(2*eps)) < 1e-4*max(1,abs(dtraces[k])) )
+
+def test_s04_solve_C_for_trace():
+    L = 0.5 + 0.86602540378443864676j
+    Cref = -0.57735026918962576451j
+    C = cp1.s04_solve_C_for_trace(L,-7.0,0,C0=-0.55j,contours=3,tol=1e-10)
+    assert( abs(C-Cref) < TESTDELTA )
@@ -0,0 +1,57 @@
+import cp1
+import asyncio
+import json
+import pytest
+
+server = pytest.importorskip('cp1.server')
+
+TESTDELTA = 0.00001
+
+def test_server():
+    L = 0.5
+    Cs = [ 0.0, 0.05+0.05j, 0.1j ]
+
+    async def run():
+        hs = server.HolonomyServer(threads=2)
+        srv = await hs.start(port=0)
+        port = srv.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1',port)
+        for i,C in enumerate(Cs):
+            req = { 'id': i, 'L': [L, 0.0], 'C': [C.real, C.imag], 'classify': True }
+            writer.write(json.dumps(req).encode('utf-8') + b'\n')
+        writer.write(b'{"id": 99, "L": [0.5, 0.0], "kind": "xyz"}\n')
+        await writer.drain()
+        resps = [ json.loads((await reader.readline()).decode('utf-8')) for i in range(len(Cs)+1) ]
+        writer.close()
+        srv.close()
+        await srv.wait_closed()
+        return hs, resps
+
+    hs, resps = asyncio.run(run())
+    resps = dict( (r['id'],r) for r in resps )
+    assert( 'error' in resps[99] )
+    for i,C in enumerate(Cs):
+        traces = [ t[0] + 1j*t[1] for t in resps[i]['traces'] ]
+        for t,tref in zip(traces,cp1.t11_lambda_hol(L,C,contours=3)):
+            assert( abs(t-tref) < TESTDELTA )
+        assert( (resps[i]['rep'],resps[i]['nodes']) == cp1.classify(traces) )
+    assert( len(hs.cache) == len(Cs) )
+
+def test_server_classify_on_request():
+    L = 0.5
+    C = 0.05+0.05j
+    surface = ('lambda',complex(L))
+
+    async def run():
+        hs = server.HolonomyServer(threads=2)
+        res = await hs.holonomy(surface,C)
+        assert( res[2] is None and res[3] is None )
+        # Classification of the cached traces, when asked for
+        cres = await hs.holonomy(surface,C,classify=True)
+        assert( hs.cache.get((surface,C))[2] == cres[2] )
+        return res, cres
+
+    res, cres = asyncio.run(run())
+    assert( (cres[2],cres[3]) == cp1.classify(res[1]) )
+    for t,tref in zip(cres[1],res[1]):
+        assert( t == tref )
@@ -0,0 +1,150 @@
+import cp1
+import cp1.slice
+import pytest
+
+TESTDELTA = 0.00001
+
+def test_grid_points():
+    C = cp1.slice.grid_points(1.0j,0.5,(3,5))
+    assert( C.shape == (3,5) )
+    assert( abs(C[0,0] - (-0.5+1.5j)) < TESTDELTA )
+    assert( abs(C[1,2] - 1.0j) < TESTDELTA )
+    assert( abs(C[2,4] - (0.5+0.5j)) < TESTDELTA )
+
+@pytest.mark.parametrize( ("threads"), [1, 3])
+def test_classify_grid_lambda(threads):
+    L = 0.5
+    C = cp1.slice.grid_points(0.0,0.16,(4,4))
+    traces, rep, nodes = cp1.slice.classify_grid(L,0.0,0.16,(4,4),threads=threads)
+    for idx in [(0,0),(1,2),(3,3)]:
+        mt = cp1.t11_lambda_hol(L,C[idx])
+        d, n = cp1.classify(mt)
+        for t,tref in zip(traces[idx],mt):
+            assert( abs(t-tref) < TESTDELTA )
+        assert( rep[idx] == d )
+        assert( nodes[idx] == n )
+
+def test_classify_grid_tau():
+    tau = 0.5+0.866j
+    center = -0.57735026918962576451j
+    C = cp1.slice.grid_points(center,0.5,(3,3))
+    traces, rep, nodes = cp1.slice.classify_grid(tau,center,0.5,(3,3),param='tau',threads=2)
+    for idx in [(0,0),(1,1),(2,1)]:
+        mt = cp1.t11_tau_hol(tau,C[idx])
+        d, n = cp1.classify(mt)
+        for t,tref in zip(traces[idx],mt):
+            assert( abs(t-tref) < TESTDELTA )
+        assert( rep[idx] == d )
+
+@pytest.mark.parametrize( ("L","center","nsym"), [(0.5, 0.0, 4),
+                                                  (0.5 + 0.86602540378443864676j, -0.57735026918962576451j, 6)])
+def test_classify_grid_symmetry(L,center,nsym):
+    setup = cp1.slice._SliceSetup(L)
+    assert( len(cp1.slice.slice_symmetries(setup.L,setup.contours)) == nsym )
+    shape = (5,5)
+    traces, rep, nodes = cp1.slice.classify_grid(L,center,0.3,shape,threads=2)
+    ftraces, frep, fnodes = cp1.slice.classify_grid(L,center,0.3,shape,threads=2,symmetry=False)
+    assert( abs(traces-ftraces).max() < TESTDELTA )
+    assert( (rep == frep).all() )
+
+def test_classify_adaptive():
+    L = 0.5
+    C = cp1.slice.grid_points(0.0,0.16,(6,6))
+    traces, rep, nodes, tols = cp1.slice.classify_adaptive(L,C,tols=(1e-4,1e-9),threads=2)
+    ftraces, frep, fnodes = cp1.slice.classify_points(L,C,tol=1e-9,threads=2)
+    assert( tols.shape == C.shape )
+    assert( set(tols.ravel()) <= set([1e-4,1e-9]) )
+    assert( (tols == 1e-4).any() )
+    assert( (rep == frep).all() )
+    assert( abs(traces[tols == 1e-9] - ftraces[tols == 1e-9]).max() < TESTDELTA )
+    assert( cp1.near_threshold([[cp1.JORGENSEN_LIMIT,5,5],[5,5,5]]).tolist() == [True,False] )
+
+def test_classify_adaptive_stats():
+    L = 0.5
+    C = cp1.slice.grid_points(0.0,0.16,(3,3))
+    traces, rep, nodes, tols = cp1.slice.classify_adaptive(L,C,tols=(1e-4,1e-9),threads=1)
+    straces, srep, snodes, stols, cost = cp1.slice.classify_adaptive(L,C,tols=(1e-4,1e-9),
+                                                                     threads=1,stats=True)
+    assert( (srep == rep).all() and (stols == tols).all() )
+    assert( sorted(cost) == sorted(cp1.slice.slicekernel.COST_FIELDS) )
+    assert( (cost['accepted'] > 0).all() )
+    # Points recomputed with the tighter tolerance cost more
+    if (tols == 1e-9).any():
+        base = cp1.slice.classify_points(L,C,tol=1e-4,threads=1,stats=True)[3]
+        assert( (cost['accepted'][tols == 1e-9] > base['accepted'][tols == 1e-9]).all() )
+
+def test_classify_quadtree():
+    L = 0.5
+    shape = (9,9)
+    traces, rep, nodes = cp1.slice.classify_grid(L,0.0,0.16,shape,threads=2)
+    qrep, qnodes = cp1.slice.classify_quadtree(L,0.0,0.16,shape,cell=4,threads=2)
+    assert( qrep.shape == shape )
+    evaluated = (qnodes >= 0)
+    assert( evaluated[0,0] and evaluated[8,8] and evaluated[4,4] )
+    assert( (qrep[evaluated] == rep[evaluated]).all() )
+    assert( (qnodes[evaluated] == nodes[evaluated]).all() )
+
+def test_boundary():
+    L = 0.5
+    points, uncertain = cp1.slice.boundary(L,0.0,8,1e-3,radius=1.0,threads=2)
+    assert( points.shape == (8,) and uncertain.shape == (8,) )
+    ok = ~uncertain
+    assert( ok.any() )
+    inside = cp1.slice.classify_points(L,0.98*points[ok])[1]
+    outside = cp1.slice.classify_points(L,1.02*points[ok])[1]
+    assert( (inside == cp1.REP_DISCRETE).all() )
+    assert( (outside != cp1.REP_DISCRETE).all() )
+
+def test_classify_tiled(tmpdir):
+    L = 0.5
+    shape = (5,7)
+    d = str(tmpdir.join('slice'))
+    traces, rep, nodes = cp1.slice.classify_grid(L,0.0,0.16,shape,threads=2)
+    ttraces, trep, tnodes, complete = cp1.slice.classify_tiled(L,0.0,0.16,shape,d,tile=3,threads=2)
+    assert( complete )
+    assert( abs(ttraces - traces).max() < TESTDELTA )
+    assert( (trep == rep).all() and (tnodes == nodes).all() )
+    # Completed computation is loaded rather than repeated
+    ttraces, trep, tnodes, complete = cp1.slice.load_tiled(d)
+    assert( complete and (trep == rep).all() )
+    with pytest.raises(ValueError):
+        cp1.slice.classify_tiled(L,0.0,0.2,shape,d,tile=3)
+    for option in [ {'stats': True}, {'symmetry': False} ]:
+        with pytest.raises(TypeError):
+            cp1.slice.classify_tiled(L,0.0,0.16,shape,str(tmpdir.join('other')),tile=3,**option)
+
+class _Interrupt(Exception):
+    pass
+
+def test_classify_tiled_resume(tmpdir):
+    L = 0.5
+    shape = (5,7)
+    d = str(tmpdir.join('slice'))
+    traces, rep, nodes = cp1.slice.classify_grid(L,0.0,0.16,shape,threads=2)
+
+    def interrupt(done,total):
+        if done == 2:
+            raise _Interrupt()
+    with pytest.raises(_Interrupt):
+        cp1.slice.classify_tiled(L,0.0,0.16,shape,d,tile=3,threads=2,progress=interrupt)
+    ttraces, trep, tnodes, complete = cp1.slice.load_tiled(d)
+    assert( not complete )
+
+    # Only the remaining tiles are computed
+    calls = []
+    ttraces, trep, tnodes, complete = cp1.slice.classify_tiled(L,0.0,0.16,shape,d,tile=3,threads=2,
+                                                               progress=lambda done,total: calls.append(done))
+    assert( complete )
+    assert( calls == [3, 4, 5, 6] )
+    assert( abs(ttraces - traces).max() < TESTDELTA )
+    assert( (trep == rep).all() and (tnodes == nodes).all() )
+
+def test_classify_grid_stats():
+    L = 0.5
+    traces, rep, nodes = cp1.slice.classify_grid(L,0.0,0.16,(3,3),threads=1)
+    straces, srep, snodes, cost = cp1.slice.classify_grid(L,0.0,0.16,(3,3),threads=1,stats=True)
+    assert( (srep == rep).all() and (snodes == nodes).all() )
+    assert( sorted(cost) == sorted(cp1.slice.slicekernel.COST_FIELDS) )
+    assert( (cost['accepted'] > 0).all() )
+    assert( (cost['sinksteps'] + cost['treenodes'] == nodes).all() )
+    assert( (cost['time'] > 0).all() )
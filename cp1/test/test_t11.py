@@ -23,3 +23,36 @@ def test_t11_square():
     assert( abs(x-xref) < TESTDELTA)
     assert( abs(y-yref) < TESTDELTA)
     assert( abs(z-zref) < TESTDELTA)
+
+def test_t11_traces_many():
+    L = 0.5
+    Cs = [ 0.0, 0.05+0.05j ]
+    h = cp1.T11(L,contours=3)
+    tr = h.traces_many(Cs)
+    assert( tr.shape == (2,3) )
+    for C,row in zip(Cs,tr):
+        for t,tref in zip(row,h.traces(C)):
+            assert( abs(t-tref) < TESTDELTA)
+
+def test_t11_tau_hol_many():
+    taus = [ [0.5+0.86602540378443864676j, 1.0j], [3.0+1.0j, 0.2+0.5j] ]
+    res = cp1.t11_tau_hol_many(taus,0.0)
+    assert( res.shape == (2,2,3) )
+    for i in range(2):
+        for j in range(2):
+            for t,tref in zip(res[i,j],cp1.t11_tau_hol(taus[i][j],0.0)):
+                assert( abs(t-tref) < TESTDELTA)
+
+def test_t11_solve_C_for_trace():
+    L = 0.5 + 0.86602540378443864676j
+    Cref = -0.57735026918962576451j
+    C = cp1.t11_solve_C_for_trace(L,3.0,1,C0=-0.6j,contours=3,tol=1e-10)
+    assert( abs(C-Cref) < TESTDELTA )
+    traces, dtraces = cp1.T11(L,contours=3,tol=1e-10).trace_jacobian(C)
+    assert( abs(traces[1]-3.0) < TESTDELTA )
+    # Repeated solves at the same L reuse one cached T11 instance
+    cache = cp1.s04.instance_cache
+    misses = cache.misses
+    C = cp1.t11_solve_C_for_trace(L,3.0,1,C0=-0.55j,contours=3,tol=1e-10)
+    assert( abs(C-Cref) < TESTDELTA )
+    assert( cache.misses == misses )
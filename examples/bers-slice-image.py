@@ -16,12 +16,12 @@ def cplx_pp(z):
 
 # Support module built in-place (in ../cp1) or system-wide
 try:
-    from cp1 import (modularlambda, t11_tau_hol, classify, HolonomyException,
-                     REP_DISCRETE, REP_INDISCRETE, REP_UNCERTAIN)
+    from cp1 import (modularlambda, REP_DISCRETE, REP_INDISCRETE, REP_UNCERTAIN)
+    from cp1.slice import classify_tiled, classify_quadtree, HOLONOMY_FAILED
 except ImportError:
     sys.path.insert(0, '..')
-    from cp1 import (modularlambda, t11_tau_hol, classify, HolonomyException,
-                     REP_DISCRETE, REP_INDISCRETE, REP_UNCERTAIN)
+    from cp1 import (modularlambda, REP_DISCRETE, REP_INDISCRETE, REP_UNCERTAIN)
+    from cp1.slice import classify_tiled, classify_quadtree, HOLONOMY_FAILED
 
 try:
     from PIL import Image, ImageDraw
@@ -45,8 +45,14 @@ parser.add_argument('-r','--radius',type=float,default=0.5,
                     help='Radius of ths image')
 parser.add_argument('-s','--size',type=int,default=256,
                     help='Size of the image (NxN pixels, specify N)')
+parser.add_argument('-j','--threads',type=int,
+                    help='Number of worker threads (default is one per CPU)')
+parser.add_argument('-q','--quadtree',action='store_true',
+                    help='Only evaluate near the boundary of the discreteness locus (faster, approximate)')
 parser.add_argument('-o','--output',
                     help='Output filename (default is based on current time)')
+parser.add_argument('-d','--data',
+                    help='Directory for the raw results, used to resume an interrupted run (default is based on output filename)')
 
 args = parser.parse_args()
 
@@ -55,6 +61,9 @@ if args.output is None:
     args.output = 'bs%d.png' % int(time())
     print('Using output filename "%s"' % args.output)
 
+if args.data is None:
+    args.data = os.path.splitext(args.output)[0] + '-data'
+
 img = Image.new('RGB',(args.size, args.size + 70), (255,255,255))
 
 L = modularlambda(args.tau)
@@ -82,36 +91,43 @@ for line in lines:
 
 d.rectangle( [(0,0),(args.size-1,args.size-1)], fill=(180,180,180) )
 
-# Draw the slice
 pix = img.load()
+
+def draw_rows(j0,rep,nodes):
+    for j in range(rep.shape[0]):
+        for i in range(rep.shape[1]):
+            d = rep[j,i]
+            if d == REP_DISCRETE:
+                pix[i,j0+j] = (0,0,0)
+            elif d == REP_INDISCRETE:
+                k = min(max(int(nodes[j,i]),0),200)
+                pix[i,j0+j] = (255-k,255-k,255)
+            elif d == HOLONOMY_FAILED:
+                pix[i,j0+j] = (0,255,0)
+            else:
+                pix[i,j0+j] = (255,0,0)
+
+# Compute the slice, all at once with the quadtree method, or a tile at
+# a time into the data directory
+def report(done,total):
+    print('Tile %d of %d' % (done,total))
+
 try:
-    for j in range(args.size):
-        print('Row %d of %d' % (j+1,args.size))
-        for i in range(args.size):
-            tx = 2.0*(float(i)/(args.size-1)) - 1.0
-            ty = 1.0 - 2.0*(float(j)/(args.size-1))
-            C = args.center + tx*args.radius + 1j*ty*args.radius
-            try:
-                mt = t11_tau_hol(tau=args.tau, C=C)
-                d, n = classify(mt)
-                if d is REP_DISCRETE:
-                    pix[i,j] = (0,0,0)
-                elif d is REP_INDISCRETE:
-                    k = n
-                    if k > 200:
-                        k = 200
-                    pix[i,j] = (255-k,255-k,255)
-                else:
-                    pix[i,j] = (255,0,0)
-            except HolonomyException:
-                pix[i,j] = (0,255,0)
+    if args.quadtree:
+        rep, nodes = classify_quadtree(args.tau, args.center, args.radius, (args.size, args.size),
+                                       param='tau', threads=args.threads)
+    else:
+        print('Storing results in "%s"' % args.data)
+        traces, rep, nodes, complete = classify_tiled(args.tau, args.center, args.radius,
+                                                      (args.size, args.size), args.data,
+                                                      param='tau', threads=args.threads,
+                                                      progress=report)
 except KeyboardInterrupt:
-    print('Interrupted: Will try to write partial progress to file.')
-    pass
+    print('Interrupted: Run the same command again to resume.')
+    sys.exit(1)
+
+draw_rows(0,rep,nodes)
 
 # Write to a file
 print('Writing "%s"' % args.output)
 img.save(args.output)
-
-        
-        
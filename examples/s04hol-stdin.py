@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 '''Read re(lambda) im(lambda) re(C) im(C) tuples from stdin or file and compute holonomy'''
 
-# This example is mainly for benchmarking holonomy computation
+# This example is mainly for benchmarking holonomy computation; for
+# large inputs use "python -m cp1 hol", which reads the same format.
 
 from __future__ import print_function
 import os
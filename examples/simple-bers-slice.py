@@ -6,10 +6,12 @@ import os,sys
 
 # Support module built in-place (in ../cp1) or system-wide
 try:
-    from cp1 import t11_lambda_hol, classify, REP_DISCRETE, REP_INDISCRETE, REP_UNCERTAIN
+    from cp1 import REP_DISCRETE, REP_INDISCRETE, REP_UNCERTAIN
+    from cp1.slice import classify_grid
 except ImportError:
     sys.path.insert(0, '..')
-    from cp1 import t11_lambda_hol, classify, REP_DISCRETE, REP_INDISCRETE, REP_UNCERTAIN
+    from cp1 import REP_DISCRETE, REP_INDISCRETE, REP_UNCERTAIN
+    from cp1.slice import classify_grid
 
 xsize = 50
 ysize = 40
@@ -24,13 +26,11 @@ C0 = 0
 # Slightly larger than Bers embedding
 radius = 0.16
 
+traces, rep, nodes = classify_grid(L, C0, radius, (ysize,xsize))
+
 for j in range(ysize):
     for i in range(xsize):
-        tx = 2.0*(float(i)/(xsize-1)) - 1.0
-        ty = 1.0 - 2.0*(float(j)/(ysize-1))
-        C = C0 + tx*radius + 1j*ty*radius
-        mt = t11_lambda_hol(L=0.5, C=C)
-        d, n = classify(mt)
+        d = rep[j,i]
         if d == REP_DISCRETE:
             print('*',end='')
         elif d == REP_INDISCRETE:
@@ -44,12 +44,15 @@ cmdclass = { 'test': PyTest }
 ext_modules = [ ]
 
 if use_cython:
-    extension_sources = { 'pcint': [ 'cp1/pcint.pyx', 'cp1/gsl_odeiv.pxd', 'cp1/gsl_complex.pxd' ],
-                          'bowditch': [ 'cp1/bowditch.pyx', 'cp1/gsl_complex.pxd' ] }
+    extension_sources = { 'pcint': [ 'cp1/pcint.pyx', 'cp1/pcint.pxd', 'cp1/gsl_odeiv.pxd', 'cp1/gsl_complex.pxd' ],
+                          'bowditch': [ 'cp1/bowditch.pyx', 'cp1/bowditch.pxd', 'cp1/gsl_complex.pxd' ],
+                          'slicekernel': [ 'cp1/slicekernel.pyx', 'cp1/pcint.pxd', 'cp1/bowditch.pxd',
+                                           'cp1/gsl_odeiv.pxd', 'cp1/gsl_complex.pxd' ] }
     cmdclass.update({ 'build_ext': build_ext })
 else:
     extension_sources = { 'pcint': [ 'cp1/pcint.c' ],
-                          'bowditch': [ 'cp1/bowditch.c' ] }
+                          'bowditch': [ 'cp1/bowditch.c' ],
+                          'slicekernel': [ 'cp1/slicekernel.c' ] }
 
 gsl_info = get_gsl_info()
 
@@ -62,6 +65,10 @@ ext_modules += [
               include_dirs=gsl_info['inc_dirs'],
               library_dirs=gsl_info['lib_dirs'],
               libraries=gsl_info['libs']),
+    Extension('cp1.slicekernel', extension_sources['slicekernel'],
+              include_dirs=gsl_info['inc_dirs'],
+              library_dirs=gsl_info['lib_dirs'],
+              libraries=gsl_info['libs']),
     ]
 
 def readme():